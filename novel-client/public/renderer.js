@@ -4,9 +4,14 @@
 class NovelGenerator {
     constructor() {
         this.serverUrl = "http://localhost:5000";
+        this.sessionId = this.getWindowSessionId(); // 本窗口的会话ID（选中状态、当前项目按会话区分）
         this.selectedContexts = new Set();
         this.contexts = [];
         this.contextTree = [];
+        this.changeRevision = 0; // 已加载数据对应的变更序号（见 subscribeChanges）
+        this.detailItemPageSize = 200; // 详情中每次加载的条目数（条目较多时分页加载）
+        this.detailContextId = null;
+        this.detailItemsLoaded = 0;
         this.messages = [];
         
         // 树状图相关属性
@@ -68,11 +73,47 @@ class NovelGenerator {
         
         // 加载上下文
         await this.loadContexts();
+        
+        // 订阅服务器的上下文变更
+        this.subscribeChanges();
     
         // 更新UI状态
         this.updateUIState();
     }
     
+    // 订阅上下文变更（其他窗口、其他客户端的修改），有新变更时重新加载（未变化的数据由ETag返回304）
+    subscribeChanges() {
+        if (typeof EventSource === 'undefined' || this.changeSource) return;
+        // EventSource无法设置请求头，会话ID通过查询参数传递
+        this.changeSource = new EventSource(
+            `${this.serverUrl}/api/changes/stream?session=${encodeURIComponent(this.sessionId)}`);
+        this.changeSource.addEventListener('changes', (event) => {
+            const feed = JSON.parse(event.data);
+            // 本窗口刷新时已包含的变更不再重新加载
+            if (!feed.reset && (feed.changes.length === 0 || feed.revision <= this.changeRevision)) return;
+            clearTimeout(this.changeReloadTimer);
+            this.changeReloadTimer = setTimeout(() => this.loadContexts(), 300);
+        });
+    }
+    
+    // 每个窗口使用独立的会话（刷新页面时沿用），不与其他窗口共用默认会话
+    getWindowSessionId() {
+        let sessionId = sessionStorage.getItem('novelSessionId');
+        if (!sessionId) {
+            sessionId = window.crypto?.randomUUID?.() ||
+                `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+            sessionStorage.setItem('novelSessionId', sessionId);
+        }
+        return sessionId;
+    }
+    
+    // 发送请求时带上本窗口的会话ID
+    apiFetch(url, options = {}) {
+        const headers = new Headers(options.headers || {});
+        headers.set('X-Session-Id', this.sessionId);
+        return fetch(url, { ...options, headers });
+    }
+    
     bindEvents() {
         // 搜索框
         const searchInput = document.getElementById('searchInput');
@@ -370,7 +411,9 @@ bindContextMenuEvents() {
         
         try {
             // 首先尝试获取树状结构
-            const treeResponse = await fetch(`${this.serverUrl}/api/contexts/tree`);
+            const treeResponse = await this.apiFetch(`${this.serverUrl}/api/contexts/tree`);
+            const changeRevision = treeResponse.headers.get('X-Change-Revision');
+            if (changeRevision !== null) this.changeRevision = Number(changeRevision);
             if (treeResponse.ok) {
                 const treeData = await treeResponse.json();
                 console.log("📂 上下文树状结构数据:", treeData);
@@ -382,7 +425,7 @@ bindContextMenuEvents() {
                     this.renderTreeVisualization();
                     
                     // 同时加载普通列表用于左侧面板
-                    const listResponse = await fetch(`${this.serverUrl}/api/contexts`);
+                    const listResponse = await this.apiFetch(`${this.serverUrl}/api/contexts`);
                     if (listResponse.ok) {
                         this.contexts = await listResponse.json();
                         this.renderContexts();
@@ -392,7 +435,7 @@ bindContextMenuEvents() {
             }
             
             // 如果树状结构不可用，使用普通列表
-            const response = await fetch(`${this.serverUrl}/api/contexts`);
+            const response = await this.apiFetch(`${this.serverUrl}/api/contexts`);
             
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
@@ -808,13 +851,17 @@ clearSelection() {
         itemsContainer.innerHTML = '';
         
         try {
-            const response = await fetch(`${this.serverUrl}/api/context/${contextId}`);
+            // 只取条目（content 与 items 是同一组条目），条目较多时先加载第一页，其余通过"加载更多"获取
+            this.detailContextId = contextId;
+            const response = await this.apiFetch(`${this.serverUrl}/api/context/${contextId}` +
+                `?fields=name,type,created_at,updated_at,items,item_count&limit=${this.detailItemPageSize}`);
             
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
             }
             
             const context = await response.json();
+            context.content = context.items;
             console.log("📄 上下文详情:", context);
             
             // 显示基本信息
@@ -870,32 +917,18 @@ clearSelection() {
                     <div class="items-section">
                         <div class="section-header">
                             <h3><i class="fas fa-list"></i> 条目列表</h3>
-                            <span class="badge">${context.items.length} 个条目</span>
+                            <span class="badge" id="itemCountBadge"></span>
                         </div>
                         <div class="items-list">
-                `;
-                
-                for (const item of context.items) {
-                    const itemId = item.id || '未知';
-                    const itemContent = item.content || '无内容';
-                    const itemDate = this.formatDate(item.created_at || item.updated_at);
-                    
-                    itemsHtml += `
-                        <div class="item-card">
-                            <div class="item-header">
-                                <div class="item-title">条目 ${itemId}</div>
-                                <div class="item-date">${itemDate}</div>
-                            </div>
-                            <div class="item-content">${itemContent}</div>
-                        </div>
-                    `;
-                }
-                
-                itemsHtml += `
+                            ${context.items.map(item => this.renderItemCard(item)).join('')}
                         </div>
+                        <button class="btn btn-sm btn-outline-secondary" id="loadMoreItemsBtn"
+                                onclick="novelGenerator.loadMoreContextItems('${contextId}')">加载更多</button>
                     </div>
                 `;
                 itemsContainer.innerHTML = itemsHtml;
+                this.detailItemsLoaded = context.items.length;
+                this.updateItemPaging(context.item_count ?? context.items.length);
             } else if (context.content && Array.isArray(context.content)) {
                 // 如果content本身就是数组
                 let itemsHtml = `
@@ -949,6 +982,67 @@ clearSelection() {
         }
     }
     
+    renderItemCard(item) {
+        const itemId = item.id || '未知';
+        const itemContent = item.content || '无内容';
+        const itemDate = this.formatDate(item.created_at || item.updated_at);
+        
+        return `
+            <div class="item-card">
+                <div class="item-header">
+                    <div class="item-title">条目 ${itemId}</div>
+                    <div class="item-date">${itemDate}</div>
+                </div>
+                <div class="item-content">${itemContent}</div>
+            </div>
+        `;
+    }
+    
+    // 更新条目数量标记与"加载更多"按钮（未全部加载时显示已加载数量）
+    updateItemPaging(total) {
+        const badge = document.getElementById('itemCountBadge');
+        const loadMoreBtn = document.getElementById('loadMoreItemsBtn');
+        const truncated = this.detailItemsLoaded < total;
+        if (badge) {
+            badge.textContent = truncated ? `已显示 ${this.detailItemsLoaded} / ${total} 个条目` : `${total} 个条目`;
+        }
+        if (loadMoreBtn) {
+            loadMoreBtn.style.display = truncated ? '' : 'none';
+            loadMoreBtn.textContent = '加载更多';
+            loadMoreBtn.disabled = false;
+        }
+    }
+    
+    // 加载详情中的下一页条目
+    async loadMoreContextItems(contextId) {
+        const loadMoreBtn = document.getElementById('loadMoreItemsBtn');
+        if (loadMoreBtn) loadMoreBtn.disabled = true;
+        
+        try {
+            const response = await this.apiFetch(`${this.serverUrl}/api/context/${contextId}` +
+                `?fields=items,item_count&offset=${this.detailItemsLoaded}&limit=${this.detailItemPageSize}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const page = await response.json();
+            // 加载期间已切换到其他上下文
+            if (this.detailContextId !== contextId) return;
+            
+            const list = document.querySelector('#contextItems .items-list');
+            if (list) {
+                list.insertAdjacentHTML('beforeend', page.items.map(item => this.renderItemCard(item)).join(''));
+            }
+            this.detailItemsLoaded += page.items.length;
+            this.updateItemPaging(page.items.length > 0 ? page.item_count : this.detailItemsLoaded);
+        } catch (error) {
+            console.error("❌ 加载更多条目失败:", error);
+            if (loadMoreBtn) {
+                loadMoreBtn.textContent = '加载失败，点击重试';
+                loadMoreBtn.disabled = false;
+            }
+        }
+    }
+    
     updateSelectionCount() {
         const selectedCountElement = document.getElementById('selectedCount');
         if (selectedCountElement) {
@@ -1782,7 +1876,7 @@ clearSelection() {
             console.log("📤 发送编辑节点请求:", requestData);
             
             // 发送请求到后端
-            const response = await fetch(`${this.serverUrl}/api/context/${nodeId}`, {
+            const response = await this.apiFetch(`${this.serverUrl}/api/context/${nodeId}`, {
                 method: 'PUT',
                 headers: {
                     'Content-Type': 'application/json',
@@ -1866,7 +1960,7 @@ clearSelection() {
             console.log(`🌐 尝试获取节点详情: ${this.serverUrl}/api/context/${nodeId}`);
             
             // 获取节点详情
-            const response = await fetch(`${this.serverUrl}/api/context/${nodeId}`, {
+            const response = await this.apiFetch(`${this.serverUrl}/api/context/${nodeId}`, {
                 headers: {
                     'Accept': 'application/json',
                     'Cache-Control': 'no-cache'
@@ -2035,52 +2129,13 @@ clearSelection() {
         console.log("🗑️ 递归删除节点:", nodeId);
         
         try {
-            // 首先获取所有子节点ID
-            let childIds = [];
-            
-            // 尝试从树状结构获取子节点
-            if (this.contextTree && this.contextTree.length > 0) {
-                childIds = this.getAllChildNodeIds(nodeId, this.contextTree);
-            }
-            
-            // 如果从树状结构没找到，尝试从扁平列表获取
-            if (childIds.length === 0 && this.contexts && this.contexts.length > 0) {
-                childIds = this.getAllChildNodeIdsFromFlatList(nodeId);
-            }
-            
-            console.log("👶 需要删除的子节点数量:", childIds.length, "子节点ID:", childIds);
-            
-            // 先删除所有子节点（从最深层开始）
-            if (childIds.length > 0) {
-                console.log("🗑️ 开始删除子节点...");
-                
-                // 由于子节点可能也有子节点，我们需要确保正确的删除顺序
-                // 我们可以先删除所有子节点，因为API应该会处理级联删除
-                // 但为了安全起见，我们可以按层级删除
-                
-                // 简单实现：直接删除所有子节点
-                for (const childId of childIds) {
-                    console.log("🗑️ 删除子节点:", childId);
-                    try {
-                        const response = await fetch(`${this.serverUrl}/api/context/${childId}`, {
-                            method: 'DELETE'
-                        });
-                        
-                        if (!response.ok) {
-                            console.warn(`⚠️ 删除子节点 ${childId} 失败: HTTP ${response.status}`);
-                        } else {
-                            console.log("✅ 子节点删除成功:", childId);
-                        }
-                    } catch (error) {
-                        console.error(`❌ 删除子节点 ${childId} 失败:`, error);
-                    }
-                }
-            }
-            
-            // 最后删除父节点
-            console.log("🗑️ 删除父节点:", nodeId);
-            const response = await fetch(`${this.serverUrl}/api/context/${nodeId}`, {
-                method: 'DELETE'
+            // 节点及其全部子孙节点在一次批量请求中原子删除（服务端从最深层开始删除）
+            const response = await this.apiFetch(`${this.serverUrl}/api/contexts/batch`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    operations: [{ op: 'delete', context_id: nodeId, recursive: true }]
+                })
             });
             
             if (!response.ok) {
@@ -2088,7 +2143,7 @@ clearSelection() {
             }
             
             const result = await response.json();
-            console.log("✅ 父节点删除成功:", result);
+            console.log("✅ 节点删除成功:", result);
             
             return result;
             
@@ -3001,7 +3056,7 @@ clearSelection() {
         
         for (const contextId of contextIds) {
             try {
-                const response = await fetch(`${this.serverUrl}/api/context/${contextId}`);
+                const response = await this.apiFetch(`${this.serverUrl}/api/context/${contextId}?fields=name,type,content`);
                 if (response.ok) {
                     const context = await response.json();
                     // 只提取我们需要的信息：ID、名称、类型和内容
@@ -3618,7 +3673,7 @@ clearSelection() {
             console.log('发送AI生成请求:', requestData);
             
             // 发送请求到服务端
-            const response = await fetch(`${this.serverUrl}/api/ai/generate`, {
+            const response = await this.apiFetch(`${this.serverUrl}/api/ai/generate`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -3998,7 +4053,7 @@ clearSelection() {
             console.log('正在保存编辑器内容...');
             
             // 调用后端API保存内容
-            const response = await fetch(`${this.serverUrl}/api/context/create`, {
+            const response = await this.apiFetch(`${this.serverUrl}/api/context/create`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -4164,7 +4219,7 @@ clearSelection() {
             this.currentStreamingController = controller;
             
             // 发送流式请求
-            const response = await fetch(`${this.serverUrl}/api/context/create`, {
+            const response = await this.apiFetch(`${this.serverUrl}/api/context/create`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -1,7 +1,13 @@
+import time
 from typing import List, Optional, AsyncGenerator
 from langchain.agents import create_agent
 from langchain_openai import ChatOpenAI
-import json
+from llm_router import RoutedChatOpenAI
+import json_codec
+import metrics
+import tracing
+
+tracer = tracing.get_tracer(__name__)
 
 
 class AgentService:
@@ -29,6 +35,9 @@ class AgentService:
     @staticmethod
     def _create_agent_llm(llm) -> ChatOpenAI:
         """从现有LLM创建非流式LLM副本供agent使用"""
+        if isinstance(llm, RoutedChatOpenAI):
+            # 路由器本身非流式，且副本会丢失后端列表，直接复用
+            return llm
         if isinstance(llm, ChatOpenAI):
             # 提取api_key明文（openai_api_key是SecretStr类型，不能直接传给构造函数）
             api_key = llm.openai_api_key
@@ -39,10 +48,14 @@ class AgentService:
                 "api_key": api_key,
                 "model": llm.model_name,
                 "streaming": False,  # agent内部用ainvoke，必须关闭streaming
+                "max_retries": llm.max_retries,
             }
             if llm.temperature is not None:
                 kwargs["temperature"] = llm.temperature
-            return ChatOpenAI(**kwargs)
+            if llm.default_headers:
+                kwargs["default_headers"] = llm.default_headers
+            # 保留子类（如GovernedChatOpenAI），使agent调用同样经过限流器
+            return type(llm)(**kwargs)
         # 非ChatOpenAI类型，直接返回原对象
         return llm
 
@@ -54,141 +67,172 @@ class AgentService:
         return result["messages"][-1].content
 
     async def stream(self, user_input: str) -> AsyncGenerator[str, None]:
-        try:
-            stats = {
-                "input_tokens": 0,
-                "output_tokens": 0,
-                "total_tokens": 0,
-                "model_calls": 0,
-                "tool_calls": 0
-            }
-            processed_model_runs = set()
-
-            async for event in self.agent.astream_events(
-                {"messages": [("user", user_input)]},
-                version="v2"
-            ):
-                kind = event["event"]
-                metadata = event.get("metadata", {})
-                node_name = metadata.get("langgraph_node", "")
-                run_id = event.get("run_id", "")
-
-                try:
-                    # 1. 模型思考开始
-                    if kind == "on_chain_start" and node_name == "model":
-                        yield self._json("thought", status="thinking", content="🧠 正在思考中...")
-
-                    # 2. 流式AI内容（streaming=True时触发）
-                    elif kind == "on_chat_model_stream" and node_name == "model":
-                        chunk = event["data"].get("chunk")
-                        if chunk is None:
-                            continue
-                        content = getattr(chunk, 'content', None)
-                        tool_calls = getattr(chunk, 'tool_calls', None)
-
-                        if tool_calls:
-                            for tc in tool_calls:
-                                tc_name = getattr(tc, 'name', str(tc)) if hasattr(tc, 'name') else tc.get('name', '未知工具')
-                                yield self._json("thought", status="tool_start", content=f"🔧 决定调用工具: {tc_name}")
-                        elif content and isinstance(content, str) and content.strip():
-                            yield self._json("ai_message", content=content)
-                        elif isinstance(content, list):
-                            for item in content:
-                                if isinstance(item, dict) and item.get("type") == "text":
-                                    text = item.get("text", "")
-                                    if text.strip():
-                                        yield self._json("ai_message", content=text)
+        stats = {
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0,
+            "model_calls": 0,
+            "tool_calls": 0
+        }
+        start = time.perf_counter()
+        first_token_at = None
+        outcome = "cancelled"  # 客户端断开时生成器在中途关闭
+        span = tracer.start_span("agent.stream", {"agent.tools": len(self.tools), "prompt.length": len(user_input)})
+        # 生成期间设为当前span：模型调用与工具调用的span挂在它下面
+        with tracing.use_span(span, end_on_exit=True):
+            try:
+                processed_model_runs = set()
+
+                async for event in self.agent.astream_events(
+                    {"messages": [("user", user_input)]},
+                    version="v2"
+                ):
+                    kind = event["event"]
+                    metadata = event.get("metadata", {})
+                    node_name = metadata.get("langgraph_node", "")
+                    run_id = event.get("run_id", "")
+
+                    try:
+                        # 1. 模型思考开始
+                        if kind == "on_chain_start" and node_name == "model":
+                            yield self._json("thought", status="thinking", content="🧠 正在思考中...")
+
+                        # 2. 流式AI内容（streaming=True时触发）
+                        elif kind == "on_chat_model_stream" and node_name == "model":
+                            chunk = event["data"].get("chunk")
+                            if chunk is None:
+                                continue
+                            content = getattr(chunk, 'content', None)
+                            tool_calls = getattr(chunk, 'tool_calls', None)
 
-                    # 3. 模型调用结束（streaming=True时触发，提取token统计）
-                    elif kind == "on_chat_model_end" and node_name == "model":
-                        stats["model_calls"] += 1
-                        output_msg = event["data"].get("output")
-                        if output_msg:
-                            msg_content = getattr(output_msg, 'content', None)
-                            tool_calls = getattr(output_msg, 'tool_calls', None)
                             if tool_calls:
                                 for tc in tool_calls:
-                                    tc_name = getattr(tc, 'name', '未知工具') if hasattr(tc, 'name') else tc.get('name', '未知工具')
+                                    tc_name = getattr(tc, 'name', str(tc)) if hasattr(tc, 'name') else tc.get('name', '未知工具')
                                     yield self._json("thought", status="tool_start", content=f"🔧 决定调用工具: {tc_name}")
-                            elif msg_content and isinstance(msg_content, str) and msg_content.strip():
-                                # streaming=True时内容已通过stream事件发送，此处跳过避免重复
-                                pass
-                        self._extract_usage_from_message(stats, output_msg)
-                        yield self._json("stats", data={k: v for k, v in stats.items()})
-
-                    # 4. on_chain_end - model节点（streaming=False时的主要事件源）
-                    #    create_agent的model节点在streaming=False时，
-                    #    不触发on_chat_model_stream/on_chat_model_end，
-                    #    而是通过on_chain_end返回Command对象，内含AIMessage
-                    elif kind == "on_chain_end" and node_name == "model" and run_id not in processed_model_runs:
-                        processed_model_runs.add(run_id)
-                        output_data = event["data"].get("output")
-                        # 从Command列表中提取AIMessage
-                        messages = self._extract_messages_from_output(output_data)
-                        for msg in messages:
-                            msg_content = getattr(msg, 'content', None)
-                            msg_tool_calls = getattr(msg, 'tool_calls', None)
-                            if msg_tool_calls:
-                                for tc in msg_tool_calls:
-                                    tc_name = getattr(tc, 'name', '未知工具') if hasattr(tc, 'name') else tc.get('name', '未知工具')
-                                    yield self._json("thought", status="tool_start", content=f"🔧 决定调用工具: {tc_name}")
-                            else:
-                                # 先尝试从content提取
-                                text = self._extract_text_from_content(msg_content) if msg_content else ""
-                                # content为空时，尝试从reasoning字段提取（推理模型如tencent/hy3-preview）
-                                if not text:
-                                    text = self._extract_reasoning_from_message(msg)
-                                if text:
-                                    yield self._json("ai_message", content=text)
-                            # 提取token统计
-                            self._extract_usage_from_message(stats, msg)
-                        if messages:
+                            elif content and isinstance(content, str) and content.strip():
+                                first_token_at = first_token_at or time.perf_counter()
+                                yield self._json("ai_message", content=content)
+                            elif isinstance(content, list):
+                                for item in content:
+                                    if isinstance(item, dict) and item.get("type") == "text":
+                                        text = item.get("text", "")
+                                        if text.strip():
+                                            first_token_at = first_token_at or time.perf_counter()
+                                            yield self._json("ai_message", content=text)
+
+                        # 3. 模型调用结束（streaming=True时触发，提取token统计）
+                        elif kind == "on_chat_model_end" and node_name == "model":
                             stats["model_calls"] += 1
-                            yield self._json("stats", data={k: v for k, v in stats.items()})
-                        else:
-                            # 兜底：递归查找
-                            self._extract_usage_recursive(stats, output_data)
-
-                    # 5. 工具调用开始
-                    elif kind == "on_tool_start":
-                        stats["tool_calls"] += 1
-                        tool_input = event["data"].get("input", {})
-                        input_preview = self._safe_preview(tool_input)
-                        yield self._json("thought", status="tool_start", tool=event["name"],
-                                       content=f"🔧 调用工具: {event['name']}", input_preview=input_preview)
-
-                    # 6. 工具调用结束
-                    elif kind == "on_tool_end":
-                        output = event["data"].get("output")
-                        serializable = self._serialize_output(output)
-                        parsed = self._try_parse_json(serializable)
-                        yield self._json("thought", status="tool_end", tool=event["name"],
-                                       content=f"✅ 工具 '{event['name']}' 执行完成",
-                                       output=serializable, parsed_output=parsed)
-
-                except Exception as e:
-                    print(f"⚠️ 事件 {kind} 处理异常: {str(e)[:100]}")
-                    continue
-
-            # 完成总结
-            yield self._json("thought", status="complete", content=(
-                f"✅ 任务完成 | 模型调用: {stats['model_calls']} 次 | "
-                f"工具调用: {stats['tool_calls']} 次 | "
-                f"总消耗: {stats['total_tokens']} Tokens "
-                f"(输入: {stats['input_tokens']}, 输出: {stats['output_tokens']})"
-            ))
-
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            yield self._json("error", content=f"❌ 处理异常: {str(e)}")
+                            output_msg = event["data"].get("output")
+                            if output_msg:
+                                msg_content = getattr(output_msg, 'content', None)
+                                tool_calls = getattr(output_msg, 'tool_calls', None)
+                                if tool_calls:
+                                    for tc in tool_calls:
+                                        tc_name = getattr(tc, 'name', '未知工具') if hasattr(tc, 'name') else tc.get('name', '未知工具')
+                                        yield self._json("thought", status="tool_start", content=f"🔧 决定调用工具: {tc_name}")
+                                elif msg_content and isinstance(msg_content, str) and msg_content.strip():
+                                    # streaming=True时内容已通过stream事件发送，此处跳过避免重复
+                                    pass
+                            self._extract_usage_from_message(stats, output_msg)
+                            yield self._json("stats", data={k: v for k, v in stats.items()}, trace_id=span.trace_id)
+
+                        # 4. on_chain_end - model节点（streaming=False时的主要事件源）
+                        #    create_agent的model节点在streaming=False时，
+                        #    不触发on_chat_model_stream/on_chat_model_end，
+                        #    而是通过on_chain_end返回Command对象，内含AIMessage
+                        elif kind == "on_chain_end" and node_name == "model" and run_id not in processed_model_runs:
+                            processed_model_runs.add(run_id)
+                            output_data = event["data"].get("output")
+                            # 从Command列表中提取AIMessage
+                            messages = self._extract_messages_from_output(output_data)
+                            for msg in messages:
+                                msg_content = getattr(msg, 'content', None)
+                                msg_tool_calls = getattr(msg, 'tool_calls', None)
+                                if msg_tool_calls:
+                                    for tc in msg_tool_calls:
+                                        tc_name = getattr(tc, 'name', '未知工具') if hasattr(tc, 'name') else tc.get('name', '未知工具')
+                                        yield self._json("thought", status="tool_start", content=f"🔧 决定调用工具: {tc_name}")
+                                else:
+                                    # 先尝试从content提取
+                                    text = self._extract_text_from_content(msg_content) if msg_content else ""
+                                    # content为空时，尝试从reasoning字段提取（推理模型如tencent/hy3-preview）
+                                    if not text:
+                                        text = self._extract_reasoning_from_message(msg)
+                                    if text:
+                                        first_token_at = first_token_at or time.perf_counter()
+                                        yield self._json("ai_message", content=text)
+                                # 提取token统计
+                                self._extract_usage_from_message(stats, msg)
+                            if messages:
+                                stats["model_calls"] += 1
+                                yield self._json("stats", data={k: v for k, v in stats.items()}, trace_id=span.trace_id)
+                            else:
+                                # 兜底：递归查找
+                                self._extract_usage_recursive(stats, output_data)
+
+                        # 5. 工具调用开始
+                        elif kind == "on_tool_start":
+                            stats["tool_calls"] += 1
+                            span.add_event("tool_start", {"tool": event["name"]})
+                            tool_input = event["data"].get("input", {})
+                            input_preview = self._safe_preview(tool_input)
+                            yield self._json("thought", status="tool_start", tool=event["name"],
+                                           content=f"🔧 调用工具: {event['name']}", input_preview=input_preview)
+
+                        # 6. 工具调用结束
+                        elif kind == "on_tool_end":
+                            span.add_event("tool_end", {"tool": event["name"]})
+                            output = event["data"].get("output")
+                            serializable = self._serialize_output(output)
+                            parsed = self._try_parse_json(serializable)
+                            yield self._json("thought", status="tool_end", tool=event["name"],
+                                           content=f"✅ 工具 '{event['name']}' 执行完成",
+                                           output=serializable, parsed_output=parsed)
+
+                    except Exception as e:
+                        print(f"⚠️ 事件 {kind} 处理异常: {str(e)[:100]}")
+                        continue
+
+                # 完成总结
+                yield self._json("thought", status="complete", content=(
+                    f"✅ 任务完成 | 模型调用: {stats['model_calls']} 次 | "
+                    f"工具调用: {stats['tool_calls']} 次 | "
+                    f"总消耗: {stats['total_tokens']} Tokens "
+                    f"(输入: {stats['input_tokens']}, 输出: {stats['output_tokens']})"
+                ))
+                outcome = "ok"
+
+            except Exception as e:
+                outcome = "error"
+                span.record_exception(e)
+                import traceback
+                traceback.print_exc()
+                yield self._json("error", content=f"❌ 处理异常: {str(e)}")
+            finally:
+                self._record_metrics(stats, start, first_token_at, outcome)
+                span.set_attributes({f"agent.{key}": value for key, value in stats.items()})
+                span.set_attribute("agent.outcome", outcome)
+                if outcome == "error":
+                    span.set_status(tracing.ERROR)
 
     # ========== 辅助方法 ==========
 
+    def _record_metrics(self, stats: dict, start: float, first_token_at: Optional[float], outcome: str):
+        """记录一次生成的耗时、首段内容耗时与token用量"""
+        provider, model = metrics.llm_labels(self.llm)
+        metrics.LLM_GENERATION_DURATION.observe(time.perf_counter() - start, provider=provider, model=model,
+                                                outcome=outcome)
+        if first_token_at is not None:
+            metrics.LLM_TIME_TO_FIRST_TOKEN.observe(first_token_at - start, provider=provider, model=model)
+        metrics.LLM_MODEL_CALLS.inc(stats["model_calls"], provider=provider, model=model)
+        metrics.LLM_TOKENS.inc(stats["input_tokens"], provider=provider, model=model, kind="input")
+        metrics.LLM_TOKENS.inc(stats["output_tokens"], provider=provider, model=model, kind="output")
+
     @staticmethod
     def _json(type_: str, **kwargs) -> str:
         """构建标准JSON事件"""
-        return json.dumps({"type": type_, **kwargs}, ensure_ascii=False)
+        return json_codec.dumps({"type": type_, **kwargs})
 
     @staticmethod
     def _safe_preview(tool_input, max_len: int = 120) -> str:
@@ -197,7 +241,7 @@ class AgentService:
             if isinstance(tool_input, dict):
                 safe = {k: v for k, v in tool_input.items()
                        if not any(x in k.lower() for x in ["password", "token", "secret", "key"])}
-                preview = json.dumps(safe, ensure_ascii=False, indent=None)
+                preview = json_codec.dumps(safe)
             else:
                 preview = str(tool_input)
             return preview[:max_len] + "..." if len(preview) > max_len else preview
@@ -211,7 +255,7 @@ class AgentService:
             if hasattr(output, 'content'):
                 return output.content
             if isinstance(output, (dict, list)):
-                return json.dumps(output, ensure_ascii=False, indent=2)
+                return json_codec.dumps(output, pretty=True)
             return str(output)
         except Exception:
             return "[工具返回内容]"
@@ -221,8 +265,8 @@ class AgentService:
         """尝试解析JSON字符串"""
         if isinstance(s, str):
             try:
-                return json.loads(s)
-            except (json.JSONDecodeError, TypeError):
+                return json_codec.loads(s)
+            except (json_codec.JSONDecodeError, TypeError):
                 pass
         return None
 
@@ -0,0 +1,84 @@
+"""
+HTML解析后端基准测试
+对 fixtures/fanqie 下的页面（详情页、扩展到数千章的目录页、章节页）
+比较各可用解析后端的吞吐量，并校验各后端的提取结果一致
+
+用法: python benchmarks/bench_html_parsing.py [--toc-size 3000] [--rounds 20]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+from html_backends import BACKENDS, available_backends  # noqa: E402
+
+FIXTURE_DIR = os.path.join(SERVICE_DIR, "fixtures", "fanqie")
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def build_large_toc(detail_html: str, size: int) -> str:
+    """把详情页的目录扩展到指定章节数（模拟长篇完整目录页）"""
+    items = re.findall(r'\s*<div class="chapter-item">.*?</div>', detail_html)
+    template = items[0]
+    generated = "".join(template.replace("/reader/700001", f"/reader/9{i:06d}")
+                                .replace("第1章", f"第{i}章")
+                        for i in range(1, size + 1))
+    return detail_html.replace("".join(items), generated)
+
+
+def bench(func, html: str, rounds: int) -> float:
+    """返回每页平均耗时（毫秒）"""
+    func(html)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(html)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--toc-size", type=int, default=3000, help="目录页章节数")
+    arg_parser.add_argument("--rounds", type=int, default=20, help="每项测试的重复次数")
+    args = arg_parser.parse_args()
+
+    detail = load_fixture("detail.html")
+    chapter = load_fixture("chapter.html")
+    toc = build_large_toc(detail, args.toc_size)
+    pages = [
+        ("详情页", "extract_detail", detail),
+        (f"目录页({args.toc_size}章)", "extract_toc", toc),
+        ("章节页", "extract_chapter", chapter),
+    ]
+
+    names = available_backends()
+    backends = {name: BACKENDS[name]() for name in names}
+    print(f"可用后端: {', '.join(names)}")
+
+    # 结果一致性校验（以bs4为基准）
+    reference = backends.get("bs4")
+    if reference:
+        for label, method, html in pages:
+            expected = getattr(reference, method)(html)
+            for name, backend in backends.items():
+                if getattr(backend, method)(html) != expected:
+                    print(f"[⚠️] {name} 在{label}上的提取结果与bs4不一致")
+
+    print(f"\n{'页面':<16}{'后端':<12}{'毫秒/页':>10}{'页/秒':>10}{'加速比':>8}")
+    for label, method, html in pages:
+        timings = {name: bench(getattr(backend, method), html, args.rounds) for name, backend in backends.items()}
+        baseline = timings.get("bs4")
+        for name, ms in timings.items():
+            speedup = f"{baseline / ms:.1f}x" if baseline else "-"
+            print(f"{label:<16}{name:<12}{ms:>10.2f}{1000 / ms:>10.1f}{speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
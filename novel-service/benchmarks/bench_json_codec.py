@@ -0,0 +1,121 @@
+"""
+JSON编解码基准测试
+在临时数据目录中生成一棵上下文树，分别使用 orjson 与标准库 json（json_codec 的两种实现）测量：
+- GET /api/contexts/tree 端到端耗时（经ASGI测试客户端，含路由、依赖与响应序列化）
+- 保存全部上下文文件与管理器启动加载的耗时
+- 流式事件的编码与解析耗时
+另列出改动前的响应方式（jsonable_encoder + 标准库JSONResponse）作为基线
+
+用法: python benchmarks/bench_json_codec.py [--contexts 2000] [--items 5] [--rounds 20]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# 在临时目录中导入，避免模块级全局实例读写仓库中的 context_data
+_workdir = tempfile.mkdtemp(prefix="context_json_")
+os.chdir(_workdir)
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import json_codec  # noqa: E402
+import web_api  # noqa: E402
+from context_manager import AdvancedContextManager, ContextType, advanced_context_manager  # noqa: E402
+
+TYPES = [ContextType.OUTLINE, ContextType.EVENTS, ContextType.CHARACTER, ContextType.CUSTOM]
+
+
+def build_tree(manager: AdvancedContextManager, count: int, items: int, seed: int):
+    """生成随机的上下文树（每个节点带若干条目）"""
+    rng = random.Random(seed)
+    ids = []
+    for i in range(count):
+        parent_id = rng.choice(ids) if ids and rng.random() < 0.9 else None
+        context_id = manager.create_context(f"节点{i}", rng.choice(TYPES), "", parent_id=parent_id)
+        for j in range(items):
+            manager.add_context_item(context_id, f"第{j}条：" + "剧情推进与人物刻画。" * rng.randint(5, 40))
+        ids.append(context_id)
+    manager.flush()
+
+
+def timed(func, rounds: int) -> float:
+    """返回平均耗时（毫秒）"""
+    func()  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def bench_codec(label: str, use_orjson: bool, client: TestClient, manager: AdvancedContextManager,
+                rounds: int) -> dict:
+    json_codec.HAS_ORJSON = use_orjson
+    events = [json_codec.dumps({"type": "ai_message", "content": "生成的文本" * 20})] * 1000
+    snapshots = [(manager._get_context_filepath(cid, ctx.type), ctx.to_dict()) for cid, ctx in manager.contexts.items()]
+
+    def save_all():
+        for filepath, data in snapshots:
+            AdvancedContextManager._dump_json(filepath, data)
+
+    def load_all():
+        AdvancedContextManager(manager.data_dir, shared=False).close()
+
+    return {
+        "label": label,
+        "tree": timed(lambda: client.get("/api/contexts/tree").content, rounds),
+        "save": timed(save_all, max(1, rounds // 4)),
+        "load": timed(load_all, max(1, rounds // 4)),
+        "events": timed(lambda: [json_codec.loads(json_codec.dumps(json_codec.loads(e))) for e in events], rounds),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--contexts", type=int, default=2000, help="上下文数量")
+    arg_parser.add_argument("--items", type=int, default=5, help="每个上下文的条目数")
+    arg_parser.add_argument("--rounds", type=int, default=20, help="每项测试的重复次数")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    manager = advanced_context_manager
+    build_tree(manager, args.contexts, args.items, args.seed)
+    client = TestClient(web_api.app)
+    orjson_available = json_codec.HAS_ORJSON
+
+    tree = manager.get_context_tree()
+    payload = {"success": True, "tree": tree, "count": len(tree)}
+    size = len(json_codec.dumps_bytes(payload))
+    print(f"上下文 {len(manager.contexts)} 个，树响应 {size / 1024:.0f}KB；orjson: {'可用' if orjson_available else '不可用'}")
+
+    baseline = timed(lambda: JSONResponse(jsonable_encoder(payload)).body, args.rounds)
+    print(f"\n改动前的响应序列化（jsonable_encoder + json）: {baseline:.2f}ms")
+
+    results = [bench_codec("json", False, client, manager, args.rounds)]
+    if orjson_available:
+        results.append(bench_codec("orjson", True, client, manager, args.rounds))
+    json_codec.HAS_ORJSON = orjson_available
+
+    print(f"\n{'实现':<10}{'树接口ms':>12}{'保存ms':>12}{'加载ms':>12}{'千条事件ms':>14}")
+    for result in results:
+        print(f"{result['label']:<10}{result['tree']:>12.2f}{result['save']:>12.2f}"
+              f"{result['load']:>12.2f}{result['events']:>14.2f}")
+    if len(results) == 2:
+        slow, fast = results
+        print(f"{'加速比':<10}" + "".join(f"{slow[key] / fast[key]:>{width}.1f}x"
+                                       for key, width in (("tree", 11), ("save", 11), ("load", 11), ("events", 13))))
+    manager.close()
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
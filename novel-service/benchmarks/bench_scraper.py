@@ -0,0 +1,137 @@
+"""
+番茄抓取链路基准测试（离线）
+启动 fanqie_standin 替身服务器，把 fanqie_tool 的请求重定向到替身，依次测量：
+- novel_tool 冷启动（强制刷新，含字体解码）与命中缓存
+- 整本抓取（FanqieCrawler，有限并发 + 每主机最小请求间隔）
+输出每秒页数、解析耗时，并校验解码后的正文与明文fixture一致
+
+用法: python benchmarks/bench_scraper.py [--latency 0.02] [--toc-size 200] [--concurrency 4] [--interval 0.0]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fanqie_standin import FIXTURE_DIR, FanqieStandIn  # noqa: E402
+
+BOOK_URL = "https://fanqienovel.com/page/7000000000000000001"
+
+
+def timed_backend(backend, timings):
+    """包装解析后端的提取方法，累计解析耗时"""
+    for method in ("extract_detail", "extract_toc", "extract_chapter"):
+        original = getattr(backend, method)
+
+        def wrapper(html, _original=original, _method=method):
+            start = time.perf_counter()
+            try:
+                return _original(html)
+            finally:
+                timings[_method].append(time.perf_counter() - start)
+
+        setattr(backend, method, wrapper)
+
+
+def report(label: str, pages: int, elapsed: float, timings):
+    parse_total = sum(sum(values) for values in timings.values())
+    print(f"{label:<20}{pages:>6} 页{elapsed:>9.2f}s{pages / elapsed if elapsed else 0:>10.1f} 页/秒"
+          f"   解析 {parse_total * 1000:>8.1f}ms")
+    for method, values in sorted(timings.items()):
+        print(f"{'':<20}  {method:<16}{len(values):>5} 次  平均 {sum(values) / len(values) * 1000:.2f}ms")
+    timings.clear()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--latency", type=float, default=0.02, help="替身服务器的每请求延迟（秒）")
+    arg_parser.add_argument("--jitter", type=float, default=0.01, help="替身服务器的随机延迟上限（秒）")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="替身服务器返回503的比例")
+    arg_parser.add_argument("--toc-size", type=int, default=200, help="目录章节数")
+    arg_parser.add_argument("--max-chapters", type=int, default=None, help="最多抓取的章节数")
+    arg_parser.add_argument("--concurrency", type=int, default=4, help="章节抓取并发数")
+    arg_parser.add_argument("--interval", type=float, default=0.0, help="每主机最小请求间隔（秒）")
+    arg_parser.add_argument("--backend", default=None, help="指定HTML解析后端")
+    args = arg_parser.parse_args()
+
+    standin = FanqieStandIn(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            toc_size=args.toc_size, seed=42).start()
+
+    # 在临时目录中运行，缓存、断点与上下文数据不会写入仓库
+    workdir = tempfile.mkdtemp(prefix="fanqie_bench_")
+    os.chdir(workdir)
+    os.environ["FANQIE_BASE_URL"] = standin.base_url
+    os.environ["FANQIE_CACHE_ROOT"] = os.path.join(workdir, "cache")
+    os.environ["FANQIE_GLYPH_TABLE"] = os.path.join(workdir, "glyphs.json")
+    if args.backend:
+        os.environ["FANQIE_HTML_BACKEND"] = args.backend
+
+    import fanqie_tool
+    from fanqie_crawler import FanqieCrawler
+
+    fanqie_tool.http_client.per_host_interval = args.interval
+    fanqie_tool.http_client.per_host_concurrency = max(args.concurrency, 1)
+    if standin.font_bytes:
+        fanqie_tool.font_decoder.reference.learn(standin.font_bytes, standin.mapping)
+
+    timings = defaultdict(list)
+    timed_backend(fanqie_tool.html_backend, timings)
+    print(f"替身服务器: {standin.base_url}  解析后端: {fanqie_tool.html_backend.name}  工作目录: {workdir}\n")
+
+    # novel_tool：冷启动与命中缓存
+    start = time.perf_counter()
+    cold = fanqie_tool.novel_tool.invoke({"url": BOOK_URL, "force_refresh": True})
+    report("novel_tool 冷启动", standin.requests, time.perf_counter() - start, timings)
+    requests_before = standin.requests
+    start = time.perf_counter()
+    rounds = 50
+    for _ in range(rounds):
+        fanqie_tool.novel_tool.invoke({"url": BOOK_URL})
+    report("novel_tool 命中缓存", rounds, time.perf_counter() - start, timings)
+    print(f"{'':<20}  缓存命中期间的上游请求: {standin.requests - requests_before}")
+
+    # 整本抓取
+    crawler = FanqieCrawler(concurrency=args.concurrency)
+    requests_before = standin.requests
+    counts = defaultdict(int)
+
+    async def run_crawl():
+        async for event in crawler.crawl(BOOK_URL, max_chapters=args.max_chapters):
+            counts[event["type"]] += 1
+            if event["type"] == "crawl_error":
+                print(f"[⚠️] 抓取失败: {event['error']}")
+
+    start = time.perf_counter()
+    asyncio.run(run_crawl())
+    report("整本抓取", standin.requests - requests_before, time.perf_counter() - start, timings)
+    print(f"{'':<20}  成功 {counts['chapter_done']} 章，失败 {counts['chapter_error']} 章，"
+          f"注入错误 {standin.errors} 次")
+
+    # 正确性校验：解码后的详情与正文应与明文fixture一致
+    problems = []
+    if "长夜余火" not in str(cold):
+        problems.append("详情页标题解码不正确")
+    with open(os.path.join(FIXTURE_DIR, "chapter.html"), "r", encoding="utf-8") as f:
+        plain_paragraphs = fanqie_tool.html_backend.extract_chapter(f.read())[1]
+    parser = fanqie_tool.FanqieNovelParser()
+    chapter = parser.parse_chapter("https://fanqienovel.com/reader/7000001")
+    expected = "\n".join(p for p in (parser._clean_text(p) for p in plain_paragraphs) if p)
+    if chapter.get("content") != expected:
+        problems.append("章节正文解码后与明文fixture不一致")
+    if any(0xE000 <= ord(ch) <= 0xF8FF for ch in str(cold) + chapter.get("content", "")):
+        problems.append("结果中残留PUA字符")
+    print("\n校验: " + ("通过" if not problems else "；".join(problems)))
+
+    standin.stop()
+    fanqie_tool.scrape_executor.shutdown(wait=False)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+上下文存储格式基准测试
+把样本数据目录（默认 context_data）中的上下文文件与blob分别按各存储格式写入临时目录，比较：
+- 磁盘占用（上下文文件与blob分开统计，按文件系统块计的实际占用另列）
+- 保存耗时：序列化并原子写入全部文件
+- 加载耗时：读取并解析全部文件，以及管理器启动加载整个分片（含条目正文还原）
+同时校验各格式读回的数据与样本一致
+
+用法: python benchmarks/bench_storage_format.py [--data-dir context_data] [--rounds 5]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+DEFAULT_SAMPLE_DIR = os.path.join(SERVICE_DIR, "context_data")
+
+_cwd = os.getcwd()
+# 在临时目录中导入，避免模块级全局实例读写仓库中的 context_data
+_workdir = tempfile.mkdtemp(prefix="context_format_")
+os.chdir(_workdir)
+
+import storage_format  # noqa: E402
+from blob_store import BLOBS_SUBDIR, BlobStore  # noqa: E402
+from context_manager import AdvancedContextManager  # noqa: E402
+
+
+def read_sample(data_dir: str) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """读取样本：{相对路径: 上下文数据}（含其他项目分片）、{哈希: blob正文}"""
+    contexts, blobs = {}, {}
+    for root, dirs, files in os.walk(data_dir):
+        if os.path.basename(root) == BLOBS_SUBDIR:
+            dirs[:] = []
+            store = BlobStore(os.path.dirname(root))
+            blobs.update((digest, store.get(digest)) for digest in store.iter_digests())
+            continue
+        for filename in files:
+            if not filename.endswith(".json") or filename.startswith("project_"):
+                continue
+            filepath = os.path.join(root, filename)
+            try:
+                contexts[os.path.relpath(filepath, data_dir)] = storage_format.load_file(filepath)
+            except (OSError, ValueError) as e:
+                print(f"[⚠️] 跳过无法解析的文件 {filepath}: {e}", file=sys.stderr)
+    return contexts, blobs
+
+
+def disk_usage(paths: List[str]) -> Tuple[int, int]:
+    """(文件字节数, 按块计的实际占用)"""
+    size = allocated = 0
+    for path in paths:
+        stat = os.stat(path)
+        size += stat.st_size
+        allocated += getattr(stat, "st_blocks", 0) * 512 or stat.st_size
+    return size, allocated
+
+
+def bench_format(fmt: str, contexts: Dict[str, Dict], blobs: Dict[str, str], rounds: int) -> Dict:
+    target = tempfile.mkdtemp(prefix=f"{fmt}_", dir=_workdir)
+    paths = [os.path.join(target, relpath) for relpath in contexts]
+
+    save_times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for path, data in zip(paths, contexts.values()):
+            AdvancedContextManager._dump_json(path, data, fmt)
+        save_times.append(time.perf_counter() - start)
+
+    store = BlobStore(target, fmt)
+    for digest, text in blobs.items():
+        store.put(digest, text)
+
+    load_times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        loaded = [storage_format.load_file(path) for path in paths]
+        load_times.append(time.perf_counter() - start)
+    if loaded != list(contexts.values()):
+        print(f"[⚠️] {fmt} 读回的上下文与样本不一致")
+    if any(store.get(digest) != text for digest, text in blobs.items()):
+        print(f"[⚠️] {fmt} 读回的blob与样本不一致")
+
+    startup_times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        manager = AdvancedContextManager(target, shared=False, file_format=fmt)
+        startup_times.append(time.perf_counter() - start)
+        manager.close()
+
+    result = {
+        "files": disk_usage(paths),
+        "blobs": disk_usage([store.path(digest) for digest in blobs]),
+        "save": min(save_times),
+        "load": min(load_times),
+        "startup": min(startup_times),
+    }
+    shutil.rmtree(target, ignore_errors=True)
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--data-dir", default=DEFAULT_SAMPLE_DIR, help="样本数据目录")
+    arg_parser.add_argument("--rounds", type=int, default=5, help="每项测试的重复次数（取最快一次）")
+    args = arg_parser.parse_args()
+
+    contexts, blobs = read_sample(os.path.join(_cwd, args.data_dir))
+    if not contexts:
+        print(f"❌ 样本目录中没有上下文文件: {args.data_dir}")
+        sys.exit(1)
+    formats = [fmt for fmt in storage_format.FORMATS if fmt != storage_format.ZSTD or storage_format.HAS_ZSTD]
+    print(f"样本: {len(contexts)} 个上下文文件，{len(blobs)} 个blob；格式: {', '.join(formats)}")
+
+    results = {fmt: bench_format(fmt, contexts, blobs, args.rounds) for fmt in formats}
+    baseline = results[storage_format.PRETTY]
+    print(f"\n{'格式':<10}{'文件KB':>10}{'占用KB':>10}{'比例':>8}{'blobKB':>10}"
+          f"{'保存ms':>10}{'读取ms':>10}{'启动ms':>10}")
+    for fmt, result in results.items():
+        size, allocated = result["files"]
+        ratio = size / baseline["files"][0] if baseline["files"][0] else 0
+        print(f"{fmt:<10}{size / 1024:>10.1f}{allocated / 1024:>10.1f}{ratio:>8.0%}{result['blobs'][0] / 1024:>10.1f}"
+              f"{result['save'] * 1000:>10.2f}{result['load'] * 1000:>10.2f}{result['startup'] * 1000:>10.2f}")
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+番茄小说离线替身服务器
+用 fixtures/fanqie 下录制的页面模拟详情页、目录与章节页，支持：
+- 按请求的书籍ID/章节ID改写标题，目录可扩展到任意章节数
+- 字体反爬：把正文中的常用字替换为PUA码位，并提供对应的web字体（需要fontTools）
+- 可配置的延迟（含抖动）与错误注入（按比例返回503）
+
+用法: python benchmarks/fanqie_standin.py --port 8900 --latency 0.05 --error-rate 0.02
+配合服务使用: FANQIE_BASE_URL=http://127.0.0.1:8900 python web_api.py
+"""
+import argparse
+import io
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(SERVICE_DIR, "fixtures", "fanqie")
+
+# 被混淆的常用字（番茄的反爬字体同样只替换高频字）
+OBFUSCATED_CHARS = "的一是了我不人在他有这个上们来到时大地为中你说着那和要出也得里后以会可下过天去能看起没只手声音身远处正车"
+PUA_BASE = 0xE3E8
+FONT_PATH = "/font/standin.ttf"
+_TOC_ITEM_RE = re.compile(r'\s*<div class="chapter-item">.*?</div>')
+
+
+def build_obfuscation_font(chars: str) -> bytes:
+    """生成反爬字体：每个PUA码位对应一个轮廓唯一的字形"""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    def outline(k: int):
+        pen = TTGlyphPen(None)
+        pen.moveTo((0, 0))
+        pen.lineTo((100 + 7 * k, 0))
+        pen.lineTo((50 + 3 * k, 200 + 11 * k))
+        pen.closePath()
+        return pen.glyph()
+
+    names = [".notdef"] + [f"g{i}" for i in range(len(chars))]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({PUA_BASE + i: f"g{i}" for i in range(len(chars))})
+    glyphs = {".notdef": TTGlyphPen(None).glyph()}
+    glyphs.update({f"g{i}": outline(i) for i in range(len(chars))})
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (1000, 0) for name in names})
+    builder.setupHorizontalHeader(ascent=880, descent=-120)
+    builder.setupNameTable({"familyName": "StandIn", "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    buffer = io.BytesIO()
+    builder.save(buffer)
+    return buffer.getvalue()
+
+
+class FanqieStandIn:
+    """离线替身服务器（在后台线程运行）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, toc_size: int = 120,
+                 obfuscate: bool = True, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+        with open(os.path.join(FIXTURE_DIR, "detail.html"), "r", encoding="utf-8") as f:
+            detail = f.read()
+        with open(os.path.join(FIXTURE_DIR, "chapter.html"), "r", encoding="utf-8") as f:
+            self.chapter_template = f.read()
+        self.detail_template = self._expand_toc(detail, toc_size)
+
+        # 字体反爬：码位 -> 真实字符
+        self.mapping: Dict[int, str] = {}
+        self.font_bytes = b""
+        if obfuscate:
+            try:
+                self.font_bytes = build_obfuscation_font(OBFUSCATED_CHARS)
+                self.mapping = {PUA_BASE + i: char for i, char in enumerate(OBFUSCATED_CHARS)}
+            except ImportError:
+                print("[⚠️] fontTools不可用，替身服务器不启用字体混淆")
+        self._obfuscate_table = {ord(char): chr(cp) for cp, char in self.mapping.items()}
+
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @staticmethod
+    def _expand_toc(detail: str, size: int) -> str:
+        items = _TOC_ITEM_RE.findall(detail)
+        generated = []
+        for i in range(1, size + 1):
+            item = items[(i - 1) % len(items)]
+            item = re.sub(r'/reader/\d+', f'/reader/{7000000 + i}', item)
+            item = re.sub(r'第\d+章', f'第{i}章', item)
+            if i <= 40:
+                item = item.replace('<span class="chapter-item-lock"></span>', '')
+            elif 'chapter-item-lock' not in item:
+                item = item.replace('</a></div>', '</a><span class="chapter-item-lock"></span></div>')
+            generated.append(item)
+        return detail.replace("".join(items), "".join(generated))
+
+    def _obfuscate(self, html: str) -> str:
+        """替换正文中的常用字为PUA码位，并注入@font-face"""
+        if not self.mapping:
+            return html
+        head, sep, body = html.partition("<body>")
+        body = body.translate(self._obfuscate_table)
+        style = f'<style>@font-face{{font-family:"StandIn";src:url("{FONT_PATH}") format("truetype");}}</style>'
+        return head.replace("</head>", style + "</head>") + sep + body
+
+    def render(self, path: str):
+        """返回 (状态码, Content-Type, 内容)"""
+        if path == FONT_PATH and self.font_bytes:
+            return 200, "font/ttf", self.font_bytes
+        match = re.fullmatch(r"/page/(\d+)", path)
+        if match:
+            return 200, "text/html; charset=utf-8", self._obfuscate(self.detail_template).encode("utf-8")
+        match = re.fullmatch(r"/reader/(\d+)", path)
+        if match:
+            index = int(match.group(1)) - 7000000
+            html = self.chapter_template.replace("第1章", f"第{index}章")
+            return 200, "text/html; charset=utf-8", self._obfuscate(html).encode("utf-8")
+        return 404, "text/plain; charset=utf-8", b"not found"
+
+    def _make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                standin.requests += 1
+                delay = standin.latency + standin.random.uniform(0, standin.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                if standin.error_rate and standin.random.random() < standin.error_rate:
+                    standin.errors += 1
+                    status, content_type, body = 503, "text/plain; charset=utf-8", b"injected error"
+                else:
+                    status, content_type, body = standin.render(self.path.split("?", 1)[0])
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FanqieStandIn":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8900)
+    arg_parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    arg_parser.add_argument("--jitter", type=float, default=0.0, help="额外的随机延迟上限（秒）")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的比例")
+    arg_parser.add_argument("--toc-size", type=int, default=120, help="目录章节数")
+    arg_parser.add_argument("--no-obfuscate", action="store_true", help="关闭字体混淆")
+    args = arg_parser.parse_args()
+
+    standin = FanqieStandIn(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                            args.toc_size, not args.no_obfuscate)
+    print(f"🚀 番茄替身服务器: {standin.base_url} （详情页示例: /page/7000000000000000001）")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+上下文存储并发压力测试
+在临时数据目录中，用多个线程（模拟同步调用方）与多个协程（模拟Web层的异步接口）
+并发地创建、移动、删除、更新上下文，结束后校验：
+- 树结构一致：父节点的children与子节点的parent_id互相对应，且不存在环
+- 落盘一致：每个上下文文件都是完整的JSON，且与内存中的版本号、子节点一致
+- 乐观并发：基于同一版本的并发更新只有一个成功，其余得到冲突
+
+用法: python benchmarks/stress_context_store.py [--threads 8] [--tasks 8] [--ops 300] [--seed 1]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# 在临时目录中导入，避免模块级全局实例读写仓库中的 context_data
+_workdir = tempfile.mkdtemp(prefix="context_stress_")
+os.chdir(_workdir)
+
+import storage_format  # noqa: E402
+from context_manager import AdvancedContextManager, ContextConflictError, ContextType  # noqa: E402
+
+TYPES = [ContextType.OUTLINE, ContextType.EVENTS, ContextType.CHARACTER, ContextType.CUSTOM]
+
+
+def random_op(manager: AdvancedContextManager, rng: random.Random, counts: Counter):
+    """执行一次随机的同步操作"""
+    ids = list(manager.contexts)
+    op = rng.choice(["create", "create", "move", "delete", "update", "add_item"])
+    try:
+        if op == "create" or not ids:
+            parent_id = rng.choice(ids) if ids and rng.random() < 0.8 else None
+            manager.create_context(f"节点{rng.randrange(10 ** 6)}", rng.choice(TYPES), "内容", parent_id=parent_id)
+        elif op == "move":
+            new_parent = rng.choice(ids + [None])
+            counts["move_rejected"] += not manager.move_context(rng.choice(ids), new_parent)
+        elif op == "delete":
+            manager.delete_context(rng.choice(ids))
+        elif op == "update":
+            context_id = rng.choice(ids)
+            context = manager.get_context(context_id)
+            if context:
+                # 使用可能已过期的版本号，冲突是预期结果
+                manager.update_context(context_id, f"更新{rng.random()}", expected_revision=context.revision)
+        else:
+            manager.add_context_item(rng.choice(ids), f"条目{rng.random()}")
+        counts[op] += 1
+    except ContextConflictError:
+        counts["conflict"] += 1
+    except ValueError:
+        # 上下文已被其他调用方删除
+        counts["vanished"] += 1
+
+
+async def random_async_op(manager: AdvancedContextManager, rng: random.Random, counts: Counter):
+    """执行一次随机的异步操作（Web层路径）"""
+    ids = list(manager.contexts)
+    op = rng.choice(["create", "move", "delete", "patch"])
+    try:
+        if op == "create" or not ids:
+            parent_id = rng.choice(ids) if ids and rng.random() < 0.8 else None
+            await manager.acreate_context(f"异步节点{rng.randrange(10 ** 6)}", rng.choice(TYPES), "内容",
+                                          parent_id=parent_id)
+        elif op == "move":
+            counts["move_rejected"] += not await manager.amove_context(rng.choice(ids), rng.choice(ids + [None]))
+        elif op == "delete":
+            await manager.adelete_context(rng.choice(ids))
+        else:
+            context_id = rng.choice(ids)
+            context = manager.get_context(context_id)
+            if context:
+                await manager.apatch_context(context_id, name=f"改名{rng.random()}", context_type=rng.choice(TYPES),
+                                             expected_revision=context.revision)
+        counts["async_" + op] += 1
+    except ContextConflictError:
+        counts["conflict"] += 1
+    except ValueError:
+        counts["vanished"] += 1
+
+
+def check_conflicts(manager: AdvancedContextManager, writers: int) -> int:
+    """基于同一版本并发更新同一上下文，返回成功次数（应为1）"""
+    context_id = manager.create_context("冲突测试", ContextType.CUSTOM, "初始")
+    revision = manager.get_context(context_id).revision
+    barrier = threading.Barrier(writers)
+    successes = []
+
+    def writer(n: int):
+        barrier.wait()
+        try:
+            manager.update_context(context_id, f"写入者{n}", expected_revision=revision)
+            successes.append(n)
+        except ContextConflictError:
+            pass
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(successes)
+
+
+def verify(manager: AdvancedContextManager) -> list:
+    """校验内存树结构与磁盘文件"""
+    problems = []
+    contexts = manager.contexts
+    for context_id, context in contexts.items():
+        for child_id in context.children:
+            child = contexts.get(child_id)
+            if child is None:
+                problems.append(f"{context_id} 的子节点 {child_id} 不存在")
+            elif child.parent_id != context_id:
+                problems.append(f"{child_id} 在 {context_id} 的children中，但parent_id为 {child.parent_id}")
+        parent = contexts.get(context.parent_id) if context.parent_id else None
+        if parent is not None and context_id not in parent.children:
+            problems.append(f"{context_id} 不在父节点 {parent.id} 的children中")
+        # 环检测
+        seen, current = set(), context
+        while current is not None and current.parent_id:
+            if current.id in seen:
+                problems.append(f"{context_id} 的祖先链存在环")
+                break
+            seen.add(current.id)
+            current = contexts.get(current.parent_id)
+
+    on_disk = {}
+    for root, _, files in os.walk(manager.data_dir):
+        for filename in files:
+            if not filename.endswith(".json") or filename.startswith("project_"):
+                continue
+            filepath = os.path.join(root, filename)
+            try:
+                data = storage_format.load_file(filepath)
+            except ValueError as e:
+                problems.append(f"文件损坏 {filepath}: {e}")
+                continue
+            if data["id"] in on_disk:
+                problems.append(f"{data['id']} 存在多个文件")
+            on_disk[data["id"]] = data
+    for context_id, context in contexts.items():
+        data = on_disk.get(context_id)
+        if data is None:
+            problems.append(f"{context_id} 没有落盘")
+        elif data.get("revision") != context.revision or data.get("children") != context.children:
+            problems.append(f"{context_id} 磁盘版本 {data.get('revision')} 与内存版本 {context.revision} 不一致")
+    for context_id in set(on_disk) - set(contexts):
+        problems.append(f"已删除的 {context_id} 仍有文件")
+    return problems
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--threads", type=int, default=8, help="同步调用线程数")
+    arg_parser.add_argument("--tasks", type=int, default=8, help="异步调用协程数")
+    arg_parser.add_argument("--ops", type=int, default=300, help="每个线程/协程的操作次数")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    manager = AdvancedContextManager(os.path.join(_workdir, "stress_data"))
+    counts = Counter()
+    counts_lock = threading.Lock()
+
+    def thread_worker(n: int):
+        rng = random.Random(args.seed * 1000 + n)
+        local = Counter()
+        for _ in range(args.ops):
+            random_op(manager, rng, local)
+        with counts_lock:
+            counts.update(local)
+
+    async def async_workers():
+        async def worker(n: int):
+            rng = random.Random(args.seed * 1000 + 500 + n)
+            local = Counter()
+            for _ in range(args.ops):
+                await random_async_op(manager, rng, local)
+            with counts_lock:
+                counts.update(local)
+        await asyncio.gather(*(worker(n) for n in range(args.tasks)))
+
+    start = time.perf_counter()
+    # 删除上下文时的日志输出量很大，压测期间屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=thread_worker, args=(n,)) for n in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        asyncio.run(async_workers())
+        for thread in threads:
+            thread.join()
+        manager.flush()
+    elapsed = time.perf_counter() - start
+
+    total = (args.threads + args.tasks) * args.ops
+    print(f"数据目录: {manager.data_dir}")
+    print(f"{total} 次操作，耗时 {elapsed:.2f}s（{total / elapsed:.0f} 次/秒），剩余上下文 {len(manager.contexts)} 个")
+    print("操作统计: " + ", ".join(f"{name}={count}" for name, count in sorted(counts.items())))
+
+    winners = check_conflicts(manager, writers=16)
+    manager.flush()
+    problems = verify(manager)
+    if winners != 1:
+        problems.append(f"基于同一版本的16个并发更新中有 {winners} 个成功（应为1个）")
+    print("\n校验: " + ("通过" if not problems else f"{len(problems)} 个问题"))
+    for problem in problems[:20]:
+        print(f"  - {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
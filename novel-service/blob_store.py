@@ -0,0 +1,240 @@
+"""
+内容寻址的文本存储
+按内容的SHA-256存放在 <数据目录>/_blobs/<前两位>/<哈希>.txt，相同内容只存一份
+节点 metadata.context_info 中引用的上下文全文存放在这里，节点文件只保留引用：
+    {"context_id": 引用的上下文ID, "item_id": 条目ID（可选）, "type": 类型, "hash": 内容哈希, "size": 字符数}
+较长的条目正文同样存放在这里，条目在文件中只保留 content_ref（内容哈希）；
+内存中由 TextStore 按哈希共享同一份正文并维护引用计数，collect_garbage 清理不再被引用的内容
+blob按上下文文件的存储格式写入（gzip/zstd时压缩），读取时按文件头识别（见 storage_format）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+import storage_format
+
+BLOBS_SUBDIR = "_blobs"
+
+
+class BlobStore:
+    """内容寻址的文本存储（写入幂等，多进程同时写入同一内容也安全）"""
+
+    def __init__(self, data_dir: str, fmt: str = storage_format.PRETTY):
+        self.root = os.path.join(data_dir, BLOBS_SUBDIR)
+        self.fmt = fmt
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.txt")
+
+    def put(self, digest: str, text: str):
+        """写入内容（已存在时只刷新修改时间：重新被引用的旧blob同样享有清理的宽限期）"""
+        filepath = self.path(digest)
+        try:
+            os.utime(filepath)
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        temp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(storage_format.encode_text(text, self.fmt))
+        os.replace(temp_path, filepath)
+
+    def get(self, digest: str) -> Optional[str]:
+        try:
+            with open(self.path(digest), "rb") as f:
+                return storage_format.decode_text(f.read())
+        except FileNotFoundError:
+            return None
+
+    def remove(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def iter_digests(self) -> Iterator[str]:
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if os.path.isdir(prefix_dir):
+                for filename in os.listdir(prefix_dir):
+                    if filename.endswith(".txt"):
+                        yield filename[:-len(".txt")]
+
+
+def needs_compaction(context_info: Any) -> bool:
+    """context_info 中是否还有内嵌全文的条目"""
+    return isinstance(context_info, list) and any(isinstance(e, dict) and "content" in e for e in context_info)
+
+
+def compact_context_info(context_info: List[Any], put: Callable[[str, str], None]) -> List[Dict]:
+    """把内嵌全文的 context_info 条目转换为引用（全文交给 put(哈希, 内容) 写入），重复的引用只保留一个"""
+    refs = []
+    seen = set()
+    for entry in context_info:
+        if not isinstance(entry, dict):
+            continue
+        if "content" in entry:
+            content = entry["content"]
+            text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+            digest = BlobStore.digest(text)
+            ref = {"context_id": entry.get("context_id", entry.get("id")), "type": entry.get("type"),
+                   "hash": digest, "size": len(text)}
+            if entry.get("item_id"):
+                ref["item_id"] = entry["item_id"]
+            put(digest, text)
+        else:
+            ref = entry
+        key = (ref.get("context_id"), ref.get("hash"))
+        if key in seen:
+            continue
+        seen.add(key)
+        refs.append(ref)
+    return refs
+
+
+def resolve_context_info(context_info: List[Any], store: BlobStore) -> List[Dict]:
+    """把引用还原为 {id, type, content}（与客户端提交的格式一致），缺失的内容为空字符串"""
+    resolved = []
+    for entry in context_info or []:
+        if not isinstance(entry, dict):
+            continue
+        if "hash" in entry and "content" not in entry:
+            item = {"id": entry.get("context_id"), "type": entry.get("type"),
+                    "content": store.get(entry["hash"]) or ""}
+            if entry.get("item_id"):
+                item["item_id"] = entry["item_id"]
+            resolved.append(item)
+        else:
+            resolved.append(entry)
+    return resolved
+
+
+class TextStore:
+    """
+    条目正文的内容寻址表：相同正文在内存中只保留一个对象，按上下文维护引用计数，
+    计数归零的正文从表中移除（磁盘上的blob由 collect_garbage 清理）
+    """
+
+    # 短于此长度的正文直接内嵌在上下文文件中（避免大量小文件）
+    INLINE_LIMIT = 256
+
+    def __init__(self, blobs: BlobStore):
+        self.blobs = blobs
+        self._texts: Dict[str, str] = {}  # 哈希 -> 正文
+        self._digests: Dict[str, str] = {}  # 正文 -> 哈希（同一对象的查找不重复计算哈希）
+        self._refs: Counter = Counter()
+        self._owners: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def digest(self, text: str) -> str:
+        digest = self._digests.get(text)
+        return digest if digest is not None else BlobStore.digest(text)
+
+    def intern(self, text: str) -> str:
+        """返回与 text 内容相同的共享对象"""
+        with self._lock:
+            digest = self.digest(text)
+            canonical = self._texts.setdefault(digest, text)
+            self._digests[canonical] = digest
+            return canonical
+
+    def load(self, digest: str) -> Optional[str]:
+        """按哈希获取正文（表中没有时从blob存储读取）"""
+        text = self._texts.get(digest)
+        if text is None:
+            text = self.blobs.get(digest)
+            if text is None:
+                return None
+            text = self.intern(text)
+        return text
+
+    def set_refs(self, owner: str, refs: Counter) -> Set[str]:
+        """
+        更新某个上下文引用的正文（哈希 -> 次数），计数归零的正文从表中移除
+        返回该上下文新增引用的哈希（调用方需确保这些正文已写入blob存储）
+        """
+        with self._lock:
+            old = self._owners.pop(owner, Counter())
+            if refs:
+                self._owners[owner] = refs
+            self._refs.update(refs)
+            self._refs.subtract(old)
+            for digest in old:
+                if self._refs[digest] <= 0:
+                    del self._refs[digest]
+                    text = self._texts.pop(digest, None)
+                    if text is not None:
+                        self._digests.pop(text, None)
+            return set(refs) - set(old)
+
+    def reset(self):
+        with self._lock:
+            self._texts.clear()
+            self._digests.clear()
+            self._refs.clear()
+            self._owners.clear()
+
+    def stats(self) -> Dict:
+        """去重统计：唯一正文数量与字符数、引用次数"""
+        return {
+            "unique_texts": len(self._texts),
+            "unique_chars": sum(len(text) for text in self._texts.values()),
+            "references": sum(self._refs.values())
+        }
+
+
+def referenced_digests(data: Dict) -> Set[str]:
+    """上下文文件数据中引用的blob哈希（条目正文与 context_info）"""
+    digests = set()
+    for item in data.get("content") or []:
+        if isinstance(item, dict) and item.get("content_ref"):
+            digests.add(item["content_ref"])
+    metadata = data.get("metadata")
+    if isinstance(metadata, dict) and isinstance(metadata.get("context_info"), list):
+        digests.update(entry["hash"] for entry in metadata["context_info"]
+                       if isinstance(entry, dict) and entry.get("hash"))
+    return digests
+
+
+def collect_garbage(store: BlobStore, context_files: List[str], grace_seconds: float = 3600.0) -> Dict:
+    """
+    删除不再被任何上下文文件引用的blob（以磁盘上的文件为准，多worker部署下同样适用）
+    修改时间在 grace_seconds 内的blob保留：引用它的上下文文件可能尚未落盘
+    """
+    referenced = set()
+    for filepath in context_files:
+        try:
+            referenced |= referenced_digests(storage_format.load_file(filepath))
+        except (OSError, ValueError):
+            # 无法确认引用时不做清理
+            return {"removed": 0, "freed_bytes": 0, "kept": None, "error": f"无法读取 {filepath}"}
+    removed = freed = kept = 0
+    cutoff = time.time() - grace_seconds
+    for digest in list(store.iter_digests()):
+        if digest in referenced:
+            kept += 1
+            continue
+        filepath = store.path(digest)
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime > cutoff:
+            kept += 1
+            continue
+        store.remove(digest)
+        removed += 1
+        freed += stat.st_size
+    return {"removed": removed, "freed_bytes": freed, "kept": kept}
+
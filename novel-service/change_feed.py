@@ -0,0 +1,54 @@
+"""
+上下文变更日志
+每个项目分片维护一个单调递增的变更序号（分片的数据版本），每次修改记录一条：
+    {"seq": 序号, "op": created/updated/moved/deleted, "context_id": 上下文ID, "revision": 上下文版本号}
+客户端记住最后处理的序号，之后只拉取增量（GET /api/changes?since=序号 或 SSE订阅）
+单进程时存放在内存中（重启后从头计数，epoch变化），多worker部署时即 shared_store 的 changes 表（两者接口一致）；
+落后超出保留范围或 epoch 不一致时返回 reset，客户端需要重新获取完整的树
+"""
+import threading
+import uuid
+from collections import deque
+from typing import Dict, List, Tuple
+
+CREATED = "created"
+UPDATED = "updated"
+MOVED = "moved"
+DELETED = "deleted"
+
+# 旧版本 changes 表中的操作名
+LEGACY_OPS = {"save": UPDATED, "delete": DELETED}
+
+# 保留的变更条数
+CHANGE_LOG_RETENTION = 10000
+
+
+class MemoryChangeLog:
+    """进程内的变更日志（只保留最近的 retention 条）"""
+
+    def __init__(self, retention: int = CHANGE_LOG_RETENTION):
+        self.epoch = uuid.uuid4().hex[:12]
+        self._entries: deque = deque(maxlen=retention)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def record_change(self, context_id: str, op: str, revision: int) -> int:
+        with self._lock:
+            self._seq += 1
+            self._entries.append({"seq": self._seq, "op": op, "context_id": context_id, "revision": revision})
+            return self._seq
+
+    def latest_change(self) -> int:
+        return self._seq
+
+    def changes_since(self, since: int, limit: int) -> Tuple[List[Dict], bool]:
+        """返回 (序号大于 since 的变更，最多 limit 条, 是否需要重新获取完整数据)"""
+        with self._lock:
+            if since > self._seq:
+                return [], True
+            oldest = self._entries[0]["seq"] if self._entries else self._seq + 1
+            if oldest > since + 1:
+                return [], True
+            # 序号连续，直接按偏移定位
+            start = since + 1 - oldest
+            return [dict(self._entries[i]) for i in range(start, min(start + limit, len(self._entries)))], False
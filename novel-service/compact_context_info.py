@@ -0,0 +1,134 @@
+"""
+上下文数据压缩工具（一次性）
+把上下文文件 metadata.context_info 中内嵌的引用全文改写为内容寻址的blob引用（见 blob_store），
+处理数据目录与 projects/ 下的所有项目分片，包括旧版本直接放在数据目录根下的文件
+改写文件时服务不能同时运行；--gc 同时清理不再被引用的blob；
+--format 把所有上下文文件改写为指定的存储格式（见 storage_format，未指定时保持各文件原有格式）
+
+用法: python compact_context_info.py [--data-dir context_data] [--dry-run] [--gc] [--format gzip]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Iterator, List, Optional
+
+import storage_format
+from blob_store import BLOBS_SUBDIR, BlobStore, collect_garbage, compact_context_info, needs_compaction
+
+PROJECTS_SUBDIR = "projects"
+
+
+def shard_dirs(data_dir: str) -> Iterator[str]:
+    """default 分片（数据目录本身）与各项目分片"""
+    yield data_dir
+    projects_root = os.path.join(data_dir, PROJECTS_SUBDIR)
+    if os.path.isdir(projects_root):
+        for name in sorted(os.listdir(projects_root)):
+            if os.path.isdir(os.path.join(projects_root, name)):
+                yield os.path.join(projects_root, name)
+
+
+def context_files(shard_dir: str) -> List[str]:
+    result = []
+    for root, dirs, files in os.walk(shard_dir):
+        if root == shard_dir:
+            dirs[:] = [d for d in dirs if d not in (PROJECTS_SUBDIR, BLOBS_SUBDIR)]
+        for filename in files:
+            if filename.endswith(".json") and not (root == shard_dir and filename.startswith("project_")):
+                result.append(os.path.join(root, filename))
+    return result
+
+
+def load_seconds(files: List[str]) -> float:
+    """解析全部文件的耗时（近似启动加载耗时）"""
+    start = time.perf_counter()
+    for filepath in files:
+        try:
+            storage_format.load_file(filepath)
+        except (OSError, ValueError):
+            pass
+    return time.perf_counter() - start
+
+
+def compact_shard(shard_dir: str, dry_run: bool, fmt: Optional[str] = None) -> dict:
+    store = BlobStore(shard_dir, fmt or storage_format.PRETTY)
+    files = context_files(shard_dir)
+    stats = {"files": len(files), "rewritten": 0, "before": 0, "after": 0, "blobs": set(),
+             "load_before": load_seconds(files)}
+    for filepath in files:
+        size = os.path.getsize(filepath)
+        stats["before"] += size
+        try:
+            with open(filepath, "rb") as f:
+                raw = f.read()
+            data = storage_format.loads(raw)
+        except (OSError, ValueError) as e:
+            print(f"[⚠️] 跳过无法解析的文件 {filepath}: {e}", file=sys.stderr)
+            stats["after"] += size
+            continue
+        metadata = data.get("metadata") if isinstance(data, dict) else None
+        compact = isinstance(metadata, dict) and needs_compaction(metadata.get("context_info"))
+        if not compact and fmt is None:
+            stats["after"] += size
+            continue
+
+        def put(digest: str, text: str):
+            stats["blobs"].add(digest)
+            if not dry_run:
+                store.put(digest, text)
+
+        if compact:
+            metadata["context_info"] = compact_context_info(metadata["context_info"], put)
+        serialized = storage_format.dumps(data, fmt or storage_format.detect_format(raw))
+        stats["after"] += len(serialized)
+        if serialized == raw:
+            continue
+        stats["rewritten"] += 1
+        if not dry_run:
+            temp_path = filepath + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(serialized)
+            os.replace(temp_path, filepath)
+    stats["load_after"] = stats["load_before"] if dry_run else load_seconds(files)
+    stats["blob_bytes"] = sum(os.path.getsize(store.path(d)) for d in stats["blobs"] if os.path.exists(store.path(d)))
+    return stats
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--data-dir", default="context_data", help="上下文数据目录")
+    arg_parser.add_argument("--dry-run", action="store_true", help="只统计，不改写文件")
+    arg_parser.add_argument("--gc", action="store_true", help="清理不再被引用的blob")
+    arg_parser.add_argument("--format", choices=storage_format.FORMATS, help="改写为指定的存储格式")
+    args = arg_parser.parse_args()
+    fmt = storage_format.resolve_format(args.format) if args.format else None
+
+    if not os.path.isdir(args.data_dir):
+        print(f"❌ 数据目录不存在: {args.data_dir}")
+        sys.exit(1)
+
+    total_before = total_after = total_blob_bytes = 0
+    for shard_dir in shard_dirs(args.data_dir):
+        stats = compact_shard(shard_dir, args.dry_run, fmt)
+        total_before += stats["before"]
+        total_after += stats["after"]
+        total_blob_bytes += stats["blob_bytes"]
+        print(f"📁 {shard_dir}: {stats['files']} 个文件，改写 {stats['rewritten']} 个，"
+              f"{stats['before'] / 1024:.1f}KB -> {stats['after'] / 1024:.1f}KB，"
+              f"引用内容 {len(stats['blobs'])} 份，"
+              f"解析耗时 {stats['load_before'] * 1000:.1f}ms -> {stats['load_after'] * 1000:.1f}ms")
+        if args.gc and not args.dry_run:
+            # 服务已停止，不需要保留最近写入的blob
+            result = collect_garbage(BlobStore(shard_dir), context_files(shard_dir), grace_seconds=0)
+            if "error" in result:
+                print(f"[⚠️] 跳过清理: {result['error']}", file=sys.stderr)
+            else:
+                print(f"   🧹 清理blob {result['removed']} 个（{result['freed_bytes'] / 1024:.1f}KB），保留 {result['kept']} 个")
+
+    print(f"\n{'[预览] ' if args.dry_run else ''}上下文文件合计 {total_before / 1024:.1f}KB -> {total_after / 1024:.1f}KB"
+          f"（另有blob {total_blob_bytes / 1024:.1f}KB）")
+
+
+if __name__ == "__main__":
+    main()
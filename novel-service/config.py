@@ -15,6 +15,7 @@ class ServerConfig:
     host: str = "localhost"
     port: int = 5000
     debug: bool = False
+    workers: int = 1  # uvicorn worker进程数，大于1时上下文存储切换为多进程共享模式
     cors_origins: list = field(default_factory=lambda: ["*"])
     
     @property
@@ -72,6 +73,8 @@ class NovelGenerationConfig:
     default_length: int = 1000
     max_length: int = 5000
     min_length: int = 100
+    batch_concurrency: int = 4  # 批量生成时的最大并发模型调用数
+    batch_rate_limit: float = 2.0  # 批量生成时每秒最多发起的模型调用数（<=0表示不限速）
     supported_styles: list = field(default_factory=lambda: [
         "奇幻", "科幻", "武侠", "言情", "悬疑", "历史", "现代"
     ])
@@ -103,6 +106,8 @@ class ConfigManager:
             self.server.port = int(os.getenv("SERVER_PORT"))
         if os.getenv("DEBUG"):
             self.server.debug = os.getenv("DEBUG").lower() == "true"
+        if os.getenv("SERVER_WORKERS"):
+            self.server.workers = int(os.getenv("SERVER_WORKERS"))
         
         # AI配置
         if os.getenv("AI_API_KEY"):
@@ -144,6 +149,7 @@ class ConfigManager:
             self.server.host = server_data.get("host", self.server.host)
             self.server.port = server_data.get("port", self.server.port)
             self.server.debug = server_data.get("debug", self.server.debug)
+            self.server.workers = server_data.get("workers", self.server.workers)
             if "cors_origins" in server_data:
                 self.server.cors_origins = server_data["cors_origins"]
         
@@ -187,6 +193,8 @@ class ConfigManager:
             self.novel_generation.default_length = novel_data.get("default_length", self.novel_generation.default_length)
             self.novel_generation.max_length = novel_data.get("max_length", self.novel_generation.max_length)
             self.novel_generation.min_length = novel_data.get("min_length", self.novel_generation.min_length)
+            self.novel_generation.batch_concurrency = novel_data.get("batch_concurrency", self.novel_generation.batch_concurrency)
+            self.novel_generation.batch_rate_limit = novel_data.get("batch_rate_limit", self.novel_generation.batch_rate_limit)
             if "supported_styles" in novel_data:
                 self.novel_generation.supported_styles = novel_data["supported_styles"]
     
@@ -197,6 +205,7 @@ class ConfigManager:
                 "host": self.server.host,
                 "port": self.server.port,
                 "debug": self.server.debug,
+                "workers": self.server.workers,
                 "cors_origins": self.server.cors_origins
             },
             "ai": {
@@ -229,6 +238,8 @@ class ConfigManager:
                 "default_length": self.novel_generation.default_length,
                 "max_length": self.novel_generation.max_length,
                 "min_length": self.novel_generation.min_length,
+                "batch_concurrency": self.novel_generation.batch_concurrency,
+                "batch_rate_limit": self.novel_generation.batch_rate_limit,
                 "supported_styles": self.novel_generation.supported_styles
             }
         }
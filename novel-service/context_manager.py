@@ -1,15 +1,45 @@
 """
 高级上下文管理器
 支持多种上下文类型、多选、文件存储
+文件写入由存储专用线程按提交顺序执行，内存修改即时生效；
+Web层使用 a 前缀的异步接口，在等待落盘期间不阻塞事件循环
+并发安全：所有修改在管理器锁内完成；每个上下文带递增的版本号（revision），
+修改时可传入 expected_revision 做乐观并发检查，版本不一致时抛出 ContextConflictError
+多worker部署（CONTEXT_SHARED_STORE=1）时通过 shared_store 协调库跨进程比较版本写入、
+轮询变更日志重新加载其他worker修改的上下文
+选中集合与当前项目按会话区分（见 session_state），多worker部署时同样存放在协调库中
+每个管理器实例对应一个项目分片（见 project_store），全局实例是 default 项目的分片
+metadata.context_info 引用的上下文全文存放在内容寻址的 blob 存储中（见 blob_store），上下文文件只保存引用；
+较长的条目正文同样按内容哈希存放，相同正文在内存与磁盘上只有一份
+每次修改记录到分片的变更日志（见 change_feed），客户端按变更序号增量同步
+上下文文件的存储格式由 CONTEXT_STORAGE_FORMAT 指定（pretty/compact/gzip/zstd，见 storage_format），
+读取时自动识别，不同格式的文件可以混合存放
 """
-import json
+import asyncio
+import bisect
+import copy
+import functools
+import hashlib
 import os
 import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Set, Any
 from enum import Enum
 import uuid
 
+import metrics
+import storage_format
+import tracing
+from blob_store import (BLOBS_SUBDIR, BlobStore, TextStore, collect_garbage, compact_context_info,
+                        needs_compaction, resolve_context_info)
+from change_feed import CREATED, DELETED, MOVED, UPDATED, MemoryChangeLog
+from session_state import DEFAULT_SESSION, MemorySessionBackend, SessionRegistry, SessionSelection
+from shared_store import SharedStore
+
 
 class ContextType(Enum):
     """上下文类型枚举"""
@@ -22,6 +52,50 @@ class ContextType(Enum):
     CUSTOM = "自定义"
 
 
+class ContextConflictError(Exception):
+    """乐观并发冲突：上下文已被其他请求修改"""
+
+    def __init__(self, context_id: str, expected: int, actual: int):
+        super().__init__(f"上下文已被修改: {context_id} (期望版本 {expected}, 当前版本 {actual})")
+        self.context_id = context_id
+        self.expected = expected
+        self.actual = actual
+
+
+class BatchOperationError(ValueError):
+    """批量操作中的某个操作无效（整批已回滚）"""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f"第 {index} 个操作失败: {message}")
+        self.index = index
+        self.message = message
+
+
+class _PendingBatch:
+    """批量操作期间推迟的持久化：同一上下文多次保存只写一次；失败时按修改前的快照回滚"""
+
+    # 同一上下文在批量中有多个操作时，变更日志记录优先级最高的一个
+    OP_PRIORITY = {UPDATED: 0, MOVED: 1, CREATED: 2}
+
+    def __init__(self):
+        self.originals: Dict[str, Optional[Dict]] = {}  # 上下文ID -> 修改前的数据（None 表示批量前不存在）
+        self.saves: Dict[str, str] = {}  # 上下文ID -> 变更操作
+        self.deletes: Dict[str, tuple] = {}  # 上下文ID -> (文件路径, 版本号)
+        self.stale_files: List[str] = []
+
+    def remember(self, contexts: Dict[str, 'ContextItem'], *context_ids: Optional[str]):
+        """在修改前记录上下文的快照（每个上下文只记录第一次）"""
+        for context_id in context_ids:
+            if context_id and context_id not in self.originals:
+                context = contexts.get(context_id)
+                self.originals[context_id] = copy.deepcopy(context.to_dict()) if context else None
+
+    def record_save(self, context_id: str, op: str):
+        previous = self.saves.get(context_id)
+        if previous is None or self.OP_PRIORITY.get(op, 0) > self.OP_PRIORITY.get(previous, 0):
+            self.saves[context_id] = op
+
+
 class ContextItem:
     """上下文项（支持树状结构）"""
     
@@ -43,6 +117,7 @@ class ContextItem:
         self.children = children or []  # 子节点ID列表
         self.created_at = datetime.now().isoformat()
         self.updated_at = self.created_at
+        self.revision = 0  # 每次修改递增，用于乐观并发检查
         self.selected_items: Set[str] = set()  # 选中的条目ID
         
         # 处理content，支持字符串和列表两种格式
@@ -59,18 +134,19 @@ class ContextItem:
             }]
     
     def to_dict(self) -> Dict:
-        """转换为字典"""
+        """转换为字典（复制可变字段，作为可交给存储线程写入的快照）"""
         return {
             "id": self.id,
             "name": self.name,
             "type": self.type.value,
-            "content": self.content,
+            "content": [dict(item) if isinstance(item, dict) else item for item in self.content],
             "project_id": self.project_id,
-            "metadata": self.metadata,
+            "metadata": dict(self.metadata),
             "parent_id": self.parent_id,
-            "children": self.children,
+            "children": list(self.children),
             "created_at": self.created_at,
             "updated_at": self.updated_at,
+            "revision": self.revision,
             "selected_items": list(self.selected_items)
         }
     
@@ -96,9 +172,15 @@ class ContextItem:
         )
         item.created_at = data.get("created_at", item.created_at)
         item.updated_at = data.get("updated_at", item.updated_at)
+        item.revision = data.get("revision", 0)
         item.selected_items = set(data.get("selected_items", []))
         return item
     
+    def touch(self):
+        """标记已修改：更新修改时间并递增版本号"""
+        self.updated_at = datetime.now().isoformat()
+        self.revision += 1
+    
     def update(self, content: Any, metadata: Optional[Dict] = None):
         """更新内容"""
         if isinstance(content, list):
@@ -116,12 +198,12 @@ class ContextItem:
                     "updated_at": datetime.now().isoformat()
                 }]
         
-        self.updated_at = datetime.now().isoformat()
+        self.touch()
         if metadata:
             self.metadata.update(metadata)
     
-    def add_item(self, item_content: str, item_id: Optional[str] = None) -> str:
-        """添加上下文条目"""
+    def add_item(self, item_content: str, item_id: Optional[str] = None, position: Optional[int] = None) -> str:
+        """添加上下文条目（position 为插入位置，默认追加到末尾）"""
         if item_id is None:
             item_id = f"item_{len(self.content) + 1}"
         
@@ -132,8 +214,11 @@ class ContextItem:
             "updated_at": datetime.now().isoformat()
         }
         
-        self.content.append(new_item)
-        self.updated_at = datetime.now().isoformat()
+        if position is None:
+            self.content.append(new_item)
+        else:
+            self.content.insert(position, new_item)
+        self.touch()
         return item_id
     
     def update_item(self, item_id: str, item_content: str) -> bool:
@@ -142,7 +227,7 @@ class ContextItem:
             if item.get("id") == item_id:
                 item["content"] = item_content
                 item["updated_at"] = datetime.now().isoformat()
-                self.updated_at = datetime.now().isoformat()
+                self.touch()
                 return True
         return False
     
@@ -154,7 +239,7 @@ class ContextItem:
                 # 从选中集中移除
                 if item_id in self.selected_items:
                     self.selected_items.remove(item_id)
-                self.updated_at = datetime.now().isoformat()
+                self.touch()
                 return True
         return False
     
@@ -206,7 +291,7 @@ class ContextItem:
         """添加子节点"""
         if child_id not in self.children:
             self.children.append(child_id)
-            self.updated_at = datetime.now().isoformat()
+            self.touch()
             return True
         return False
     
@@ -214,7 +299,7 @@ class ContextItem:
         """移除子节点"""
         if child_id in self.children:
             self.children.remove(child_id)
-            self.updated_at = datetime.now().isoformat()
+            self.touch()
             return True
         return False
     
@@ -235,6 +320,24 @@ class ContextItem:
         return result
 
 
+def _io_done(future: Future):
+    """存储线程执行完一个文件操作"""
+    metrics.STORE_IO_QUEUE_DEPTH.dec()
+
+
+def _locked(method):
+    """
+    在管理器锁内执行（内存修改与写入快照原子完成，避免并发请求丢失更新）
+    多worker部署时其他worker的变更由同步线程定期加载，这里不同步：同步可能整体重新加载，
+    而加锁的读写大多直接在事件循环中调用；基于旧版本的写入由落盘时的版本比较发现（见 _shared_write）
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class AdvancedContextManager:
     """高级上下文管理器（支持树状结构）"""
     
@@ -248,23 +351,74 @@ class AdvancedContextManager:
         "小说数据": "小说数据",
         "自定义": "自定义",
     }
+    # 其他项目分片所在的子目录（加载时跳过）
+    PROJECTS_SUBDIR = "projects"
     
-    def __init__(self, data_dir: str = "context_data"):
+    def __init__(self, data_dir: str = "context_data", shared: Optional[bool] = None,
+                 project_id: Optional[str] = None, sessions: Optional[SessionRegistry] = None,
+                 file_format: Optional[str] = None):
+        """
+        project_id: 分片所属项目，新建与列出上下文时默认使用（为空时使用会话的当前项目）
+        sessions: 与其他分片共用的会话注册表（为空时新建）
+        file_format: 写入上下文文件与blob的格式（为空时由环境变量决定，默认 pretty）
+        """
         self.data_dir = data_dir
+        self.project_id = project_id
         self.contexts: Dict[str, ContextItem] = {}
-        self.selected_contexts: Set[str] = set()  # 当前选中的上下文ID
-        self.current_project = "default"
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        # 存储专用线程：单线程保证同一文件的写入/删除按提交顺序执行
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-io")
+        
+        self.storage_format = storage_format.resolve_format(
+            file_format or os.getenv("CONTEXT_STORAGE_FORMAT", storage_format.PRETTY))
+        self.blobs = BlobStore(data_dir, self.storage_format)
+        self.texts = TextStore(self.blobs)
         
         # 创建数据目录和类型子目录
         os.makedirs(data_dir, exist_ok=True)
         for subdir in self.TYPE_DIR_MAP.values():
             os.makedirs(os.path.join(data_dir, subdir), exist_ok=True)
         
+        # 多worker共享存储（未指定时由环境变量决定）
+        if shared is None:
+            shared = os.getenv("CONTEXT_SHARED_STORE", "").lower() in ("1", "true")
+        self.shared_store = SharedStore(os.path.join(data_dir, "_shared.sqlite3")) if shared else None
+        self._lost_writes: Set[str] = set()  # 被其他worker的并发写入覆盖的上下文
+        self._deferred_reloads: Set[str] = set()  # 存储线程未能立即重新加载、留给下一次同步的上下文
+        self._batch: Optional[_PendingBatch] = None  # 正在执行的批量操作（见 apply_batch）
+        # 变更日志：多worker部署时即协调库的 changes 表（在写入落盘时记录）
+        self.change_log = self.shared_store or MemoryChangeLog(int(os.getenv("CONTEXT_CHANGE_RETENTION", "10000")))
+        # 会话状态：每个会话独立的选中集合（有上限）与当前项目，空闲超时后清理
+        self.sessions = sessions or SessionRegistry(
+            self.shared_store or MemorySessionBackend(),
+            max_selection=int(os.getenv("CONTEXT_MAX_SELECTION", "50")),
+            ttl=float(os.getenv("CONTEXT_SESSION_TTL", "86400"))
+        )
+        
         # 加载现有数据
         self._load_all_contexts()
         
         # 重建树状结构关系
         self._rebuild_tree_structure()
+        
+        if self.shared_store:
+            interval = float(os.getenv("CONTEXT_SYNC_INTERVAL", "0.5"))
+            threading.Thread(target=self._sync_loop, args=(interval,), daemon=True, name="context-sync").start()
+    
+    @property
+    def selected_contexts(self) -> SessionSelection:
+        """默认会话（命令行）的选中集合"""
+        return self.sessions.selection(DEFAULT_SESSION)
+    
+    @property
+    def current_project(self) -> str:
+        """默认会话（命令行）的当前项目"""
+        return self.sessions.get_project(DEFAULT_SESSION)
+    
+    @current_project.setter
+    def current_project(self, project_id: str):
+        self.sessions.set_project(DEFAULT_SESSION, project_id)
     
     def _get_subdir_for_type(self, type_value: str) -> str:
         """根据类型获取子目录名"""
@@ -289,47 +443,311 @@ class AdvancedContextManager:
                 subdir = "自定义"
         return os.path.join(self.data_dir, subdir, f"{context_id}.json")
     
+    def _context_files(self) -> List[str]:
+        """数据目录中的上下文文件（包括子目录，跳过其他项目的分片、blob存储与项目信息文件）"""
+        result = []
+        for root, dirs, files in os.walk(self.data_dir):
+            if root == self.data_dir:
+                dirs[:] = [d for d in dirs if d not in (self.PROJECTS_SUBDIR, BLOBS_SUBDIR)]
+            for filename in files:
+                if filename.endswith('.json') and not (root == self.data_dir and filename.startswith('project_')):
+                    result.append(os.path.join(root, filename))
+        return result
+    
     def _load_all_contexts(self):
         """加载所有上下文（递归扫描子目录）"""
         if not os.path.exists(self.data_dir):
             return
         
-        # 遍历数据目录（包括子目录）
-        for root, dirs, files in os.walk(self.data_dir):
-            for filename in files:
-                if filename.endswith('.json'):
-                    filepath = os.path.join(root, filename)
+        start = time.perf_counter()
+        loaded_bytes = 0
+        for filepath in self._context_files():
+            try:
+                loaded_bytes += os.path.getsize(filepath)
+                data = self._inflate_items(storage_format.load_file(filepath))
+                context_item = ContextItem.from_dict(data)
+                self.contexts[context_item.id] = context_item
+                self._track_items(context_item)
+            except Exception as e:
+                print(f"[⚠️] 加载上下文失败 {os.path.basename(filepath)}: {e}", file=sys.stderr)
+        metrics.STORE_LOAD_DURATION.observe(time.perf_counter() - start)
+        metrics.STORE_LOAD_BYTES.inc(loaded_bytes)
+        metrics.STORE_LOADED_CONTEXTS.inc(len(self.contexts))
+    
+    def _inflate_items(self, data: Dict) -> Dict:
+        """还原文件中以 content_ref 引用的条目正文（从共享的正文表或blob存储读取）"""
+        if isinstance(data.get("content"), list):
+            for item in data["content"]:
+                if isinstance(item, dict) and "content_ref" in item:
+                    digest = item.pop("content_ref")
+                    text = self.texts.load(digest)
+                    if text is None:
+                        print(f"[⚠️] 条目正文缺失 {data.get('id')}/{item.get('id')}: {digest[:12]}", file=sys.stderr)
+                        text = ""
+                    item["content"] = text
+        return data
+    
+    def _track_items(self, context_item: ContextItem) -> Dict[int, str]:
+        """
+        较长的条目正文替换为共享对象并登记引用计数，新引用的正文提交写入blob存储
+        返回 {条目序号: 内容哈希}
+        """
+        refs = Counter()
+        positions = {}
+        for index, item in enumerate(context_item.content):
+            text = item.get("content") if isinstance(item, dict) else None
+            if isinstance(text, str) and len(text) >= TextStore.INLINE_LIMIT:
+                item["content"] = text = self.texts.intern(text)
+                positions[index] = self.texts.digest(text)
+                refs[positions[index]] += 1
+        for digest in self.texts.set_refs(context_item.id, refs):
+            self._submit_io(self._write_blob, digest, self.texts.load(digest))
+        return positions
+    
+    def _submit_io(self, func, *args) -> Future:
+        """提交文件操作到存储线程（调用方不等待落盘）"""
+        if self._closed.is_set():
+            # 分片已卸载但仍有调用方持有引用：直接同步执行，文件仍是最终数据
+            future = Future()
+            future.set_result(func(*args))
+            return future
+        if tracing.current_trace_id() is not None:
+            # 带上当前链路：存储线程中的写入记在发起修改的请求下
+            func, args = tracing.wrap_context(func, *args), ()
+        metrics.STORE_IO_QUEUE_DEPTH.inc()
+        future = self._io_executor.submit(func, *args)
+        future.add_done_callback(_io_done)
+        return future
+    
+    @staticmethod
+    def _dump_json(filepath: str, data: Dict, fmt: str = storage_format.PRETTY):
+        """原子写入JSON文件（按指定的存储格式）"""
+        # 确保子目录存在
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        start = time.perf_counter()
+        payload = storage_format.dumps(data, fmt)
+        temp_path = filepath + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, filepath)
+        metrics.STORE_WRITE_DURATION.observe(time.perf_counter() - start)
+        metrics.STORE_WRITE_BYTES.observe(len(payload))
+    
+    @classmethod
+    @tracing.traced("context.write")
+    def _write_json_file(cls, filepath: str, data: Dict, error_message: str, fmt: str = storage_format.PRETTY):
+        """原子写入JSON文件（在存储线程中执行）"""
+        try:
+            cls._dump_json(filepath, data, fmt)
+        except Exception as e:
+            print(f"[⚠️] {error_message}: {e}", file=sys.stderr)
+    
+    @tracing.traced("context.write")
+    def _shared_write(self, context_id: str, revision: int, filepath: str, data: Dict, op: str = UPDATED):
+        """多worker部署下的写入（在存储线程中执行）：已落盘版本不低于本次版本时放弃写入并加载对方的版本"""
+        try:
+            if not self.shared_store.commit_write(context_id, revision,
+                                                  lambda: self._dump_json(filepath, data, self.storage_format), op):
+                print(f"[⚠️] 上下文 {context_id} 已被其他worker修改，放弃版本 {revision} 的写入", file=sys.stderr)
+                self._lost_writes.add(context_id)
+                # 存储线程不等待锁：持锁的线程可能正在等待存储线程落盘（flush），等待会互相卡死
+                if self._lock.acquire(blocking=False):
                     try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            context_item = ContextItem.from_dict(data)
-                            self.contexts[context_item.id] = context_item
-                    except Exception as e:
-                        print(f"[⚠️] 加载上下文失败 {filename}: {e}", file=sys.stderr)
-    
-    def _save_context(self, context_item: ContextItem):
-        """保存单个上下文（按类型存入子目录）"""
+                        self._reload_context(context_id)
+                    finally:
+                        self._lock.release()
+                else:
+                    self._deferred_reloads.add(context_id)
+        except Exception as e:
+            print(f"[⚠️] 保存上下文失败 {context_id}: {e}", file=sys.stderr)
+    
+    def _shared_delete(self, context_id: str, filepath: str):
+        """多worker部署下的删除（在存储线程中执行）"""
         try:
-            filepath = self._get_context_filepath(context_item.id, context_item.type)
-            # 确保子目录存在
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            temp_path = filepath + ".tmp"
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(context_item.to_dict(), f, ensure_ascii=False, indent=2)
-            os.replace(temp_path, filepath)
+            self.shared_store.commit_delete(context_id, lambda: self._remove_file(filepath))
         except Exception as e:
-            print(f"[⚠️] 保存上下文失败 {context_item.id}: {e}", file=sys.stderr)
+            print(f"[⚠️] 删除上下文文件失败 {context_id}: {e}", file=sys.stderr)
+    
+    @staticmethod
+    def _remove_file(filepath: str):
+        """删除文件（在存储线程中执行）"""
+        try:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except OSError as e:
+            print(f"[⚠️] 删除文件失败 {filepath}: {e}", file=sys.stderr)
+    
+    @tracing.traced("context.write_blob")
+    def _write_blob(self, digest: str, text: str):
+        """写入blob（在存储线程中执行）"""
+        try:
+            self.blobs.put(digest, text)
+        except Exception as e:
+            print(f"[⚠️] 保存引用内容失败 {digest[:12]}: {e}", file=sys.stderr)
+    
+    def _save_context(self, context_item: ContextItem, op: str = UPDATED):
+        """保存单个上下文（按类型存入子目录；先取快照，再交给存储线程写入），op 为变更日志中记录的操作"""
+        if self._batch is not None:
+            # 批量操作结束后统一保存
+            self._batch.record_save(context_item.id, op)
+            return
+        if needs_compaction(context_item.metadata.get("context_info")):
+            # 内嵌的引用全文改存blob（先于上下文文件提交，存储线程按顺序执行，引用不会悬空）
+            context_item.metadata["context_info"] = compact_context_info(
+                context_item.metadata["context_info"],
+                lambda digest, text: self._submit_io(self._write_blob, digest, text)
+            )
+        positions = self._track_items(context_item)
+        data = context_item.to_dict()
+        for index, digest in positions.items():
+            stored = data["content"][index]
+            del stored["content"]
+            stored["content_ref"] = digest
+        
+        filepath = self._get_context_filepath(context_item.id, context_item.type)
+        if self.shared_store:
+            self._submit_io(self._shared_write, context_item.id, context_item.revision, filepath, data, op)
+        else:
+            self.change_log.record_change(context_item.id, op, context_item.revision)
+            self._submit_io(self._write_json_file, filepath, data, f"保存上下文失败 {context_item.id}",
+                            self.storage_format)
+    
+    @staticmethod
+    def _check_revision(context: ContextItem, expected_revision: Optional[int]):
+        """乐观并发检查：指定了期望版本且与当前版本不一致时抛出冲突"""
+        if expected_revision is not None and context.revision != expected_revision:
+            raise ContextConflictError(context.id, expected_revision, context.revision)
+    
+    def flush(self):
+        """等待此前提交的所有文件操作完成"""
+        self._submit_io(lambda: None).result()
+    
+    def collect_garbage(self, grace_seconds: float = 3600.0) -> Dict:
+        """
+        清理不再被引用的blob（以磁盘上的上下文文件为准），返回清理统计
+        扫描与删除在存储线程中执行：此前提交的写入都已落盘，扫描期间本进程也不会写入新的blob；
+        在锁内提交，不会插在同一次保存的blob与上下文文件之间
+        """
+        with self._lock:
+            future = self._submit_io(lambda: collect_garbage(self.blobs, self._context_files(), grace_seconds))
+        result = future.result()
+        result.update(self.texts.stats())
+        return result
+    
+    def close(self):
+        """等待落盘后停止存储线程与同步线程（项目分片卸载时调用）"""
+        with self._lock:
+            self.flush()
+            self._closed.set()
+        self._io_executor.shutdown(wait=True)
+    
+    @tracing.traced("context.flush")
+    async def aflush(self):
+        """异步等待此前提交的所有文件操作完成（存储线程按顺序执行，空任务完成即表示之前的写入已落盘）"""
+        await asyncio.wrap_future(self._submit_io(lambda: None))
+    
+    def _revision_of(self, context_id: str) -> Optional[int]:
+        context = self.contexts.get(context_id)
+        return context.revision if context else None
+    
+    async def _aflush_checked(self, context_id: str, revision: Optional[int]):
+        """等待落盘；多worker部署下本次写入被其他worker的并发写入覆盖时抛出冲突"""
+        await self.aflush()
+        if context_id in self._lost_writes:
+            self._lost_writes.discard(context_id)
+            current = self.contexts.get(context_id)
+            raise ContextConflictError(context_id, revision, current.revision if current else -1)
+    
+    # ==================== 多worker变更同步 ====================
+    
+    def _find_context_file(self, context_id: str) -> Optional[str]:
+        """在所有类型子目录中查找上下文文件（其他worker可能修改了类型）"""
+        for subdir_name in self.TYPE_DIR_MAP.values():
+            candidate = os.path.join(self.data_dir, subdir_name, f"{context_id}.json")
+            if os.path.exists(candidate):
+                return candidate
+        return None
+    
+    def _detach_from_parent(self, context: ContextItem):
+        parent = self.contexts.get(context.parent_id) if context.parent_id else None
+        if parent and context.id in parent.children:
+            parent.children.remove(context.id)
+    
+    def _reload_context(self, context_id: str):
+        """从磁盘重新加载单个上下文（文件不存在表示已被删除），并维护内存中的父子关系"""
+        with self._lock:
+            current = self.contexts.get(context_id)
+            filepath = self._find_context_file(context_id)
+            if filepath is None:
+                if current:
+                    self._detach_from_parent(current)
+                    del self.contexts[context_id]
+                    self.texts.set_refs(context_id, Counter())
+                return
+            try:
+                item = ContextItem.from_dict(self._inflate_items(storage_format.load_file(filepath)))
+            except Exception as e:
+                print(f"[⚠️] 重新加载上下文失败 {context_id}: {e}", file=sys.stderr)
+                return
+            if current and current.revision > item.revision:
+                return  # 本地更新的版本尚未落盘
+            
+            if current and current.parent_id != item.parent_id:
+                self._detach_from_parent(current)
+            parent = self.contexts.get(item.parent_id) if item.parent_id else None
+            if parent and context_id not in parent.children:
+                parent.children.append(context_id)
+            # children是派生数据：合并文件中的列表与内存中parent_id指向该节点的上下文
+            derived = [cid for cid, ctx in self.contexts.items() if ctx.parent_id == context_id]
+            item.children = list(dict.fromkeys([cid for cid in item.children if cid in self.contexts] + derived))
+            self.contexts[context_id] = item
+            self._track_items(item)
     
+    def sync_changes(self):
+        """应用其他worker的变更（同步线程定期调用，增量变更接口在线程池中也会调用）"""
+        if not self.shared_store:
+            return
+        deferred = []
+        while self._deferred_reloads:
+            deferred.append(self._deferred_reloads.pop())
+        for context_id in deferred:
+            self._reload_context(context_id)
+        changes, full_reload = self.shared_store.poll_changes()
+        if full_reload:
+            with self._lock:
+                self.contexts.clear()
+                self.texts.reset()
+                self._load_all_contexts()
+                self._rebuild_tree_structure()
+            return
+        for context_id in dict.fromkeys(context_id for context_id, _ in changes):
+            self._reload_context(context_id)
+    
+    def _sync_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.sync_changes()
+            except Exception as e:
+                print(f"[⚠️] 同步其他worker的变更失败: {e}", file=sys.stderr)
+    
+    @_locked
     def create_context(self, 
                       name: str,
                       context_type: ContextType,
                       content: Any,
                       project_id: Optional[str] = None,
                       metadata: Optional[Dict] = None,
-                      parent_id: Optional[str] = None) -> str:
-        """创建新上下文（支持树状结构）"""
+                      parent_id: Optional[str] = None,
+                      session_id: str = DEFAULT_SESSION,
+                      select: bool = False) -> str:
+        """
+        创建新上下文（支持树状结构）
+        未指定项目时使用会话的当前项目；select 为真时在该会话中选中新上下文（默认不选中）
+        """
         context_id = str(uuid.uuid4())[:8]  # 生成简短ID
-        project_id = project_id or self.current_project
+        while context_id in self.contexts:
+            context_id = str(uuid.uuid4())[:8]
+        project_id = project_id or self.project_id or self.sessions.get_project(session_id)
         
         context_item = ContextItem(
             context_id=context_id,
@@ -342,7 +760,7 @@ class AdvancedContextManager:
         )
         
         self.contexts[context_id] = context_item
-        self._save_context(context_item)
+        self._save_context(context_item, CREATED)
         
         # 如果指定了父节点，更新父节点的子节点列表
         if parent_id and parent_id in self.contexts:
@@ -350,66 +768,267 @@ class AdvancedContextManager:
             parent.add_child(context_id)
             self._save_context(parent)
         
-        # 自动选中新创建的上下文
-        self.selected_contexts.add(context_id)
+        if select:
+            self.sessions.selection(session_id).add(context_id)
         
         return context_id
     
-    def update_context(self, context_id: str, content: Any, metadata: Optional[Dict] = None):
+    @_locked
+    def update_context(self, context_id: str, content: Any, metadata: Optional[Dict] = None,
+                       expected_revision: Optional[int] = None):
         """更新上下文内容"""
         if context_id not in self.contexts:
             raise ValueError(f"上下文不存在: {context_id}")
         
+        self._check_revision(self.contexts[context_id], expected_revision)
         self.contexts[context_id].update(content, metadata)
         self._save_context(self.contexts[context_id])
     
-    def delete_context(self, context_id: str) -> bool:
+    @_locked
+    def patch_context(self,
+                      context_id: str,
+                      name: Optional[str] = None,
+                      context_type: Optional[ContextType] = None,
+                      content: Any = None,
+                      metadata: Optional[Dict] = None,
+                      expected_revision: Optional[int] = None) -> ContextItem:
+        """部分更新上下文（名称、类型、内容、元数据），返回更新后的上下文"""
+        context = self.contexts.get(context_id)
+        if not context:
+            raise ValueError(f"上下文不存在: {context_id}")
+        self._check_revision(context, expected_revision)
+        
+        old_filepath = self._get_context_filepath(context_id)
+        if name is not None:
+            context.name = name
+        if context_type is not None:
+            context.type = context_type
+        if content is not None:
+            context.update(content, metadata)
+        else:
+            if metadata is not None:
+                context.metadata.update(metadata)
+            context.touch()
+        
+        # 类型变化时文件移到新的类型子目录
+        if self._get_context_filepath(context_id) != old_filepath:
+            if self._batch is not None:
+                self._batch.stale_files.append(old_filepath)
+            else:
+                self._submit_io(self._remove_file, old_filepath)
+        self._save_context(context)
+        return context
+    
+    @_locked
+    def delete_context(self, context_id: str, expected_revision: Optional[int] = None) -> bool:
         print(f"[ℹ️] 删除上下文: {context_id}")
         """删除上下文"""
         if context_id not in self.contexts:
             return False
         
-        # 从选中集中移除
-        if context_id in self.selected_contexts:
-            self.selected_contexts.remove(context_id)
+        context = self.contexts[context_id]
+        self._check_revision(context, expected_revision)
+        
+        # 从父节点的子节点列表中移除
+        parent = self.contexts.get(context.parent_id) if context.parent_id else None
+        if parent and parent.remove_child(context_id):
+            self._save_context(parent)
         
-        # 删除文件
         filepath = self._get_context_filepath(context_id)
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        if self._batch is not None:
+            self._batch.deletes[context_id] = (filepath, context.revision)
+        else:
+            self._delete_persisted(context_id, filepath, context.revision)
         
-        # 从内存中移除
+        # 从内存中移除（释放对共享正文的引用）
         del self.contexts[context_id]
+        self.texts.set_refs(context_id, Counter())
         
         return True
     
+    def _delete_persisted(self, context_id: str, filepath: str, revision: int):
+        """从所有会话的选中集中移除，并提交文件删除"""
+        self.sessions.remove_context(context_id)
+        if self.shared_store:
+            self._submit_io(self._shared_delete, context_id, filepath)
+        else:
+            self.change_log.record_change(context_id, DELETED, revision)
+            self._submit_io(self._remove_file, filepath)
+    
+    # ==================== 批量操作 ====================
+    
+    @_locked
+    def apply_batch(self, operations: List[Dict], session_id: str = DEFAULT_SESSION) -> List[Dict]:
+        """
+        原子地执行一组操作，返回每个操作的结果；任一操作失败时回滚全部内存修改，
+        抛出 BatchOperationError（操作无效）或 ContextConflictError（版本冲突）
+        执行期间推迟持久化，结束后每个受影响的上下文只写一次
+        操作（op）：
+            create  name, type(ContextType), content, metadata, parent_id, select, ref
+            update  context_id, name, type, content, metadata, revision
+            move    context_id, parent_id, revision
+            delete  context_id, revision, recursive（同时删除所有子孙节点）
+            select  context_id, selected（默认为真）
+        create 指定 ref 后，之后的操作可用 "$<ref>" 引用新上下文的ID
+        """
+        if self._batch is not None:
+            raise RuntimeError("批量操作不能嵌套")
+        batch = self._batch = _PendingBatch()
+        selection = self.sessions.selection(session_id)
+        selected_before = list(selection)
+        refs: Dict[str, str] = {}
+        results = []
+        try:
+            for index, operation in enumerate(operations):
+                try:
+                    results.append(self._apply_operation(batch, operation, refs, session_id))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise BatchOperationError(index, str(e)) from e
+        except BaseException:
+            self._batch = None
+            self._rollback_batch(batch)
+            selection.clear()
+            for context_id in selected_before:
+                selection.add(context_id)
+            raise
+        self._batch = None
+        self._commit_batch(batch)
+        return results
+    
+    def _apply_operation(self, batch: _PendingBatch, operation: Dict, refs: Dict[str, str], session_id: str) -> Dict:
+        def resolve(value: Optional[str]) -> Optional[str]:
+            if isinstance(value, str) and value.startswith("$"):
+                if value[1:] not in refs:
+                    raise ValueError(f"未定义的引用: {value}")
+                return refs[value[1:]]
+            return value
+        
+        def existing(context_id: Optional[str]) -> ContextItem:
+            context = self.contexts.get(resolve(context_id)) if context_id else None
+            if context is None:
+                raise ValueError(f"上下文不存在: {context_id}")
+            return context
+        
+        op = operation.get("op")
+        if op == "create":
+            parent_id = resolve(operation.get("parent_id"))
+            if parent_id and parent_id not in self.contexts:
+                raise ValueError(f"父上下文不存在: {parent_id}")
+            batch.remember(self.contexts, parent_id)
+            context_id = self.create_context(operation.get("name") or "未命名", operation.get("type") or ContextType.CUSTOM,
+                                             operation.get("content") if operation.get("content") is not None else "", metadata=operation.get("metadata"),
+                                             parent_id=parent_id, session_id=session_id,
+                                             select=bool(operation.get("select")))
+            batch.originals.setdefault(context_id, None)
+            if operation.get("ref"):
+                refs[operation["ref"]] = context_id
+            return {"op": op, "ref": operation.get("ref"), "context_id": context_id, "revision": 0}
+        
+        if op == "update":
+            context = existing(operation.get("context_id"))
+            batch.remember(self.contexts, context.id)
+            self.patch_context(context.id, operation.get("name"), operation.get("type"), operation.get("content"),
+                               operation.get("metadata"), operation.get("revision"))
+            return {"op": op, "context_id": context.id, "revision": context.revision}
+        
+        if op == "move":
+            context = existing(operation.get("context_id"))
+            new_parent_id = resolve(operation.get("parent_id"))
+            batch.remember(self.contexts, context.id, context.parent_id, new_parent_id)
+            if not self.move_context(context.id, new_parent_id, operation.get("revision")):
+                raise ValueError(f"无法移动 {context.id}：父上下文不存在或会形成循环引用")
+            return {"op": op, "context_id": context.id, "revision": context.revision}
+        
+        if op == "delete":
+            context = existing(operation.get("context_id"))
+            self._check_revision(context, operation.get("revision"))
+            # 先删除最深层的子孙节点
+            doomed = [context.id]
+            if operation.get("recursive"):
+                for context_id in doomed:
+                    doomed.extend(child for child in self.contexts[context_id].children if child in self.contexts)
+            for context_id in reversed(doomed):
+                batch.remember(self.contexts, context_id, self.contexts[context_id].parent_id)
+                self.delete_context(context_id)
+            return {"op": op, "context_id": context.id, "deleted": doomed}
+        
+        if op == "select":
+            context = existing(operation.get("context_id"))
+            selection = self.sessions.selection(session_id)
+            if operation.get("selected", True):
+                selection.add(context.id)
+            else:
+                selection.discard(context.id)
+            return {"op": op, "context_id": context.id, "selected": context.id in selection}
+        
+        raise ValueError(f"未知的操作: {op}")
+    
+    def _rollback_batch(self, batch: _PendingBatch):
+        """按快照恢复批量中修改过的上下文（新建的移除，删除的恢复）"""
+        for context_id, original in batch.originals.items():
+            if original is None:
+                if self.contexts.pop(context_id, None) is not None:
+                    self.texts.set_refs(context_id, Counter())
+            else:
+                context_item = ContextItem.from_dict(original)
+                self.contexts[context_id] = context_item
+                self._track_items(context_item)
+    
+    def _commit_batch(self, batch: _PendingBatch):
+        """提交批量操作的持久化：旧类型目录中的文件、每个上下文的最终状态、删除"""
+        for filepath in batch.stale_files:
+            self._submit_io(self._remove_file, filepath)
+        for context_id, op in batch.saves.items():
+            context = self.contexts.get(context_id)
+            if context is not None:
+                self._save_context(context, op)
+        for context_id, (filepath, revision) in batch.deletes.items():
+            if batch.originals.get(context_id) is None:
+                self.sessions.remove_context(context_id)  # 批量中新建又删除，没有落盘
+            else:
+                self._delete_persisted(context_id, filepath, revision)
+    
     def get_context(self, context_id: str) -> Optional[ContextItem]:
         """获取单个上下文"""
         return self.contexts.get(context_id)
     
+    def resolve_context_info(self, context_id: str) -> List[Dict]:
+        """读取上下文 metadata.context_info 引用的全文（按需从blob存储读取）"""
+        context = self.contexts.get(context_id)
+        if context is None:
+            raise ValueError(f"上下文不存在: {context_id}")
+        return resolve_context_info(context.metadata.get("context_info"), self.blobs)
+    
     def _rebuild_tree_structure(self):
-        """重建树状结构关系"""
+        """重建树状结构关系（只保存子节点列表有变化的上下文）"""
         # 清空所有子节点列表
-        for context in self.contexts.values():
+        old_children = {}
+        for context_id, context in self.contexts.items():
+            old_children[context_id] = context.children
             context.children = []
         
-        # 重新建立父子关系
+        # 重新建立父子关系（重建不算修改，不递增版本号）
         for context_id, context in self.contexts.items():
             if context.parent_id and context.parent_id in self.contexts:
                 parent = self.contexts[context.parent_id]
-                parent.add_child(context_id)
+                if context_id not in parent.children:
+                    parent.children.append(context_id)
         
         # 保存更新后的树状结构
-        for context in self.contexts.values():
-            self._save_context(context)
+        for context_id, context in self.contexts.items():
+            if context.children != old_children[context_id]:
+                self._save_context(context)
     
+    @_locked
     def list_contexts(self, 
                       project_id: Optional[str] = None,
                       context_type: Optional[ContextType] = None,
-                      parent_id: Optional[str] = None) -> List[Dict]:
-        """列出上下文（支持按父节点过滤）"""
+                      parent_id: Optional[str] = None,
+                      session_id: str = DEFAULT_SESSION) -> List[Dict]:
+        """列出上下文（支持按父节点过滤，选中状态与默认项目取自会话）"""
         result = []
-        project_id = project_id or self.current_project
+        project_id = project_id or self.project_id or self.sessions.get_project(session_id)
+        selected = set(self.sessions.selection(session_id))
         
         for context_id, item in self.contexts.items():
             if project_id and item.project_id != project_id:
@@ -425,35 +1044,83 @@ class AdvancedContextManager:
                 if item.parent_id is not None:
                     continue
             
-            result.append({
-                "id": context_id,
-                "name": item.name,
-                "type": item.type.value,
-                "project_id": item.project_id,
-                "parent_id": item.parent_id,
-                "has_children": len(item.children) > 0,
-                "is_selected": context_id in self.selected_contexts,
-                "created_at": item.created_at,
-                "updated_at": item.updated_at
-            })
+            result.append(self._context_summary(item, selected))
+        
+        return result
+    
+    @staticmethod
+    def _context_summary(item: ContextItem, selected: Set[str]) -> Dict:
+        """上下文列表与变更日志中的上下文概要"""
+        return {
+            "id": item.id,
+            "name": item.name,
+            "type": item.type.value,
+            "project_id": item.project_id,
+            "parent_id": item.parent_id,
+            "has_children": len(item.children) > 0,
+            "is_selected": item.id in selected,
+            "created_at": item.created_at,
+            "updated_at": item.updated_at,
+            "revision": item.revision
+        }
+    
+    def get_changes(self, since: Optional[int], epoch: Optional[str] = None, limit: int = 500,
+                    session_id: str = DEFAULT_SESSION) -> Dict:
+        """
+        增量变更：返回序号大于 since 的变更（最多 limit 条），仍存在的上下文附带当前概要（context）
+        返回的 revision 是下次请求应传入的 since；since 为空时只返回当前 revision 与 epoch；
+        reset 为真表示无法增量同步（落后超出保留范围、epoch 不一致），客户端需要重新获取完整的树
+        """
+        result = {"epoch": self.change_log.epoch, "revision": self.change_log.latest_change(),
+                  "reset": False, "has_more": False, "changes": []}
+        if since is None:
+            return result
+        if epoch and epoch != self.change_log.epoch:
+            result["reset"] = True
+            return result
+        entries, reset = self.change_log.changes_since(since, limit + 1)
+        if reset:
+            result["reset"] = True
+            return result
+        result["has_more"] = len(entries) > limit
+        entries = entries[:limit]
+        if entries:
+            result["revision"] = entries[-1]["seq"] if result["has_more"] else max(result["revision"], entries[-1]["seq"])
         
+        # 先读变更再同步：附带的概要不会比变更旧
+        with self._lock:
+            if self.shared_store:
+                self.sync_changes()
+            selected = set(self.sessions.selection(session_id))
+            for entry in entries:
+                context = self.contexts.get(entry["context_id"])
+                entry["context"] = (self._context_summary(context, selected)
+                                    if context is not None and entry["op"] != DELETED else None)
+        result["changes"] = entries
         return result
     
-    def select_contexts(self, context_ids: List[str]):
-        """选择多个上下文"""
+    @_locked
+    def select_contexts(self, context_ids: List[str], session_id: str = DEFAULT_SESSION):
+        """选择多个上下文（替换会话的当前选择，超出上限时只保留最后的部分）"""
+        selection = self.sessions.selection(session_id)
         # 清空当前选择
-        self.selected_contexts.clear()
+        selection.clear()
         
         # 添加有效ID
+        valid_ids = []
         for context_id in context_ids:
             if context_id in self.contexts:
-                self.selected_contexts.add(context_id)
+                valid_ids.append(context_id)
             else:
                 print(f"[⚠️] 上下文不存在，跳过: {context_id}", file=sys.stderr)
+        if len(valid_ids) > selection.limit:
+            print(f"[⚠️] 选中数量超过上限 {selection.limit}，只保留最后 {selection.limit} 个", file=sys.stderr)
+        for context_id in valid_ids[-selection.limit:]:
+            selection.add(context_id)
     
-    def clear_selection(self):
+    def clear_selection(self, session_id: str = DEFAULT_SESSION):
         """清空选择"""
-        self.selected_contexts.clear()
+        self.sessions.selection(session_id).clear()
     
     def get_selected_contexts_content(self) -> str:
         """获取选中上下文的组合内容"""
@@ -470,26 +1137,39 @@ class AdvancedContextManager:
     
     def get_contexts_by_type(self, context_type: ContextType) -> List[ContextItem]:
         """按类型获取上下文"""
-        return [item for item in self.contexts.values() if item.type == context_type]
+        return [item for item in list(self.contexts.values()) if item.type == context_type]
+    
+    @_locked
+    def state_digest(self) -> str:
+        """
+        分片当前内容的摘要（按顺序汇总各上下文的ID、版本号与修改时间），用于上下文列表与树的HTTP ETag
+        列表与树中可见的修改都会递增版本号（删除则移除条目）；摘要与进程无关，多worker与重启后保持一致
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for context_id, context in self.contexts.items():
+            digest.update(f"{context_id}:{context.revision}:{context.updated_at}\n".encode("utf-8"))
+        return digest.hexdigest()
     
-    def get_context_tree(self, root_id: Optional[str] = None) -> List[Dict]:
+    @_locked
+    def get_context_tree(self, root_id: Optional[str] = None, session_id: str = DEFAULT_SESSION) -> List[Dict]:
         """获取上下文树状结构"""
         result = []
+        selected = set(self.sessions.selection(session_id))
         
         if root_id:
             # 从指定根节点开始
             if root_id in self.contexts:
                 root = self.contexts[root_id]
-                result.append(self._build_tree_node(root))
+                result.append(self._build_tree_node(root, selected))
         else:
             # 获取所有根节点（没有父节点的节点）
             for context_id, context in self.contexts.items():
                 if context.parent_id is None:
-                    result.append(self._build_tree_node(context))
+                    result.append(self._build_tree_node(context, selected))
         
         return result
     
-    def _build_tree_node(self, node: ContextItem) -> Dict:
+    def _build_tree_node(self, node: ContextItem, selected: Set[str]) -> Dict:
         """构建树节点"""
         node_dict = {
             "id": node.id,
@@ -499,9 +1179,10 @@ class AdvancedContextManager:
             "project_id": node.project_id,
             "parent_id": node.parent_id,
             "has_children": len(node.children) > 0,
-            "is_selected": node.id in self.selected_contexts,
+            "is_selected": node.id in selected,
             "created_at": node.created_at,
             "updated_at": node.updated_at,
+            "revision": node.revision,
             "children": []
         }
         
@@ -509,20 +1190,27 @@ class AdvancedContextManager:
         for child_id in node.children:
             if child_id in self.contexts:
                 child = self.contexts[child_id]
-                node_dict["children"].append(self._build_tree_node(child))
+                node_dict["children"].append(self._build_tree_node(child, selected))
         
         return node_dict
     
-    def move_context(self, context_id: str, new_parent_id: Optional[str] = None) -> bool:
+    @_locked
+    def move_context(self, context_id: str, new_parent_id: Optional[str] = None,
+                     expected_revision: Optional[int] = None) -> bool:
         """移动上下文到新的父节点"""
         if context_id not in self.contexts:
             return False
         
         context = self.contexts[context_id]
+        self._check_revision(context, expected_revision)
         old_parent_id = context.parent_id
         
         # 检查是否形成循环引用
         if new_parent_id:
+            # 新父节点必须存在（可能已被并发请求删除）
+            if new_parent_id not in self.contexts:
+                return False
+            
             # 不能将自己作为父节点
             if context_id == new_parent_id:
                 return False
@@ -545,7 +1233,7 @@ class AdvancedContextManager:
         
         # 更新当前节点的父节点
         context.parent_id = new_parent_id
-        context.updated_at = datetime.now().isoformat()
+        context.touch()
         
         # 添加到新父节点的子节点列表
         if new_parent_id and new_parent_id in self.contexts:
@@ -553,9 +1241,10 @@ class AdvancedContextManager:
             new_parent.add_child(context_id)
             self._save_context(new_parent)
         
-        self._save_context(context)
+        self._save_context(context, MOVED)
         return True
     
+    @_locked
     def get_context_path(self, context_id: str) -> List[Dict]:
         """获取上下文路径（从根节点到当前节点）"""
         path = []
@@ -572,9 +1261,9 @@ class AdvancedContextManager:
         
         return path
     
-    def create_project(self, project_id: str, name: str):
-        """创建项目（项目是上下文的容器）"""
-        self.current_project = project_id
+    def create_project(self, project_id: str, name: str, session_id: str = DEFAULT_SESSION):
+        """创建项目（项目是上下文的容器），并设为会话的当前项目"""
+        self.sessions.set_project(session_id, project_id)
         project_file = os.path.join(self.data_dir, f"project_{project_id}.json")
         project_data = {
             "id": project_id,
@@ -582,12 +1271,9 @@ class AdvancedContextManager:
             "created_at": datetime.now().isoformat()
         }
         
-        try:
-            with open(project_file, 'w', encoding='utf-8') as f:
-                json.dump(project_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[⚠️] 保存项目信息失败: {e}", file=sys.stderr)
+        self._submit_io(self._write_json_file, project_file, project_data, "保存项目信息失败")
     
+    @_locked
     def save_to_context(self, 
                        context_id: str, 
                        content: Any,
@@ -614,13 +1300,14 @@ class AdvancedContextManager:
             else:
                 # 创建新条目
                 item.add_item(content)
-            item.updated_at = datetime.now().isoformat()
+            item.touch()
         else:
             # 替换内容
             item.update(content, metadata)
         
         self._save_context(item)
     
+    @_locked
     def save_to_history(self, 
                        question: str, 
                        answer: str,
@@ -658,13 +1345,32 @@ class AdvancedContextManager:
         history_context.update(new_content)
         self._save_context(history_context)
     
-    def get_context_items(self, context_id: str) -> List[Dict]:
-        """获取上下文的所有条目"""
+    def get_context_items(self, context_id: str, offset: int = 0, limit: Optional[int] = None,
+                          preview: Optional[int] = None) -> List[Dict]:
+        """
+        获取上下文的条目（附带内容哈希，客户端比较哈希即可判断正文是否变化）
+        offset/limit 分页（只为这一页计算哈希）；preview 为正文截取的字符数（哈希仍按完整正文计算）
+        """
         if context_id not in self.contexts:
             raise ValueError(f"上下文不存在: {context_id}")
         
-        return self.contexts[context_id].list_items()
+        items = self.contexts[context_id].list_items()
+        page = items[offset:offset + limit] if limit is not None else items[offset:]
+        return [self.preview_item(dict(item, content_hash=self.texts.digest(str(item.get("content", "")))), preview)
+                if isinstance(item, dict) else item
+                for item in page]
     
+    @staticmethod
+    def preview_item(item: Dict, preview: Optional[int]) -> Dict:
+        """把条目正文截取为前 preview 个字符（截取时附带 truncated 与完整长度 length；传入的条目会被修改）"""
+        text = item.get("content") if isinstance(item, dict) else None
+        if preview is not None and isinstance(text, str) and len(text) > preview:
+            item["content"] = text[:preview]
+            item["truncated"] = True
+            item["length"] = len(text)
+        return item
+    
+    @_locked
     def select_context_items(self, context_id: str, item_ids: List[str]):
         """选择上下文中的特定条目"""
         if context_id not in self.contexts:
@@ -673,6 +1379,7 @@ class AdvancedContextManager:
         self.contexts[context_id].select_items(item_ids)
         self._save_context(self.contexts[context_id])
     
+    @_locked
     def deselect_context_items(self, context_id: str, item_ids: List[str]):
         """取消选择上下文中的条目"""
         if context_id not in self.contexts:
@@ -681,6 +1388,7 @@ class AdvancedContextManager:
         self.contexts[context_id].deselect_items(item_ids)
         self._save_context(self.contexts[context_id])
     
+    @_locked
     def clear_context_item_selection(self, context_id: str):
         """清空上下文条目选择"""
         if context_id not in self.contexts:
@@ -689,6 +1397,7 @@ class AdvancedContextManager:
         self.contexts[context_id].clear_item_selection()
         self._save_context(self.contexts[context_id])
     
+    @_locked
     def add_context_item(self, context_id: str, item_content: str, item_id: Optional[str] = None) -> str:
         """添加上下文条目"""
         if context_id not in self.contexts:
@@ -698,21 +1407,57 @@ class AdvancedContextManager:
         self._save_context(self.contexts[context_id])
         return item_id
     
-    def update_context_item(self, context_id: str, item_id: str, item_content: str) -> bool:
+    @_locked
+    def put_context_items(self, context_id: str, items: Dict[str, str], ordered: bool = False) -> int:
+        """
+        批量添加或更新条目（{条目ID: 正文}，已存在的条目更新正文），只保存一次；返回有变化的条目数
+        ordered 为真时新条目按条目ID插入到有序位置（如按章节序号命名的章节条目），否则追加到末尾
+        """
+        if context_id not in self.contexts:
+            raise ValueError(f"上下文不存在: {context_id}")
+        
+        context = self.contexts[context_id]
+        changed = 0
+        for item_id, item_content in items.items():
+            current = context.get_item(item_id)
+            if current is None:
+                position = None
+                if ordered:
+                    position = bisect.bisect_left([item.get("id", "") for item in context.content], item_id)
+                context.add_item(item_content, item_id, position)
+            elif self.texts.digest(str(current.get("content", ""))) != self.texts.digest(item_content):
+                context.update_item(item_id, item_content)
+            else:
+                continue
+            changed += 1
+        if changed:
+            self._save_context(context)
+        return changed
+    
+    @_locked
+    def update_context_item(self, context_id: str, item_id: str, item_content: str,
+                            expected_revision: Optional[int] = None) -> bool:
         """更新上下文条目"""
         if context_id not in self.contexts:
             raise ValueError(f"上下文不存在: {context_id}")
         
+        self._check_revision(self.contexts[context_id], expected_revision)
+        current = self.contexts[context_id].get_item(item_id)
+        if current is not None and self.texts.digest(str(current.get("content", ""))) == self.texts.digest(item_content):
+            return True  # 正文未变化，不递增版本也不写盘
         success = self.contexts[context_id].update_item(item_id, item_content)
         if success:
             self._save_context(self.contexts[context_id])
         return success
     
-    def delete_context_item(self, context_id: str, item_id: str) -> bool:
+    @_locked
+    def delete_context_item(self, context_id: str, item_id: str,
+                            expected_revision: Optional[int] = None) -> bool:
         """删除上下文条目"""
         if context_id not in self.contexts:
             raise ValueError(f"上下文不存在: {context_id}")
         
+        self._check_revision(self.contexts[context_id], expected_revision)
         success = self.contexts[context_id].delete_item(item_id)
         if success:
             self._save_context(self.contexts[context_id])
@@ -725,13 +1470,15 @@ class AdvancedContextManager:
         
         return self.contexts[context_id].get_item(item_id)
     
-    def get_selected_contexts_content(self) -> str:
-        """获取选中上下文的组合内容（支持条目级别选择）"""
-        if not self.selected_contexts:
+    @_locked
+    def get_selected_contexts_content(self, session_id: str = DEFAULT_SESSION) -> str:
+        """获取会话选中上下文的组合内容（支持条目级别选择）"""
+        selection = self.sessions.selection(session_id)
+        if not selection:
             return "【未选择任何上下文】"
         
         result = []
-        for context_id in self.selected_contexts:
+        for context_id in selection:
             item = self.contexts.get(context_id)
             if item:
                 # 使用条目的选中内容获取方法
@@ -739,6 +1486,133 @@ class AdvancedContextManager:
                 result.append(f"=== {item.type.value}: {item.name} ===\n{content}")
         
         return "\n\n".join(result)
+    
+    # ==================== 异步接口（供Web层使用） ====================
+    
+    @tracing.traced("context.create")
+    async def acreate_context(self,
+                              name: str,
+                              context_type: ContextType,
+                              content: Any,
+                              project_id: Optional[str] = None,
+                              metadata: Optional[Dict] = None,
+                              parent_id: Optional[str] = None,
+                              session_id: str = DEFAULT_SESSION,
+                              select: bool = False) -> str:
+        """创建新上下文并异步等待落盘"""
+        context_id = self.create_context(name, context_type, content, project_id, metadata, parent_id,
+                                         session_id, select)
+        await self.aflush()
+        return context_id
+    
+    @tracing.traced("context.update")
+    async def aupdate_context(self, context_id: str, content: Any, metadata: Optional[Dict] = None,
+                              expected_revision: Optional[int] = None):
+        """更新上下文内容并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        self.update_context(context_id, content, metadata, expected_revision)
+        await self._aflush_checked(context_id, self._revision_of(context_id))
+    
+    @tracing.traced("context.patch")
+    async def apatch_context(self,
+                             context_id: str,
+                             name: Optional[str] = None,
+                             context_type: Optional[ContextType] = None,
+                             content: Any = None,
+                             metadata: Optional[Dict] = None,
+                             expected_revision: Optional[int] = None) -> ContextItem:
+        """部分更新上下文并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        context = self.patch_context(context_id, name, context_type, content, metadata, expected_revision)
+        await self._aflush_checked(context_id, context.revision)
+        return context
+    
+    @tracing.traced("context.save")
+    async def asave_context(self, context_item: ContextItem):
+        """保存（调用方已直接修改的）上下文并异步等待落盘"""
+        self._lost_writes.discard(context_item.id)
+        self._save_context(context_item)
+        await self._aflush_checked(context_item.id, context_item.revision)
+    
+    @tracing.traced("context.apply_batch")
+    async def aapply_batch(self, operations: List[Dict], session_id: str = DEFAULT_SESSION) -> List[Dict]:
+        """原子执行一组操作并异步等待一次落盘；多worker部署下其中的写入被其他worker覆盖时抛出冲突"""
+        results = self.apply_batch(operations, session_id)
+        await self.aflush()
+        for result in results:
+            context_id = result.get("context_id")
+            if context_id in self._lost_writes:
+                self._lost_writes.discard(context_id)
+                current = self.contexts.get(context_id)
+                raise ContextConflictError(context_id, result.get("revision"), current.revision if current else -1)
+        return results
+    
+    @tracing.traced("context.delete")
+    async def adelete_context(self, context_id: str, expected_revision: Optional[int] = None) -> bool:
+        """删除上下文并异步等待文件删除完成"""
+        success = self.delete_context(context_id, expected_revision)
+        if success:
+            await self.aflush()
+        return success
+    
+    @tracing.traced("context.move")
+    async def amove_context(self, context_id: str, new_parent_id: Optional[str] = None,
+                            expected_revision: Optional[int] = None) -> bool:
+        """移动上下文并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        success = self.move_context(context_id, new_parent_id, expected_revision)
+        if success:
+            await self._aflush_checked(context_id, self._revision_of(context_id))
+        return success
+    
+    @tracing.traced("context.save_to")
+    async def asave_to_context(self,
+                               context_id: str,
+                               content: Any,
+                               append: bool = False,
+                               metadata: Optional[Dict] = None,
+                               as_new_item: bool = False):
+        """保存内容到指定上下文并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        self.save_to_context(context_id, content, append, metadata, as_new_item)
+        await self._aflush_checked(context_id, self._revision_of(context_id))
+    
+    @tracing.traced("context.add_item")
+    async def aadd_context_item(self, context_id: str, item_content: str, item_id: Optional[str] = None) -> str:
+        """添加上下文条目并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        item_id = self.add_context_item(context_id, item_content, item_id)
+        await self._aflush_checked(context_id, self._revision_of(context_id))
+        return item_id
+    
+    @tracing.traced("context.put_items")
+    async def aput_context_items(self, context_id: str, items: Dict[str, str], ordered: bool = False) -> int:
+        """批量添加或更新条目并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        changed = self.put_context_items(context_id, items, ordered)
+        if changed:
+            await self._aflush_checked(context_id, self._revision_of(context_id))
+        return changed
+    
+    @tracing.traced("context.update_item")
+    async def aupdate_context_item(self, context_id: str, item_id: str, item_content: str,
+                                   expected_revision: Optional[int] = None) -> bool:
+        """更新上下文条目并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        success = self.update_context_item(context_id, item_id, item_content, expected_revision)
+        if success:
+            await self._aflush_checked(context_id, self._revision_of(context_id))
+        return success
+    
+    @tracing.traced("context.delete_item")
+    async def adelete_context_item(self, context_id: str, item_id: str,
+                                   expected_revision: Optional[int] = None) -> bool:
+        """删除上下文条目并异步等待落盘"""
+        self._lost_writes.discard(context_id)
+        success = self.delete_context_item(context_id, item_id, expected_revision)
+        if success:
+            await self._aflush_checked(context_id, self._revision_of(context_id))
+        return success
 
 
 # 全局实例
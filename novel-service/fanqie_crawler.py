@@ -0,0 +1,192 @@
+"""
+番茄小说整本抓取流程
+抓取完整目录 → 有限并发抓取免费章节正文 → 每章作为一个条目写入小说上下文，
+章节每累积 batch_size 章写入一次（每次写入都会重写整个上下文文件，逐章写入的总写入量随章节数平方增长），
+写入落盘后更新断点文件，中断后再次抓取同一本书时跳过已完成章节
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, Optional, Set
+
+from context_manager import advanced_context_manager, ContextType
+from fanqie_tool import CACHE_ROOT, FanqieNovelParser, save_novel_to_context, scrape_executor
+from page_cache import normalize_book_url
+
+# 抓取提前结束后仍在保存章节的后台任务（保留引用，避免任务被回收）
+_background_saves: Set[asyncio.Task] = set()
+
+
+class CrawlCheckpoint:
+    """抓取断点：记录章节上下文ID与已完成章节"""
+
+    def __init__(self, checkpoint_dir: str, book_url: str):
+        self.book_url = book_url
+        digest = hashlib.sha1(book_url.encode("utf-8")).hexdigest()
+        self.filepath = os.path.join(checkpoint_dir, f"{digest}.json")
+        self.context_id: Optional[str] = None
+        self.done: Dict[str, str] = {}  # 章节URL -> 条目ID
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.context_id = data.get("context_id")
+            self.done = data.get("done", {})
+        except Exception as e:
+            print(f"[⚠️] 加载抓取断点失败 {self.filepath}: {e}", file=sys.stderr)
+
+    def save(self):
+        data = {
+            "url": self.book_url,
+            "context_id": self.context_id,
+            "done": self.done,
+            "updated_at": datetime.now().isoformat()
+        }
+        temp_path = self.filepath + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, self.filepath)
+
+
+class FanqieCrawler:
+    """整本书抓取（有限并发 + 断点续抓）"""
+
+    def __init__(self, parser: FanqieNovelParser = None, concurrency: int = 4,
+                 checkpoint_dir: Optional[str] = None, batch_size: int = 20):
+        self.parser = parser or FanqieNovelParser()
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.checkpoint_dir = checkpoint_dir or os.path.join(CACHE_ROOT, "crawl")
+
+    def _ensure_chapters_context(self, checkpoint: CrawlCheckpoint, detail: Dict[str, Any]) -> str:
+        """获取或创建保存章节的小说上下文（作为书籍上下文的子节点）"""
+        if checkpoint.context_id and advanced_context_manager.get_context(checkpoint.context_id):
+            return checkpoint.context_id
+        for ctx in advanced_context_manager.get_contexts_by_type(ContextType.NOVEL):
+            if ctx.metadata.get("chapters_of") == checkpoint.book_url:
+                checkpoint.context_id = ctx.id
+                return ctx.id
+        book_context_id = save_novel_to_context(detail, source_url=checkpoint.book_url)
+        checkpoint.context_id = advanced_context_manager.create_context(
+            name=f"章节: {detail.get('title', '未知')}",
+            context_type=ContextType.NOVEL,
+            content=[],
+            metadata={"chapters_of": checkpoint.book_url},
+            parent_id=book_context_id
+        )
+        return checkpoint.context_id
+
+    @staticmethod
+    def _chapter_text(chapter: Dict[str, Any]) -> str:
+        return f"{chapter['title']}\n\n{chapter['content']}" if chapter.get("title") else chapter["content"]
+
+    @staticmethod
+    async def _save_chapters(context_id: str, items: Dict[str, str], urls: Dict[str, str],
+                             checkpoint: CrawlCheckpoint):
+        """写入一批章节，落盘后更新断点（断点文件在线程池中写入，不阻塞事件循环）"""
+        await advanced_context_manager.aput_context_items(context_id, items, ordered=True)
+        checkpoint.done.update(urls)
+        await asyncio.get_running_loop().run_in_executor(None, checkpoint.save)
+
+    @classmethod
+    async def _save_chapters_in_background(cls, context_id: str, items: Dict[str, str], urls: Dict[str, str],
+                                           checkpoint: CrawlCheckpoint):
+        try:
+            await cls._save_chapters(context_id, items, urls, checkpoint)
+        except Exception as e:
+            print(f"[⚠️] 保存已抓取章节失败 {checkpoint.book_url}: {e}", file=sys.stderr)
+
+    async def crawl(self, url: str, max_chapters: Optional[int] = None,
+                    include_locked: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """抓取整本书，逐章产出进度事件"""
+        loop = asyncio.get_running_loop()
+        book_url = normalize_book_url(url)
+        checkpoint = CrawlCheckpoint(self.checkpoint_dir, book_url)
+
+        detail = await loop.run_in_executor(scrape_executor, self.parser.parse_novel, url)
+        if "error" in detail:
+            yield {"type": "crawl_error", "error": detail["error"]}
+            return
+        toc = await loop.run_in_executor(scrape_executor, self.parser.fetch_full_toc, url)
+        context_id = self._ensure_chapters_context(checkpoint, detail)
+        await advanced_context_manager.aflush()
+        await loop.run_in_executor(None, checkpoint.save)
+
+        pending = [(index, chapter) for index, chapter in enumerate(toc)
+                   if (include_locked or not chapter["locked"]) and chapter["url"] not in checkpoint.done]
+        if max_chapters is not None:
+            pending = pending[:max_chapters]
+        yield {
+            "type": "crawl_start",
+            "title": detail.get("title"),
+            "context_id": context_id,
+            "toc_size": len(toc),
+            "already_done": len(checkpoint.done),
+            "pending": len(pending)
+        }
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(index: int, chapter: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    result = await loop.run_in_executor(scrape_executor, self.parser.parse_chapter, chapter["url"])
+                except Exception as e:
+                    result = {"error": str(e)}
+                return index, chapter, result
+
+        tasks = [asyncio.create_task(fetch(index, chapter)) for index, chapter in pending]
+        succeeded = failed = 0
+        buffered: Dict[str, str] = {}  # 条目ID -> 正文（尚未写入）
+        buffered_urls: Dict[str, str] = {}  # 章节URL -> 条目ID
+
+        async def save_buffered():
+            await self._save_chapters(context_id, buffered, buffered_urls, checkpoint)
+            buffered.clear()
+            buffered_urls.clear()
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, chapter, result = await next_done
+                if "error" in result:
+                    failed += 1
+                    yield {"type": "chapter_error", "index": index, "title": chapter["title"], "error": result["error"]}
+                    continue
+                if not result.get("title"):
+                    result["title"] = chapter["title"]
+                item_id = f"chapter_{index + 1:05d}"
+                buffered[item_id] = self._chapter_text(result)
+                buffered_urls[chapter["url"]] = item_id
+                if len(buffered) >= self.batch_size:
+                    await save_buffered()
+                succeeded += 1
+                yield {"type": "chapter_done", "index": index, "title": result["title"],
+                       "item_id": item_id, "length": len(result["content"])}
+            if buffered:
+                await save_buffered()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if buffered:
+                # 提前结束（如客户端断开）时在后台任务中保存已抓取的章节：生成器已被取消或关闭，不能在此等待
+                task = asyncio.ensure_future(self._save_chapters_in_background(
+                    context_id, dict(buffered), dict(buffered_urls), checkpoint))
+                _background_saves.add(task)
+                task.add_done_callback(_background_saves.discard)
+
+        yield {
+            "type": "crawl_complete",
+            "context_id": context_id,
+            "succeeded": succeeded,
+            "failed": failed,
+            "total_done": len(checkpoint.done),
+            "toc_size": len(toc)
+        }
@@ -1,7 +1,18 @@
 import re, json
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import time
+from urllib.parse import urlsplit, urljoin
 import requests
-from bs4 import BeautifulSoup
-from langchain.tools import tool
+from requests.adapters import HTTPAdapter
+from langchain_core.tools import StructuredTool
+from page_cache import PageCache, normalize_book_url, FRESH, STALE
+from html_backends import get_html_backend
+from font_decoder import DEFAULT_GLYPH_TABLE, FontDecoder, GlyphReference
+import metrics
+import tracing
 import sys
 import os
 
@@ -14,32 +25,180 @@ except ImportError:
     print("[⚠️] 上下文管理器不可用，使用简单文件保存", file=sys.stderr)
 
 
+class FanqieHttpClient:
+    """共享连接池的HTTP客户端（keep-alive + 条件请求 + 每主机并发限制）"""
+
+    def __init__(self, per_host_concurrency: int = 2, pool_size: int = 8,
+                 timeout: float = 10, max_validators: int = 128, per_host_interval: float = 0.2,
+                 base_url_override: str = None):
+        self.timeout = timeout
+        # 将fanqienovel.com的请求改发到指定地址（如离线替身服务器），URL校验与缓存键不受影响
+        self.base_url_override = base_url_override.rstrip("/") if base_url_override else None
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_interval = per_host_interval  # 同一主机相邻请求的最小间隔（礼貌抓取）
+        self.max_validators = max_validators
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # 浏览器头
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+            "Cookie": "fqnovel_platform=web"
+        })
+        self._host_limits = {}
+        self._host_next_start = {}
+        # url -> (etag, last_modified, text)，用于If-None-Match/If-Modified-Since
+        self._validators = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return self._host_limits[host]
+
+    def _wait_host_turn(self, url: str):
+        """按主机限速：保证相邻请求的发起间隔不小于per_host_interval"""
+        if self.per_host_interval <= 0:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._host_next_start.get(host, 0.0))
+            self._host_next_start[host] = start + self.per_host_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _rewrite(self, url: str) -> str:
+        if not self.base_url_override:
+            return url
+        parts = urlsplit(url)
+        if not parts.netloc.endswith("fanqienovel.com"):
+            return url
+        rewritten = self.base_url_override + parts.path
+        return f"{rewritten}?{parts.query}" if parts.query else rewritten
+
+    def fetch(self, url: str) -> str:
+        """获取页面文本；页面未变化时（304）直接返回上次的内容"""
+        url = self._rewrite(url)
+        with self._lock:
+            cached = self._validators.get(url)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        with self._host_limit(url):
+            self._wait_host_turn(url)
+            resp = self.session.get(url, headers=headers, timeout=self.timeout)
+        if resp.status_code == 304 and cached:
+            with self._lock:
+                self._validators.move_to_end(url)
+            return cached[2]
+        resp.raise_for_status()
+
+        etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        if etag or last_modified:
+            with self._lock:
+                self._validators[url] = (etag, last_modified, resp.text)
+                self._validators.move_to_end(url)
+                while len(self._validators) > self.max_validators:
+                    self._validators.popitem(last=False)
+        return resp.text
+
+    def fetch_bytes(self, url: str) -> bytes:
+        """获取二进制资源（如反爬字体）"""
+        url = self._rewrite(url)
+        with self._host_limit(url):
+            self._wait_host_turn(url)
+            resp = self.session.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.content
+
+
+# 全局共享客户端与抓取线程池（抓取在独立线程执行，不阻塞事件循环）
+http_client = FanqieHttpClient(base_url_override=os.getenv("FANQIE_BASE_URL"))
+scrape_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fanqie")
+metrics.SCRAPE_QUEUE_DEPTH.set_function(lambda: {(): scrape_executor._work_queue.qsize()})
+tracer = tracing.get_tracer(__name__)
+# 抓取缓存（详情页、字体解码表、整本抓取断点）的根目录：默认在模块目录下，不随启动目录变化
+CACHE_ROOT = os.getenv("FANQIE_CACHE_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+# HTML解析后端（优先selectolax/lxml，不可用时回退BeautifulSoup）
+html_backend = get_html_backend()
+# 字体反爬解码（参考字形表用 python font_decoder.py learn 从已知映射的字体中补充）
+font_decoder = FontDecoder(http_client.fetch_bytes,
+                           GlyphReference(os.getenv("FANQIE_GLYPH_TABLE", DEFAULT_GLYPH_TABLE)),
+                           cache_dir=os.path.join(CACHE_ROOT, "fonts"))
+# 详情页缓存（原始HTML+解析结果），1小时内视为新鲜，1天内可先返回旧数据再后台刷新
+# 创建时不读取磁盘，索引在首次查询时建立
+page_cache = PageCache(os.getenv("FANQIE_CACHE_DIR", os.path.join(CACHE_ROOT, "fanqie")))
+
+
 class FanqieNovelParser:
     """精准解析番茄小说详情页（对抗字体反爬+付费标识）"""
+
+    def __init__(self, client: FanqieHttpClient = None, cache: PageCache = None, backend=None,
+                 decoder: FontDecoder = None):
+        self.client = client or http_client
+        self.cache = cache or page_cache
+        self.backend = backend or html_backend
+        self.decoder = decoder or font_decoder
     
-    def parse_novel(self, url):
-        """解析小说页面 - 返回结构化数据"""
+    def parse_novel(self, url, force_refresh=False):
+        """解析小说页面 - 返回结构化数据（优先使用缓存）"""
         # 验证URL有效性
         if "fanqienovel.com/page/" not in url:
             return {"error": "⚠️ 无效链接，请提供番茄小说详情页URL"}
-        # 安全请求（带浏览器头+超时）
-        resp = requests.get(url, headers={
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Cookie": "fqnovel_platform=web"
-        }, timeout=10)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, 'html.parser')
+        key = normalize_book_url(url)
+        if not force_refresh:
+            entry, state = self.cache.get(key)
+            if state == FRESH:
+                return entry["parsed"]
+            if state == STALE:
+                # 先返回旧数据，后台重新验证
+                if self.cache.begin_revalidate(key):
+                    scrape_executor.submit(self._revalidate, key)
+                return entry["parsed"]
+        return self._fetch_and_parse(key)
+
+    def _revalidate(self, key):
+        try:
+            self._fetch_and_parse(key)
+        except Exception as e:
+            print(f"[⚠️] 后台刷新缓存失败 {key}: {e}", file=sys.stderr)
+        finally:
+            self.cache.end_revalidate(key)
+
+    def _fetch_and_parse(self, url):
+        """抓取并解析页面，成功时写入缓存"""
+        # 安全请求（共享连接池+超时）
+        html = self.client.fetch(url)
+        data = self._parse_html(self.decoder.decode_page(html, url), url)
+        if "error" not in data:
+            self.cache.put(url, html, data)
+        return data
+
+    def _parse_html(self, html, url):
+        """从详情页HTML提取结构化数据"""
+        raw = self.backend.extract_detail(html)
+        toc = self._build_toc(raw["toc"], url)
         # === 核心数据提取 ===
         data = {
-            "title": self._clean_text(soup.select_one('div.info-name h1').text),
-            "status": [self._clean_text(s.text) for s in soup.select('div.info-label span')],
-            "word_count": soup.select_one('div.info-count-word .detail').text + "万字",
+            "title": self._clean_text(raw["title"]),
+            "status": [self._clean_text(s) for s in raw["status"]],
+            "word_count": raw["word_count"] + "万字",
             "last_update": {
-                "chapter": self._clean_text(soup.select_one('div.info-last .info-last-title').text),
-                "time": soup.select_one('div.info-last .info-last-time').text
+                "chapter": self._clean_text(raw["last_chapter"]),
+                "time": raw["last_time"]
             },
-            "summary": self._clean_text(soup.select_one('div.page-abstract-content p').text),
-            "toc": self._parse_toc(soup)
+            "summary": self._clean_text(raw["summary"]),
+            "toc": toc[:10],  # 工具输出只保留前10章，完整目录由抓取流程获取
+            "chapter_count": len(toc)
         }
         # 验证关键字段
         if not data["title"] or not data["summary"]:
@@ -48,47 +207,76 @@ class FanqieNovelParser:
 
     
     def _clean_text(self, text):
-        """清理特殊字符（对抗字体反爬）"""
+        """清理特殊字符（字体反爬字符已在解码阶段还原，残留的无法识别字符在此移除）"""
         if not text: return ""
         # 移除非常规字符 + 处理Unicode控制符
         return re.sub(r'[\x00-\x1f\x7f-\x9f]|[\uf000-\uf8ff]', '', text).strip()
     
-    def _parse_toc(self, soup):
-        """解析目录（识别付费章节）"""
+    def _build_toc(self, entries, base_url="https://fanqienovel.com"):
+        """整理目录条目（识别付费章节）"""
         chapters = []
-        for item in soup.select('div.chapter-item'):
-            title = self._clean_text(item.select_one('a.chapter-item-title').text)
+        for raw_title, href, is_locked in entries:
+            title = self._clean_text(raw_title)
             if not title: continue
-            
-            # 检测付费锁标识
-            is_locked = bool(item.select_one('span.chapter-item-lock'))
             chapters.append({
                 "title": title,
                 "locked": is_locked,
-                "url": "https://fanqienovel.com" + item.select_one('a').get('href', '')
+                "url": urljoin(base_url, href)
             })
-        return chapters[:10]
+        return chapters
+
+    def _fetch_decoded(self, url):
+        """抓取页面并解码字体反爬字符（整页一次str.translate）"""
+        return self.decoder.decode_page(self.client.fetch(url), url)
+
+    def fetch_full_toc(self, url, max_pages=50):
+        """抓取完整目录（跟随分页链接）"""
+        chapters, seen = [], set()
+        page_url = url
+        for _ in range(max_pages):
+            entries, next_href = self.backend.extract_toc(self._fetch_decoded(page_url))
+            for chapter in self._build_toc(entries, page_url):
+                if chapter["url"] not in seen:
+                    seen.add(chapter["url"])
+                    chapters.append(chapter)
+            if not next_href:
+                break
+            page_url = urljoin(page_url, next_href)
+        return chapters
+
+    def parse_chapter(self, url):
+        """解析章节正文"""
+        title, paragraphs = self.backend.extract_chapter(self._fetch_decoded(url))
+        if paragraphs is None:
+            return {"error": "⚠️ 章节正文解析失败"}
+        paragraphs = [self._clean_text(p) for p in paragraphs]
+        return {
+            "title": self._clean_text(title),
+            "content": "\n".join(p for p in paragraphs if p)
+        }
 
 
-def save_novel_to_context(novel_data, context_id=None):
-    """保存小说数据到上下文"""
+def save_novel_to_context(novel_data, context_id=None, source_url=None):
+    """保存小说数据到上下文（按来源URL对应到各自的小说上下文）"""
     novel_name = f"小说: {novel_data.get('title', '未知')}"
+    metadata = {"source_url": source_url} if source_url else None
 
     if HAS_ADVANCED_CONTEXT:
         try:
             # 如果提供了context_id且上下文存在，则更新
             if context_id and advanced_context_manager.get_context(context_id):
-                advanced_context_manager.update_context(context_id, novel_data)
+                advanced_context_manager.update_context(context_id, novel_data, metadata)
                 return context_id
 
-            # 否则查找已有小说上下文或创建新的
-            novel_contexts = advanced_context_manager.get_contexts_by_type(ContextType.NOVEL)
-            if novel_contexts:
-                advanced_context_manager.update_context(novel_contexts[0].id, novel_data)
-                return novel_contexts[0].id
+            # 否则查找同一本书的小说上下文或创建新的
+            if source_url:
+                for ctx in advanced_context_manager.get_contexts_by_type(ContextType.NOVEL):
+                    if ctx.metadata.get("source_url") == source_url:
+                        advanced_context_manager.update_context(ctx.id, novel_data)
+                        return ctx.id
 
             return advanced_context_manager.create_context(
-                name=novel_name, context_type=ContextType.NOVEL, content=novel_data
+                name=novel_name, context_type=ContextType.NOVEL, content=novel_data, metadata=metadata
             )
         except Exception as e:
             print(f"[⚠️] 保存到上下文失败: {e}", file=sys.stderr)
@@ -118,23 +306,49 @@ def save_novel_to_context(novel_data, context_id=None):
             return None
 
 
-@tool
-def novel_tool(url: str, context_id: str = "") -> str:
+def _novel_tool(url: str, context_id: str = "", force_refresh: bool = False) -> str:
     """解析番茄小说链接。必须条件: URL包含'fanqienovel.com/page/'。返回JSON: {status, data}
 
     参数:
         url: 番茄小说详情页URL
         context_id: (可选) 指定上下文ID，用于保存到特定上下文
+        force_refresh: (可选) 忽略缓存重新抓取页面
     """
-    result = FanqieNovelParser().parse_novel(url=url)
+    start = time.perf_counter()
+    outcome = "error"
+    with tracer.start_as_current_span("tool.novel_tool", {"tool.url": url}) as span:
+        try:
+            response = _run_novel_tool(url, context_id, force_refresh)
+            outcome = response["status"]
+            return json.dumps(response, ensure_ascii=False)
+        finally:
+            span.set_attribute("tool.outcome", outcome)
+            metrics.TOOL_CALL_DURATION.observe(time.perf_counter() - start, tool="novel_tool", outcome=outcome)
+
+
+def _run_novel_tool(url: str, context_id: str, force_refresh: bool) -> dict:
+    """解析并保存小说，返回未序列化的工具响应"""
+    with tracer.start_as_current_span("fanqie.parse_novel"):
+        result = FanqieNovelParser().parse_novel(url=url, force_refresh=force_refresh)
     if "error" in result:
-        return json.dumps({"status": "error", "data": {"message": result.get("error", "解析失败")}}, ensure_ascii=False)
+        return {"status": "error", "data": {"message": result.get("error", "解析失败")}}
 
-    saved_id = save_novel_to_context(result, context_id)
+    with tracer.start_as_current_span("fanqie.save_context"):
+        saved_id = save_novel_to_context(result, context_id, source_url=normalize_book_url(url))
     response = {"status": "success", "data": result}
     if saved_id:
         response["context_id"] = saved_id
         response["message"] = f"小说数据已保存到上下文: {saved_id}"
     else:
         response["message"] = "小说数据解析成功，但保存到上下文失败"
-    return json.dumps(response, ensure_ascii=False)
+    return response
+
+
+async def _anovel_tool(url: str, context_id: str = "", force_refresh: bool = False) -> str:
+    """异步版本：在抓取线程池中执行，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    # 带上当前链路，工具的span记在调用它的生成请求下
+    return await loop.run_in_executor(scrape_executor, tracing.wrap_context(_novel_tool, url, context_id, force_refresh))
+
+
+novel_tool = StructuredTool.from_function(func=_novel_tool, coroutine=_anovel_tool, name="novel_tool")
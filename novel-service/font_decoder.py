@@ -0,0 +1,243 @@
+"""
+番茄字体反爬解码
+页面正文中的部分汉字被替换为私有区（PUA）码位，由页面的自定义web字体渲染成真实字形。
+解码流程：下载页面字体 → 对每个PUA码位的字形轮廓做哈希 → 在参考字形表（轮廓哈希→真实字符）
+中查找，得到 {码位: 字符} 映射。映射按字体URL缓存（内存+磁盘），解码时只需一次 str.translate
+
+参考字形表（默认 fanqie_glyphs.json，FANQIE_GLYPH_TABLE 可指定）需要先从已知映射的字体中学习：
+    python font_decoder.py learn <字体文件或URL> <映射.json>
+    python font_decoder.py learn <字体文件或URL> --texts <页面原文.txt> <显示文字.txt>
+映射.json 为 {码位: 字符}，码位可写作十进制、"U+E3E8"/"0xE3E8" 或PUA字符本身；
+--texts 从同一段正文的页面原文（含PUA字符）与浏览器中显示的文字逐字对齐得到映射。
+参考表按字形轮廓匹配、与码位无关，学习过的字形在码位重新分配的字体中同样可以识别
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import urllib.request
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from urllib.parse import urljoin
+
+try:
+    from fontTools.pens.recordingPen import RecordingPen
+    from fontTools.ttLib import TTFont
+    HAS_FONTTOOLS = True
+except ImportError:
+    HAS_FONTTOOLS = False
+    print("[⚠️] fontTools不可用，字体反爬字符将被直接移除", file=sys.stderr)
+
+PUA_START, PUA_END = 0xE000, 0xF8FF
+DEFAULT_GLYPH_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fanqie_glyphs.json")
+_FONT_FACE_RE = re.compile(r"@font-face\s*\{[^}]*?src\s*:[^}]*?url\(\s*['\"]?([^'\")\s]+)", re.S)
+
+# 码位 -> 真实字符（None表示无法识别，与旧逻辑一样直接移除）
+TranslateTable = Dict[int, Optional[str]]
+# 无法解码时使用：移除全部PUA字符
+_STRIP_PUA: TranslateTable = dict.fromkeys(range(PUA_START, PUA_END + 1))
+
+
+def find_font_url(html: str, base_url: str) -> Optional[str]:
+    """从页面内联样式中找到@font-face字体地址"""
+    match = _FONT_FACE_RE.search(html)
+    return urljoin(base_url, match.group(1)) if match else None
+
+
+def outline_hash(glyph_set, glyph_name: str) -> str:
+    """字形轮廓哈希（与码位、字形名无关，只取决于绘制指令）"""
+    pen = RecordingPen()
+    glyph_set[glyph_name].draw(pen)
+    return hashlib.sha1(repr(pen.value).encode("utf-8")).hexdigest()
+
+
+def _pua_glyphs(font_bytes: bytes):
+    """遍历字体中所有PUA码位，产出 (码位, 轮廓哈希)"""
+    font = TTFont(io.BytesIO(font_bytes))
+    glyph_set = font.getGlyphSet()
+    for codepoint, glyph_name in (font.getBestCmap() or {}).items():
+        if PUA_START <= codepoint <= PUA_END:
+            yield codepoint, outline_hash(glyph_set, glyph_name)
+
+
+class GlyphReference:
+    """参考字形表：轮廓哈希 -> 真实字符（可从已知映射的字体中学习）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.table: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.table = json.load(f)
+            except Exception as e:
+                print(f"[⚠️] 加载参考字形表失败 {path}: {e}", file=sys.stderr)
+
+    def get(self, glyph_hash: str) -> Optional[str]:
+        return self.table.get(glyph_hash)
+
+    def learn(self, font_bytes: bytes, mapping: Dict[int, str]) -> int:
+        """从已知 {码位: 字符} 映射的字体中学习轮廓哈希，返回新增条目数"""
+        added = 0
+        with self._lock:
+            for codepoint, glyph_hash in _pua_glyphs(font_bytes):
+                char = mapping.get(codepoint)
+                if char and self.table.get(glyph_hash) != char:
+                    self.table[glyph_hash] = char
+                    added += 1
+            if added:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.table, f, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+        return added
+
+
+class FontDecoder:
+    """按字体URL缓存解码表的字体反爬解码器"""
+
+    def __init__(self, fetch_bytes: Callable[[str], bytes], reference: GlyphReference,
+                 cache_dir: str = os.path.join("cache", "fonts"), max_memory_entries: int = 32):
+        self.fetch_bytes = fetch_bytes
+        self.reference = reference
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self._tables: "OrderedDict[str, TranslateTable]" = OrderedDict()
+        self._lock = threading.Lock()
+        if HAS_FONTTOOLS and not reference.table:
+            print(f"[⚠️] 参考字形表为空（{reference.path}），字体反爬解码未启用，反爬字符将被直接移除"
+                  f"（用 python font_decoder.py learn 建立参考字形表）", file=sys.stderr)
+
+    def _cache_path(self, font_url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(font_url.encode("utf-8")).hexdigest() + ".json")
+
+    def _remember(self, font_url: str, table: TranslateTable):
+        with self._lock:
+            self._tables[font_url] = table
+            self._tables.move_to_end(font_url)
+            while len(self._tables) > self.max_memory_entries:
+                self._tables.popitem(last=False)
+
+    def get_table(self, font_url: str) -> TranslateTable:
+        """获取字体的解码表（内存 → 磁盘 → 下载字体并计算）"""
+        with self._lock:
+            table = self._tables.get(font_url)
+            if table is not None:
+                self._tables.move_to_end(font_url)
+                return table
+
+        cache_path = self._cache_path(font_url)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    table = {int(cp): char for cp, char in json.load(f).items()}
+                self._remember(font_url, table)
+                return table
+            except Exception as e:
+                print(f"[⚠️] 加载字体解码缓存失败 {font_url}: {e}", file=sys.stderr)
+
+        table = self._build_table(font_url)
+        # 只缓存完整识别的解码表：下载或解析失败、未识别的字形在恢复或参考表补全后可重新计算
+        if table and all(table.values()):
+            self._remember(font_url, table)
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(cache_path, "w", encoding="utf-8") as f:
+                    json.dump(table, f, ensure_ascii=False)
+            except OSError as e:
+                print(f"[⚠️] 保存字体解码缓存失败 {font_url}: {e}", file=sys.stderr)
+        return table
+
+    def _build_table(self, font_url: str) -> TranslateTable:
+        if not HAS_FONTTOOLS or not self.reference.table:
+            return _STRIP_PUA  # 无法识别任何字形，不必下载字体
+        try:
+            font_bytes = self.fetch_bytes(font_url)
+            return {cp: self.reference.get(glyph_hash) for cp, glyph_hash in _pua_glyphs(font_bytes)}
+        except Exception as e:
+            print(f"[⚠️] 解析反爬字体失败 {font_url}: {e}", file=sys.stderr)
+            return {}
+
+    def decode_page(self, html: str, base_url: str) -> str:
+        """解码整页HTML中的PUA字符（页面未使用自定义字体时原样返回）"""
+        font_url = find_font_url(html, base_url)
+        if not font_url:
+            return html
+        table = self.get_table(font_url)
+        return html.translate(table) if table else html
+
+
+def _parse_codepoint(key: str) -> int:
+    key = key.strip()
+    if len(key) == 1:
+        return ord(key)
+    if key[:2].lower() in ("u+", "0x"):
+        return int(key[2:], 16)
+    return int(key)
+
+
+def _mapping_from_texts(obfuscated: str, plain: str) -> Dict[int, str]:
+    """逐字对齐页面原文与显示文字，取出PUA字符对应的真实字符"""
+    if len(obfuscated) != len(plain):
+        raise ValueError(f"两段文字长度不一致（{len(obfuscated)} / {len(plain)}），请确认是同一段正文")
+    mapping = {}
+    for raw, char in zip(obfuscated, plain):
+        if PUA_START <= ord(raw) <= PUA_END:
+            if mapping.setdefault(ord(raw), char) != char:
+                raise ValueError(f"码位 U+{ord(raw):04X} 对应了不同的字符: {mapping[ord(raw)]} / {char}")
+    return mapping
+
+
+def _read_font(source: str) -> bytes:
+    if source.startswith(("http://", "https://")):
+        request = urllib.request.Request(source, headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(request, timeout=30) as resp:
+            return resp.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    learn = commands.add_parser("learn", help="从已知映射的字体中学习参考字形")
+    learn.add_argument("font", help="字体文件路径或URL")
+    learn.add_argument("mapping", nargs="?", help="{码位: 字符} 映射的JSON文件")
+    learn.add_argument("--texts", nargs=2, metavar=("OBFUSCATED", "PLAIN"),
+                       help="页面原文与显示文字（同一段正文）的文本文件")
+    learn.add_argument("--table", default=os.getenv("FANQIE_GLYPH_TABLE", DEFAULT_GLYPH_TABLE), help="参考字形表路径")
+    args = arg_parser.parse_args()
+
+    if not HAS_FONTTOOLS:
+        sys.exit("需要安装 fontTools")
+    if bool(args.mapping) == bool(args.texts):
+        arg_parser.error("请提供映射JSON文件或 --texts 二者之一")
+    try:
+        if args.texts:
+            with open(args.texts[0], "r", encoding="utf-8") as f:
+                obfuscated = f.read()
+            with open(args.texts[1], "r", encoding="utf-8") as f:
+                plain = f.read()
+            mapping = _mapping_from_texts(obfuscated.strip(), plain.strip())
+        else:
+            with open(args.mapping, "r", encoding="utf-8") as f:
+                mapping = {_parse_codepoint(key): char for key, char in json.load(f).items()}
+        font_bytes = _read_font(args.font)
+    except (OSError, ValueError) as e:
+        sys.exit(f"[⚠️] {e}")
+
+    reference = GlyphReference(args.table)
+    known = sum(1 for codepoint, _ in _pua_glyphs(font_bytes) if codepoint in mapping)
+    added = reference.learn(font_bytes, mapping)
+    print(f"[ℹ️] 映射 {len(mapping)} 个码位，字体中匹配 {known} 个，新增 {added} 个参考字形，"
+          f"参考字形表共 {len(reference.table)} 个: {reference.path}")
+
+
+if __name__ == "__main__":
+    main()
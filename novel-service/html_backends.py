@@ -0,0 +1,231 @@
+"""
+番茄页面HTML解析后端
+只提取需要的节点，不同后端实现相同的提取接口：
+selectolax（lexbor，最快）> lxml（预编译XPath）> BeautifulSoup（纯Python兜底）
+返回未清洗的原始文本，清洗与URL拼接由 FanqieNovelParser 完成
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+# 目录条目：(标题, 链接, 是否付费)
+TocEntry = Tuple[str, str, bool]
+
+
+class BeautifulSoupBackend:
+    """纯Python兜底实现（html.parser）"""
+
+    name = "bs4"
+
+    @staticmethod
+    def _text(soup, selector: str) -> str:
+        node = soup.select_one(selector)
+        return node.text if node else ""
+
+    def _toc(self, soup) -> Tuple[List[TocEntry], Optional[str]]:
+        entries = []
+        for item in soup.select('div.chapter-item'):
+            title = item.select_one('a.chapter-item-title')
+            link = item.select_one('a')
+            entries.append((
+                title.text if title else "",
+                link.get('href', '') if link else "",
+                bool(item.select_one('span.chapter-item-lock'))
+            ))
+        next_link = soup.select_one('link[rel=next], a[rel=next], a.page-next')
+        return entries, next_link.get('href') if next_link else None
+
+    def extract_detail(self, html: str) -> Dict:
+        soup = BeautifulSoup(html, 'html.parser')
+        toc, next_href = self._toc(soup)
+        return {
+            "title": self._text(soup, 'div.info-name h1'),
+            "status": [s.text for s in soup.select('div.info-label span')],
+            "word_count": self._text(soup, 'div.info-count-word .detail'),
+            "last_chapter": self._text(soup, 'div.info-last .info-last-title'),
+            "last_time": self._text(soup, 'div.info-last .info-last-time'),
+            "summary": self._text(soup, 'div.page-abstract-content p'),
+            "toc": toc,
+            "next": next_href,
+        }
+
+    def extract_toc(self, html: str) -> Tuple[List[TocEntry], Optional[str]]:
+        return self._toc(BeautifulSoup(html, 'html.parser'))
+
+    def extract_chapter(self, html: str) -> Tuple[Optional[str], Optional[List[str]]]:
+        soup = BeautifulSoup(html, 'html.parser')
+        content = soup.select_one('div.muye-reader-content')
+        if not content:
+            return None, None
+        title = soup.select_one('h1.muye-reader-title')
+        paragraphs = [p.text for p in content.select('p')] or [content.text]
+        return (title.text if title else None), paragraphs
+
+
+class SelectolaxBackend:
+    """selectolax（lexbor引擎，C实现的CSS选择器）"""
+
+    name = "selectolax"
+
+    def __init__(self):
+        try:
+            from selectolax.lexbor import LexborHTMLParser
+        except ImportError:
+            from selectolax.parser import HTMLParser as LexborHTMLParser
+        self._parser_cls = LexborHTMLParser
+
+    @staticmethod
+    def _text(tree, selector: str) -> str:
+        node = tree.css_first(selector)
+        return node.text() if node else ""
+
+    def _toc(self, tree) -> Tuple[List[TocEntry], Optional[str]]:
+        entries = []
+        for item in tree.css('div.chapter-item'):
+            title = item.css_first('a.chapter-item-title')
+            link = item.css_first('a')
+            entries.append((
+                title.text() if title else "",
+                (link.attributes.get('href') or '') if link else "",
+                item.css_first('span.chapter-item-lock') is not None
+            ))
+        next_link = tree.css_first('link[rel=next], a[rel=next], a.page-next')
+        return entries, next_link.attributes.get('href') if next_link else None
+
+    def extract_detail(self, html: str) -> Dict:
+        tree = self._parser_cls(html)
+        toc, next_href = self._toc(tree)
+        return {
+            "title": self._text(tree, 'div.info-name h1'),
+            "status": [s.text() for s in tree.css('div.info-label span')],
+            "word_count": self._text(tree, 'div.info-count-word .detail'),
+            "last_chapter": self._text(tree, 'div.info-last .info-last-title'),
+            "last_time": self._text(tree, 'div.info-last .info-last-time'),
+            "summary": self._text(tree, 'div.page-abstract-content p'),
+            "toc": toc,
+            "next": next_href,
+        }
+
+    def extract_toc(self, html: str) -> Tuple[List[TocEntry], Optional[str]]:
+        return self._toc(self._parser_cls(html))
+
+    def extract_chapter(self, html: str) -> Tuple[Optional[str], Optional[List[str]]]:
+        tree = self._parser_cls(html)
+        content = tree.css_first('div.muye-reader-content')
+        if content is None:
+            return None, None
+        title = tree.css_first('h1.muye-reader-title')
+        paragraphs = [p.text() for p in content.css('p')] or [content.text()]
+        return (title.text() if title else None), paragraphs
+
+
+def _cls(name: str) -> str:
+    """XPath类名匹配（等价于CSS的 .name）"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class LxmlBackend:
+    """lxml（libxml2解析 + 预编译XPath）"""
+
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html
+        from lxml import etree
+        self._fromstring = lxml.html.fromstring
+        xp = etree.XPath
+        self._title = xp(f"//div[{_cls('info-name')}]//h1")
+        self._status = xp(f"//div[{_cls('info-label')}]//span")
+        self._word_count = xp(f"//div[{_cls('info-count-word')}]//*[{_cls('detail')}]")
+        self._last_chapter = xp(f"//div[{_cls('info-last')}]//*[{_cls('info-last-title')}]")
+        self._last_time = xp(f"//div[{_cls('info-last')}]//*[{_cls('info-last-time')}]")
+        self._summary = xp(f"//div[{_cls('page-abstract-content')}]//p")
+        self._toc_items = xp(f"//div[{_cls('chapter-item')}]")
+        self._item_title = xp(f".//a[{_cls('chapter-item-title')}]")
+        self._item_link = xp(".//a")
+        self._item_lock = xp(f".//span[{_cls('chapter-item-lock')}]")
+        self._next = xp(f"//link[@rel='next'] | //a[@rel='next'] | //a[{_cls('page-next')}]")
+        self._chapter_title = xp(f"//h1[{_cls('muye-reader-title')}]")
+        self._chapter_content = xp(f"//div[{_cls('muye-reader-content')}]")
+        self._paragraphs = xp(".//p")
+
+    def _parse(self, html: str):
+        return self._fromstring(html) if html and html.strip() else None
+
+    @staticmethod
+    def _first_text(nodes) -> str:
+        return nodes[0].text_content() if nodes else ""
+
+    def _toc(self, root) -> Tuple[List[TocEntry], Optional[str]]:
+        entries = []
+        for item in self._toc_items(root):
+            links = self._item_link(item)
+            entries.append((
+                self._first_text(self._item_title(item)),
+                links[0].get('href', '') if links else "",
+                bool(self._item_lock(item))
+            ))
+        next_links = self._next(root)
+        return entries, next_links[0].get('href') if next_links else None
+
+    def extract_detail(self, html: str) -> Dict:
+        root = self._parse(html)
+        if root is None:
+            return BeautifulSoupBackend().extract_detail("")
+        toc, next_href = self._toc(root)
+        return {
+            "title": self._first_text(self._title(root)),
+            "status": [s.text_content() for s in self._status(root)],
+            "word_count": self._first_text(self._word_count(root)),
+            "last_chapter": self._first_text(self._last_chapter(root)),
+            "last_time": self._first_text(self._last_time(root)),
+            "summary": self._first_text(self._summary(root)),
+            "toc": toc,
+            "next": next_href,
+        }
+
+    def extract_toc(self, html: str) -> Tuple[List[TocEntry], Optional[str]]:
+        root = self._parse(html)
+        return self._toc(root) if root is not None else ([], None)
+
+    def extract_chapter(self, html: str) -> Tuple[Optional[str], Optional[List[str]]]:
+        root = self._parse(html)
+        contents = self._chapter_content(root) if root is not None else []
+        if not contents:
+            return None, None
+        titles = self._chapter_title(root)
+        paragraphs = [p.text_content() for p in self._paragraphs(contents[0])] or [contents[0].text_content()]
+        return (titles[0].text_content() if titles else None), paragraphs
+
+
+BACKENDS = {
+    SelectolaxBackend.name: SelectolaxBackend,
+    LxmlBackend.name: LxmlBackend,
+    BeautifulSoupBackend.name: BeautifulSoupBackend,
+}
+
+
+def available_backends() -> List[str]:
+    """当前环境可用的后端（按速度优先级排序）"""
+    names = []
+    for name, backend_cls in BACKENDS.items():
+        try:
+            backend_cls()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_html_backend(name: Optional[str] = None):
+    """获取解析后端：指定名称（或FANQIE_HTML_BACKEND）优先，否则选择最快的可用后端"""
+    name = name or os.getenv("FANQIE_HTML_BACKEND")
+    if name:
+        return BACKENDS[name]()
+    for backend_cls in BACKENDS.values():
+        try:
+            return backend_cls()
+        except ImportError:
+            continue
+    return BeautifulSoupBackend()
@@ -0,0 +1,129 @@
+"""
+HTTP响应压缩与条件请求
+- CompressionMiddleware：按 Accept-Encoding 对较大的一次性响应做 brotli（需要 brotli）或 gzip 压缩；
+  流式响应（NDJSON/SSE）逐条发送，不压缩
+- 强ETag按表示区分：压缩后的响应在ETag末尾加上编码后缀（"<摘要>-gzip"），
+  比较 If-None-Match 时去掉后缀，客户端持有任一编码的ETag都能得到304
+"""
+import gzip
+import hashlib
+from typing import Iterable, Optional
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    brotli = None
+    HAS_BROTLI = False
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # JSON上压缩率优于gzip 6，耗时约为其两倍
+THREAD_MINIMUM_SIZE = 256 * 1024  # 超过此大小的响应在线程中压缩，不阻塞事件循环
+_ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+def make_etag(*parts) -> str:
+    """由若干组成部分生成强ETag"""
+    digest = hashlib.blake2b("\x1f".join(str(part) for part in parts).encode("utf-8"), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def _strip_etag(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in _ENCODING_SUFFIXES:
+        if tag.endswith(f'{suffix}"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否与ETag匹配（GET请求使用弱比较，忽略压缩编码后缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _strip_etag(etag) in (_strip_etag(tag) for tag in if_none_match.split(","))
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩编码：br 优先（brotli可用时），其次gzip"""
+    accepted = set()
+    for token in accept_encoding.lower().split(","):
+        name, _, params = token.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if HAS_BROTLI and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """压缩较大的一次性响应（纯ASGI中间件，不缓冲流式响应）"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024,
+                 exclude_content_types: Iterable[str] = ("text/event-stream",)):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.exclude_content_types = tuple(exclude_content_types)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        pending_start: Optional[Message] = None
+
+        async def send_wrapper(message: Message):
+            nonlocal pending_start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or headers.get("content-type", "").startswith(self.exclude_content_types):
+                    await send(message)  # 流式响应立即发送响应头
+                else:
+                    pending_start = message
+                return
+            if message["type"] != "http.response.body" or pending_start is None:
+                await send(message)
+                return
+            start, pending_start = pending_start, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body") or len(body) < self.minimum_size:
+                await send(start)
+                await send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            if encoding:
+                if len(body) >= THREAD_MINIMUM_SIZE:
+                    body = await anyio.to_thread.run_sync(compress_body, body, encoding)
+                else:
+                    body = compress_body(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/") and etag.endswith('"'):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,48 @@
+"""
+JSON编解码
+上下文文件读写、流式事件与API响应统一使用这里的编解码函数：
+有 orjson 时使用 orjson（比标准库快数倍），否则使用标准库 json，两者输出均为UTF-8、不转义非ASCII字符
+orjson 不支持的数据（如超过64位的整数）自动退回标准库
+"""
+import json
+import sys
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    HAS_ORJSON = False
+    print("[⚠️] orjson不可用，JSON编解码使用标准库", file=sys.stderr)
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError 是它的子类
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if HAS_ORJSON else 0
+
+
+def dumps_bytes(obj: Any, pretty: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """序列化为UTF-8字节（pretty 时缩进两格，与原有的文件格式一致）"""
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(obj, default=default,
+                                option=_ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if pretty else 0))
+        except TypeError:
+            pass  # orjson.JSONEncodeError 是 TypeError 的子类，交给标准库处理或报错
+    if pretty:
+        text = json.dumps(obj, ensure_ascii=False, indent=2, default=default)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default)
+    return text.encode("utf-8")
+
+
+def dumps(obj: Any, pretty: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """序列化为字符串"""
+    return dumps_bytes(obj, pretty, default).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    """解析JSON（格式错误时抛出 JSONDecodeError）"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
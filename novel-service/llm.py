@@ -1,21 +1,168 @@
 import os
+import time
+import openai
 from langchain_openai import ChatOpenAI
+import metrics
+import tracing
+from rate_limiter import get_governor, parse_retry_after, RateLimitedError
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter")
+# 限流配置（OpenRouter免费模型默认20次/分钟）
+LLM_RPM = float(os.getenv("LLM_RPM", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
 
-if LLM_PROVIDER == "internal":
-    base_llm = ChatOpenAI(base_url=os.getenv("INTERNAL_LLM_URL","http://model-api.desaysv.com"),
-                          api_key=os.getenv("INTERNAL_API_KEY",""),
-                          model="deepseek-v3.2",
-                          temperature=0.3,
-                          streaming=False)
+tracer = tracing.get_tracer(__name__)
+
+
+class GovernedChatOpenAI(ChatOpenAI):
+    """经过共享限流器调度的ChatOpenAI：同一provider/model的所有调用公平排队，429时按Retry-After退避重试"""
+
+    @property
+    def governor_key(self) -> str:
+        return f"{self.openai_api_base}|{self.model_name}"
+
+    def _governor(self):
+        return get_governor(self.governor_key, LLM_RPM, LLM_MAX_CONCURRENCY)
+
+    def _observe_call(self, start: float, outcome: str, span=tracing.INVALID_SPAN):
+        """记录一次调用（获得限流许可之后）的耗时"""
+        provider, model = metrics.llm_labels(self)
+        metrics.LLM_REQUEST_DURATION.observe(time.perf_counter() - start, provider=provider, model=model,
+                                             outcome=outcome)
+        span.add_event("attempt", {"outcome": outcome, "duration_ms": round((time.perf_counter() - start) * 1000, 3)})
+
+    def _start_span(self):
+        """一次模型调用（含限流排队与429重试）的span"""
+        provider, model = metrics.llm_labels(self)
+        return tracer.start_span("llm.call", {"llm.provider": provider, "llm.model": model})
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        span = self._start_span()
+        with tracing.use_span(span, end_on_exit=True):
+            try:
+                result = await self._agenerate_governed(span, messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                span.record_exception(e)
+                span.set_status(tracing.ERROR, str(e)[:200])
+                raise
+            usage = (result.llm_output or {}).get("token_usage") or {}
+            span.set_attributes({f"llm.{key}": value for key, value in usage.items() if isinstance(value, int)})
+            return result
+
+    async def _agenerate_governed(self, span, messages, stop=None, run_manager=None, **kwargs):
+        governor = self._governor()
+        retry_after = None
+        for _ in range(LLM_RATE_LIMIT_RETRIES + 1):
+            async with governor.slot():
+                start = time.perf_counter()
+                try:
+                    result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                except openai.RateLimitError as e:
+                    self._observe_call(start, "rate_limited", span)
+                    retry_after = parse_retry_after(getattr(e.response, "headers", None))
+                    governor.record_rate_limited(retry_after)
+                    continue
+                except Exception:
+                    self._observe_call(start, "error", span)
+                    raise
+                self._observe_call(start, "ok", span)
+            governor.record_success()
+            return result
+        raise RateLimitedError(self.governor_key, retry_after)
+
+    async def _astream(self, *args, **kwargs):
+        # 生成器跨越多次yield，span不设为当前span，只记录首段内容时间与各次尝试
+        span = self._start_span()
+        try:
+            governor = self._governor()
+            retry_after = None
+            for _ in range(LLM_RATE_LIMIT_RETRIES + 1):
+                started = False
+                async with governor.slot():
+                    start = time.perf_counter()
+                    try:
+                        async for chunk in super()._astream(*args, **kwargs):
+                            if not started:
+                                span.add_event("first_chunk")
+                            started = True
+                            yield chunk
+                    except openai.RateLimitError as e:
+                        self._observe_call(start, "rate_limited", span)
+                        if started:
+                            raise
+                        retry_after = parse_retry_after(getattr(e.response, "headers", None))
+                        governor.record_rate_limited(retry_after)
+                        continue
+                    except Exception:
+                        self._observe_call(start, "error", span)
+                        raise
+                    self._observe_call(start, "ok", span)
+                governor.record_success()
+                return
+            raise RateLimitedError(self.governor_key, retry_after)
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(tracing.ERROR, str(e)[:200])
+            raise
+        finally:
+            span.end()
+
+
+# max_retries=0：429交给限流器统一退避，避免SDK内部重试绕过排队
+def _internal_llm():
+    return GovernedChatOpenAI(base_url=os.getenv("INTERNAL_LLM_URL","http://model-api.desaysv.com"),
+                              api_key=os.getenv("INTERNAL_API_KEY",""),
+                              model="deepseek-v3.2",
+                              temperature=0.3,
+                              streaming=False,
+                              max_retries=0)
+
+
+def _openrouter_llm(model: str):
+    return GovernedChatOpenAI(base_url="https://openrouter.ai/api/v1",
+                              api_key=os.getenv("OPENROUTER_API_KEY",""),
+                              model=model,
+                              temperature=0.3,
+                              streaming=False,
+                              max_retries=0,
+                              default_headers={"HTTP-Referer":"https://novel-app.local",
+                                               "X-Title":"Novel Assistant"})
+
+
+def _local_llm():
+    """本地OpenAI兼容替身（如Ollama/llama.cpp server）"""
+    return GovernedChatOpenAI(base_url=os.getenv("LOCAL_LLM_URL"),
+                              api_key=os.getenv("LOCAL_API_KEY","local"),
+                              model=os.getenv("LOCAL_LLM_MODEL","local-model"),
+                              temperature=0.3,
+                              streaming=False,
+                              max_retries=0)
+
+
+def _build_backends() -> list:
+    """按LLM_PROVIDER确定首选后端，其余已配置的后端作为备选"""
+    from llm_router import Backend
+    openrouter_models = [os.getenv("OPENROUTER_MODEL","tencent/hy3-preview:free")]
+    openrouter_models += [m.strip() for m in os.getenv("OPENROUTER_FALLBACK_MODELS","").split(",") if m.strip()]
+    openrouter = lambda: [Backend(f"openrouter:{m}", _openrouter_llm(m)) for m in openrouter_models]
+    internal = lambda: [Backend("internal", _internal_llm())]
+
+    if LLM_PROVIDER == "internal":
+        backends = internal() + (openrouter() if os.getenv("OPENROUTER_API_KEY") else [])
+    else:
+        backends = openrouter() + (internal() if os.getenv("INTERNAL_API_KEY") else [])
+    if os.getenv("LOCAL_LLM_URL"):
+        backends.append(Backend("local", _local_llm()))
+    return backends
+
+
+_backends = _build_backends()
+base_llm = _backends[0].model
+
+if len(_backends) > 1:
+    from llm_router import RoutedChatOpenAI
+    # 对冲延迟（秒）：无延迟样本时使用，有样本后取首选后端的p95；<=0关闭对冲
+    llm = RoutedChatOpenAI.from_backends(_backends, hedge_delay=float(os.getenv("LLM_HEDGE_DELAY", "20")))
 else:
-    base_llm = ChatOpenAI(base_url="https://openrouter.ai/api/v1",
-                          api_key=os.getenv("OPENROUTER_API_KEY",""),
-                          model=os.getenv("OPENROUTER_MODEL","tencent/hy3-preview:free"),
-                          temperature=0.3,
-                          streaming=False,
-                          default_headers={"HTTP-Referer":"https://novel-app.local",
-                                           "X-Title":"Novel Assistant"})
-
-llm = base_llm
+    llm = base_llm
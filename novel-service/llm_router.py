@@ -0,0 +1,211 @@
+"""
+多后端模型路由
+维护多个OpenAI兼容后端（OpenRouter模型、内部接口、本地替身），统计每个后端的
+p50/p95延迟与错误率，每次调用路由到最健康的后端；慢请求超过对冲延迟后向次优后端
+发起对冲请求，失败时透明切换到下一个后端
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
+
+
+class LatencyTracker:
+    """滑动窗口内的延迟与错误率统计"""
+
+    def __init__(self, window: int = 50):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)  # True表示成功
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # 熔断截止时间
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+
+    def record_failure(self, cooldown: float, threshold: int = 3):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= threshold:
+            self.open_until = time.monotonic() + cooldown
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+
+class Backend:
+    """一个可路由的模型后端"""
+
+    def __init__(self, name: str, model: ChatOpenAI):
+        self.name = name
+        self.model = model
+        self.tracker = LatencyTracker()
+
+    def score(self, default_latency: float) -> float:
+        """健康分（越小越好）：p50延迟按错误率放大，从未调用过时为0（优先探索）"""
+        if not self.tracker.outcomes:
+            return 0.0
+        p50 = self.tracker.percentile(0.5)
+        if p50 is None:
+            # 只有失败记录，按默认延迟计算
+            p50 = default_latency
+        return p50 * (1 + 4 * self.tracker.error_rate)
+
+    def stats(self) -> Dict[str, Any]:
+        p50 = self.tracker.percentile(0.5)
+        p95 = self.tracker.percentile(0.95)
+        return {
+            "name": self.name,
+            "model": self.model.model_name,
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.tracker.error_rate, 3),
+            "samples": len(self.tracker.outcomes),
+            "circuit_open": self.tracker.is_open,
+        }
+
+
+class RoutedChatOpenAI(ChatOpenAI):
+    """按后端健康度路由的ChatOpenAI
+
+    继承ChatOpenAI以复用bind_tools等能力（agent绑定工具后参数原样透传给后端），
+    自身的客户端不会被使用，实际请求全部交给各后端模型完成
+    """
+
+    hedge_delay: float = 20.0  # 无延迟样本时的对冲延迟（秒），<=0表示不对冲
+    failure_cooldown: float = 30.0  # 连续失败后的熔断时长（秒）
+
+    _backends: List[Backend] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def from_backends(cls, backends: List[Backend], **kwargs) -> "RoutedChatOpenAI":
+        """以首个后端的连接参数构造路由器"""
+        primary = backends[0].model
+        api_key = primary.openai_api_key
+        if hasattr(api_key, 'get_secret_value'):
+            api_key = api_key.get_secret_value()
+        router = cls(base_url=primary.openai_api_base, api_key=api_key, model=primary.model_name,
+                     temperature=primary.temperature, streaming=False, **kwargs)
+        router._backends = list(backends)
+        return router
+
+    @property
+    def backends(self) -> List[Backend]:
+        return self._backends
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-openai-chat"
+
+    def _ranked_backends(self) -> List[Backend]:
+        """按健康分排序（熔断中的后端排在最后，分数相同时保持配置顺序）"""
+        return sorted(self._backends, key=lambda b: (b.tracker.is_open, b.score(self.hedge_delay)))
+
+    def _hedge_delay_for(self, backend: Backend) -> Optional[float]:
+        if self.hedge_delay <= 0:
+            return None
+        p95 = backend.tracker.percentile(0.95)
+        if p95 is None or len(backend.tracker.latencies) < 5:
+            return self.hedge_delay
+        return p95
+
+    async def _call_backend(self, backend: Backend, messages, stop, **kwargs):
+        start = time.monotonic()
+        try:
+            result = await backend.model._agenerate(messages, stop=stop, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            backend.tracker.record_failure(self.failure_cooldown)
+            raise
+        backend.tracker.record_success(time.monotonic() - start)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        ranked = self._ranked_backends()
+        pending: Dict[asyncio.Task, Backend] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch():
+            backend = ranked.pop(0)
+            task = asyncio.create_task(self._call_backend(backend, messages, stop, **kwargs))
+            pending[task] = backend
+            return backend
+
+        try:
+            current = launch()
+            while pending:
+                timeout = self._hedge_delay_for(current) if ranked else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过对冲延迟仍未返回，向次优后端发起对冲请求
+                    current = launch()
+                    continue
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                if not pending and ranked:
+                    # 全部在途请求失败，切换到下一个后端
+                    current = launch()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        """同步调用：按健康度依次尝试（不对冲）"""
+        last_error: Optional[BaseException] = None
+        for backend in self._ranked_backends():
+            start = time.monotonic()
+            try:
+                result = backend.model._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                backend.tracker.record_failure(self.failure_cooldown)
+                last_error = e
+                continue
+            backend.tracker.record_success(time.monotonic() - start)
+            return result
+        raise last_error
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        last_error: Optional[BaseException] = None
+        for backend in self._ranked_backends():
+            start = time.monotonic()
+            started = False
+            try:
+                async for chunk in backend.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                backend.tracker.record_failure(self.failure_cooldown)
+                if started:
+                    # 已经输出部分内容，无法透明切换
+                    raise
+                last_error = e
+                continue
+            backend.tracker.record_success(time.monotonic() - start)
+            return
+        raise last_error
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各后端健康状态"""
+        return [backend.stats() for backend in self._backends]
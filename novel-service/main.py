@@ -71,7 +71,8 @@ def show_save_menu(content: str) -> str:
                 ctx_id = advanced_context_manager.create_context(
                     name=name,
                     context_type=context_type,
-                    content=content
+                    content=content,
+                    select=True
                 )
                 return f"✅ 已创建并保存到新上下文: {name} ({ctx_id})"
             else:
@@ -206,7 +207,7 @@ def handle_context_command(command: str) -> str:
                 available_types = ", ".join([ct.value for ct in ContextType])
                 return f"❌ 无效的上下文类型。可用类型: {available_types}"
             
-            ctx_id = advanced_context_manager.create_context(name, context_type, "")
+            ctx_id = advanced_context_manager.create_context(name, context_type, "", select=True)
             return f"✅ 已创建上下文: {ctx_id}"
         
         elif subcmd == "delete" and len(parts) > 2:
@@ -441,7 +442,8 @@ def handle_context_command(command: str) -> str:
                     ctx_id = advanced_context_manager.create_context(
                         name=name,
                         context_type=context_type,
-                        content=content
+                        content=content,
+                        select=True
                     )
                     return f"✅ 已创建并保存到新 {context_type.value} 上下文: {name} ({ctx_id})"
             else:
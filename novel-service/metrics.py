@@ -0,0 +1,306 @@
+"""
+运行指标
+进程内收集计数器、仪表与直方图，GET /metrics 以Prometheus文本格式（0.0.4）输出，不依赖 prometheus_client：
+- HTTP：按路由模板统计请求耗时与进行中的请求数
+- 大模型：每次调用的耗时与结果（按provider/model）、生成的首个内容耗时、token用量、限流器排队深度
+- 工具：novel_tool 等工具的执行耗时
+- 存储：上下文文件的写入耗时与大小、启动加载耗时、存储线程的待写入数量
+- 事件循环延迟、抓取线程池排队深度
+记录操作只是加锁更新字典中的数值；METRICS_ENABLED=0 时记录操作直接返回，/metrics 不可用
+多worker部署时每个进程各自统计（由Prometheus按实例抓取后汇总）
+"""
+import asyncio
+import bisect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 耗时直方图的默认分桶（秒），覆盖毫秒级的接口与分钟级的生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 字节数直方图的分桶
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """指标注册表：按注册顺序输出全部指标"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"[⚠️] 指标 {metric.name} 输出失败: {e}", file=sys.stderr)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """可增可减的当前值；也可以设置回调，在输出时读取（如队列长度）"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelKey, float]]] = None
+
+    def set(self, value: float, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Dict[LabelKey, float]]):
+        """输出时调用 function 取值：返回 {标签值元组: 数值}（无标签时键为空元组）"""
+        self._function = function
+
+    def render(self) -> List[str]:
+        if self._function is not None:
+            values = list(self._function().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """分桶统计观测值的分布（输出累计桶、总和与次数）"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, list] = {}  # 标签 -> [各桶次数（非累计，末位为+Inf）, 总和, 次数]
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        bucket_names = self.labelnames + ("le",)
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_names, key + (_format_value(bound),))} "
+                             f"{cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def llm_labels(llm) -> Tuple[str, str]:
+    """模型对象的 (provider, model) 标签：provider 取接口地址的主机名，多后端路由器记为 router"""
+    model = str(getattr(llm, "model_name", "") or type(llm).__name__)
+    if hasattr(llm, "backends"):
+        return "router", model
+    base_url = getattr(llm, "openai_api_base", None) or ""
+    return urlparse(base_url).hostname or "unknown", model
+
+
+# ==================== 指标定义 ====================
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（流式响应计到响应结束）", ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "正在处理的HTTP请求数")
+
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "单次大模型调用耗时（不含限流排队）", ("provider", "model", "outcome"))
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "生成开始到返回首段内容的耗时", ("provider", "model"))
+LLM_GENERATION_DURATION = Histogram(
+    "llm_generation_duration_seconds", "一次Agent生成（含多次模型与工具调用）的耗时", ("provider", "model", "outcome"))
+LLM_TOKENS = Counter("llm_tokens_total", "大模型token用量", ("provider", "model", "kind"))
+LLM_MODEL_CALLS = Counter("llm_model_calls_total", "Agent生成中的模型调用次数", ("provider", "model"))
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "限流器中排队等待的模型调用数", ("key",))
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "限流器放行、正在进行的模型调用数", ("key",))
+
+TOOL_CALL_DURATION = Histogram("tool_call_duration_seconds", "工具执行耗时", ("tool", "outcome"))
+
+STORE_WRITE_DURATION = Histogram(
+    "context_store_write_seconds", "上下文文件序列化并原子写入的耗时",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+STORE_WRITE_BYTES = Histogram("context_store_write_bytes", "写入的上下文文件大小", buckets=SIZE_BUCKETS)
+STORE_LOAD_DURATION = Histogram("context_store_load_seconds", "分片启动时加载全部上下文的耗时")
+STORE_LOAD_BYTES = Counter("context_store_load_bytes_total", "启动加载读取的上下文文件字节数")
+STORE_LOADED_CONTEXTS = Counter("context_store_loaded_contexts_total", "启动加载的上下文数")
+STORE_IO_QUEUE_DEPTH = Gauge("context_store_io_queue_depth", "已提交、尚未由存储线程执行完的文件操作数")
+
+SCRAPE_QUEUE_DEPTH = Gauge("scrape_queue_depth", "抓取线程池中排队等待的任务数")
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_last_seconds", "最近一次测得的事件循环延迟")
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "event_loop_lag_seconds", "事件循环延迟的分布",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+# ==================== HTTP ====================
+
+class MetricsMiddleware:
+    """
+    记录每个HTTP请求的耗时与状态码（纯ASGI中间件）
+    路由标签取路由模板（如 /api/context/{context_id}），未匹配任何路由的请求记为 unmatched，避免路径造成标签膨胀
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start_event_loop_monitor()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=scope["method"], route=route,
+                                          status=status)
+
+
+# ==================== 事件循环延迟 ====================
+
+EVENT_LOOP_LAG_INTERVAL = 0.5  # 秒
+_lag_monitor: Optional[asyncio.Task] = None
+
+
+async def _monitor_event_loop(interval: float):
+    """定期休眠，实际唤醒时间比预期晚出的部分即事件循环被阻塞的时长"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+def start_event_loop_monitor(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    """在当前事件循环中启动延迟监测（已启动时跳过，须在事件循环中调用）"""
+    global _lag_monitor
+    loop = asyncio.get_running_loop()
+    if not ENABLED or (_lag_monitor is not None and not _lag_monitor.done() and _lag_monitor.get_loop() is loop):
+        return
+    _lag_monitor = loop.create_task(_monitor_event_loop(interval))
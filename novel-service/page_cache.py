@@ -0,0 +1,157 @@
+"""
+持久化页面缓存
+按规范化URL缓存原始HTML与解析结果：TTL内直接返回，过期但在stale窗口内先返回旧数据
+并在后台重新验证（stale-while-revalidate），超出总大小上限时按LRU淘汰
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+def normalize_book_url(url: str) -> str:
+    """规范化番茄小说详情页URL：统一https与小写域名，去掉查询参数、锚点和末尾斜杠"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    return f"https://{host}{path}"
+
+
+class PageCache:
+    """磁盘持久化的页面缓存（每个URL一个JSON文件，内存中只保留索引；索引在首次使用时建立）"""
+
+    def __init__(self, cache_dir: str = "cache/fanqie", ttl: float = 3600,
+                 stale_ttl: float = 86400, max_bytes: int = 50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        # key -> (文件名, 抓取时间, 字节数)，按最近使用排序
+        self._index: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._revalidating = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @staticmethod
+    def _filename(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+
+    def _ensure_index(self):
+        """首次使用时扫描缓存目录重建索引（调用方持有锁）"""
+        if not self._loaded:
+            self._loaded = True
+            self._load_index()
+
+    def _load_index(self):
+        """扫描缓存目录重建索引（按抓取时间排序）"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".json"):
+                continue
+            filepath = os.path.join(self.cache_dir, filename)
+            try:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                entries.append((data["key"], filename, data["fetched_at"], os.path.getsize(filepath)))
+            except Exception as e:
+                print(f"[⚠️] 加载页面缓存失败 {filename}: {e}", file=sys.stderr)
+        for key, filename, fetched_at, size in sorted(entries, key=lambda e: e[2]):
+            self._index[key] = (filename, fetched_at, size)
+            self._total_bytes += size
+
+    def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """返回 (缓存条目, 状态)，状态为 fresh / stale / miss"""
+        with self._lock:
+            self._ensure_index()
+            meta = self._index.get(key)
+            if meta is None:
+                return None, MISS
+            filename, fetched_at, _ = meta
+            age = time.time() - fetched_at
+            if age >= self.ttl + self.stale_ttl:
+                return None, MISS
+            self._index.move_to_end(key)
+        try:
+            with open(os.path.join(self.cache_dir, filename), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except Exception:
+            self.invalidate(key)
+            return None, MISS
+        return entry, FRESH if age < self.ttl else STALE
+
+    def put(self, key: str, html: str, parsed: Any):
+        """写入缓存（原子替换），并按大小上限淘汰最久未使用的条目"""
+        filename = self._filename(key)
+        filepath = os.path.join(self.cache_dir, filename)
+        entry = {"key": key, "fetched_at": time.time(), "html": html, "parsed": parsed}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = filepath + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, filepath)
+            size = os.path.getsize(filepath)
+        except Exception as e:
+            print(f"[⚠️] 写入页面缓存失败 {key}: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            self._ensure_index()
+            old = self._index.pop(key, None)
+            if old:
+                self._total_bytes -= old[2]
+            self._index[key] = (filename, entry["fetched_at"], size)
+            self._total_bytes += size
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                _, (old_file, _, old_size) = self._index.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_file)
+        for old_file in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_file))
+            except OSError:
+                pass
+
+    def invalidate(self, key: str):
+        """删除缓存条目"""
+        with self._lock:
+            self._ensure_index()
+            meta = self._index.pop(key, None)
+            if meta:
+                self._total_bytes -= meta[2]
+        if meta:
+            try:
+                os.remove(os.path.join(self.cache_dir, meta[0]))
+            except OSError:
+                pass
+
+    def begin_revalidate(self, key: str) -> bool:
+        """标记后台重新验证开始；已有重新验证在进行时返回False"""
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def end_revalidate(self, key: str):
+        with self._lock:
+            self._revalidating.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._ensure_index()
+            return {"entries": len(self._index), "bytes": self._total_bytes, "max_bytes": self.max_bytes}
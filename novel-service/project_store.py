@@ -0,0 +1,190 @@
+"""
+项目分片
+每个项目是独立的数据分片（各自的目录、存储线程与多worker协调库），按需加载、空闲后卸载：
+- default 项目使用数据目录本身（兼容原有布局），即全局的 advanced_context_manager
+- 其他项目位于 <数据目录>/projects/<项目ID>/，目录结构与 default 相同
+- 项目信息仍是数据目录下的 project_<项目ID>.json
+旧版本中混在 default 目录里的其他项目的上下文，在启动时迁移到各自的分片
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import storage_format
+from blob_store import BlobStore, referenced_digests
+from context_manager import AdvancedContextManager, advanced_context_manager
+from session_state import DEFAULT_PROJECT
+
+_PROJECT_ID_RE = re.compile(r"^[\w\-]{1,64}$")
+
+
+class ProjectNotFoundError(KeyError):
+    """项目不存在"""
+
+
+class ProjectRegistry:
+    """项目分片注册表：按需加载分片，卸载空闲超时或超出数量上限的分片"""
+
+    def __init__(self, default_manager: AdvancedContextManager,
+                 idle_timeout: float = 600.0, max_loaded: int = 16):
+        self.default_manager = default_manager
+        self.data_dir = default_manager.data_dir
+        self.idle_timeout = idle_timeout
+        self.max_loaded = max_loaded
+        self._shards: Dict[str, AdvancedContextManager] = {}
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._migrate_legacy_contexts()
+
+    @staticmethod
+    def validate_project_id(project_id: str) -> str:
+        if not _PROJECT_ID_RE.match(project_id or ""):
+            raise ValueError(f"无效的项目ID: {project_id}")
+        return project_id
+
+    def _shard_dir(self, project_id: str) -> str:
+        return os.path.join(self.data_dir, AdvancedContextManager.PROJECTS_SUBDIR, project_id)
+
+    def _project_file(self, project_id: str) -> str:
+        return os.path.join(self.data_dir, f"project_{project_id}.json")
+
+    def exists(self, project_id: str) -> bool:
+        return (project_id == DEFAULT_PROJECT
+                or os.path.exists(self._project_file(project_id))
+                or os.path.isdir(self._shard_dir(project_id)))
+
+    def get(self, project_id: str = DEFAULT_PROJECT) -> AdvancedContextManager:
+        """获取项目分片（未加载时加载），项目不存在时抛出 ProjectNotFoundError"""
+        if project_id == DEFAULT_PROJECT:
+            return self.default_manager
+        self.validate_project_id(project_id)
+        with self._lock:
+            self._last_used[project_id] = time.time()
+            shard = self._shards.get(project_id)
+            if shard is None:
+                if not self.exists(project_id):
+                    raise ProjectNotFoundError(project_id)
+                shard = AdvancedContextManager(self._shard_dir(project_id), project_id=project_id,
+                                               sessions=self.default_manager.sessions,
+                                               file_format=self.default_manager.storage_format)
+                self._shards[project_id] = shard
+            evicted = self._pick_evictions(keep=project_id)
+        for shard_to_close in evicted:
+            shard_to_close.close()
+        return shard
+
+    def _pick_evictions(self, keep: Optional[str] = None) -> List[AdvancedContextManager]:
+        """从已加载分片中移除空闲超时的与超出数量上限的（最久未使用的先卸载），返回待关闭的分片"""
+        now = time.time()
+        by_age = sorted((pid for pid in self._shards if pid != keep), key=lambda pid: self._last_used.get(pid, 0.0))
+        evict = [pid for pid in by_age if now - self._last_used.get(pid, 0.0) > self.idle_timeout]
+        overflow = len(self._shards) - len(evict) - self.max_loaded
+        if overflow > 0:
+            evict.extend([pid for pid in by_age if pid not in evict][:overflow])
+        evicted = []
+        for pid in evict:
+            evicted.append(self._shards.pop(pid))
+            self._last_used.pop(pid, None)
+        return evicted
+
+    def unload_idle(self) -> int:
+        """卸载空闲超时的分片，返回卸载数量"""
+        with self._lock:
+            evicted = self._pick_evictions()
+        for shard in evicted:
+            shard.close()
+        return len(evicted)
+
+    def create_project(self, project_id: str, name: str, session_id: Optional[str] = None) -> Dict:
+        """创建项目（写入项目信息并加载分片），指定会话时设为该会话的当前项目"""
+        self.validate_project_id(project_id)
+        if self.exists(project_id):
+            raise ValueError(f"项目已存在: {project_id}")
+        project_data = {"id": project_id, "name": name, "created_at": datetime.now().isoformat()}
+        AdvancedContextManager._dump_json(self._project_file(project_id), project_data)
+        self.get(project_id)
+        if session_id:
+            self.default_manager.sessions.set_project(session_id, project_id)
+        return project_data
+
+    def _read_project_info(self, project_id: str) -> Dict:
+        try:
+            with open(self._project_file(project_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"id": project_id, "name": project_id}
+
+    def list_projects(self) -> List[Dict]:
+        """列出所有项目（未加载的分片不读取上下文，上下文数量为空）"""
+        self.unload_idle()
+        project_ids = {DEFAULT_PROJECT}
+        for filename in os.listdir(self.data_dir):
+            if filename.startswith("project_") and filename.endswith(".json"):
+                project_ids.add(filename[len("project_"):-len(".json")])
+        projects_root = os.path.join(self.data_dir, AdvancedContextManager.PROJECTS_SUBDIR)
+        if os.path.isdir(projects_root):
+            project_ids.update(name for name in os.listdir(projects_root)
+                               if os.path.isdir(os.path.join(projects_root, name)))
+
+        result = []
+        with self._lock:
+            loaded = dict(self._shards)
+        loaded[DEFAULT_PROJECT] = self.default_manager
+        for project_id in sorted(project_ids):
+            info = self._read_project_info(project_id)
+            shard = loaded.get(project_id)
+            result.append({
+                "id": project_id,
+                "name": info.get("name", project_id),
+                "created_at": info.get("created_at"),
+                "loaded": shard is not None,
+                "context_count": len(shard.contexts) if shard is not None else None
+            })
+        return result
+
+    def _migrate_legacy_contexts(self):
+        """把 default 目录中属于其他项目的上下文迁移到各自的分片"""
+        manager = self.default_manager
+        with manager._lock:
+            manager.flush()
+            legacy = [context for context in manager.contexts.values()
+                      if context.project_id and context.project_id != DEFAULT_PROJECT
+                      and _PROJECT_ID_RE.match(context.project_id)]
+            if not legacy:
+                return
+            for context in legacy:
+                source = manager._get_context_filepath(context.id, context.type)
+                target = os.path.join(self._shard_dir(context.project_id), os.path.relpath(source, manager.data_dir))
+                try:
+                    # 先复制上下文文件引用的blob，再移动文件
+                    digests = referenced_digests(storage_format.load_file(source))
+                    target_blobs = BlobStore(self._shard_dir(context.project_id), manager.storage_format)
+                    for digest in digests:
+                        text = manager.blobs.get(digest)
+                        if text is not None:
+                            target_blobs.put(digest, text)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(source, target)
+                except FileNotFoundError:
+                    pass  # 其他worker已迁移
+                except (OSError, ValueError) as e:
+                    print(f"[⚠️] 迁移上下文到项目分片失败 {context.id}: {e}", file=sys.stderr)
+                    continue
+                del manager.contexts[context.id]
+                manager.texts.set_refs(context.id, Counter())
+            manager._rebuild_tree_structure()
+        print(f"[ℹ️] 已将 {len(legacy)} 个上下文迁移到各自的项目分片")
+
+
+# 全局实例
+project_registry = ProjectRegistry(
+    advanced_context_manager,
+    idle_timeout=float(os.getenv("PROJECT_IDLE_TIMEOUT", "600")),
+    max_loaded=int(os.getenv("PROJECT_MAX_LOADED", "16"))
+)
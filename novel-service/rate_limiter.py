@@ -0,0 +1,200 @@
+"""
+模型调用限流器
+按 provider/model 共享的令牌桶 + 自适应并发控制：
+公平排队（FIFO）、遵守 Retry-After、根据 429 自动收紧限额，并统计排队深度与等待时间
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Optional, Any
+
+import metrics
+
+
+class RateLimitedError(Exception):
+    """上游持续限流，重试次数用尽"""
+
+    def __init__(self, key: str, retry_after: Optional[float] = None):
+        self.key = key
+        self.retry_after = retry_after
+        message = f"模型服务限流: {key}"
+        if retry_after:
+            message += f"，请在 {retry_after:.0f} 秒后重试"
+        super().__init__(message)
+
+
+def parse_retry_after(headers: Any) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期），无法解析时返回None"""
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelGovernor:
+    """单个 provider/model 的限流器：令牌桶控制速率，FIFO 队列控制并发"""
+
+    def __init__(self, key: str, requests_per_minute: float = 20, max_concurrency: int = 4):
+        self.key = key
+        self.max_rate = requests_per_minute / 60.0
+        self.rate = self.max_rate  # 当前每秒令牌数（429后自适应下调）
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency  # 当前并发上限（429后自适应下调）
+        self.capacity = max(1.0, float(self.max_concurrency))
+        self.tokens = self.capacity
+        self.in_flight = 0
+        self.paused_until = 0.0  # Retry-After 指定的暂停截止时间
+        self._last_refill = time.monotonic()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._success_streak = 0
+        self._dispatcher: Optional[asyncio.TimerHandle] = None
+        # 统计
+        self.total_requests = 0
+        self.rate_limited_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # ========== 排队与放行 ==========
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    def _dispatch(self):
+        """按FIFO顺序放行排队的调用者，放行不了时安排下一次检查"""
+        self._dispatcher = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if self.in_flight >= self.limit:
+                return  # 等待有调用结束时再放行
+            if now < self.paused_until:
+                self._schedule(self.paused_until - now)
+                return
+            if self.rate > 0 and self.tokens < 1:
+                self._schedule((1 - self.tokens) / self.rate)
+                return
+            self._waiters.popleft()
+            if self.rate > 0:
+                self.tokens -= 1
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _schedule(self, delay: float):
+        if self._dispatcher is None:
+            loop = asyncio.get_running_loop()
+            self._dispatcher = loop.call_later(max(0.0, delay), self._dispatch)
+
+    async def acquire(self):
+        """排队获取调用许可"""
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已放行但调用者被取消，归还并发名额
+                self.release()
+            raise
+        waited = time.monotonic() - start
+        self.total_requests += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self):
+        """归还调用许可"""
+        self.in_flight = max(0, self.in_flight - 1)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self):
+        """获取一次调用许可的上下文管理器"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    # ========== 自适应调整 ==========
+
+    def record_success(self):
+        """成功调用：连续成功后逐步恢复并发与速率（加性增）"""
+        self._success_streak += 1
+        if self._success_streak >= self.limit:
+            self._success_streak = 0
+            if self.limit < self.max_concurrency:
+                self.limit += 1
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def record_rate_limited(self, retry_after: Optional[float] = None):
+        """收到429：暂停到Retry-After之后，并发与速率减半（乘性减）"""
+        self.rate_limited_count += 1
+        self._success_streak = 0
+        self.limit = max(1, self.limit // 2)
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        if retry_after is None:
+            # 未给出Retry-After时清空令牌桶，按下调后的速率自然退避
+            self.tokens = 0
+            return
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        """限流器统计信息"""
+        return {
+            "key": self.key,
+            "queue_depth": sum(1 for w in self._waiters if not w.done()),
+            "in_flight": self.in_flight,
+            "concurrency_limit": self.limit,
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": round(self.rate * 60, 2),
+            "max_requests_per_minute": round(self.max_rate * 60, 2),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            "total_requests": self.total_requests,
+            "rate_limited_count": self.rate_limited_count,
+            "avg_wait": round(self.total_wait / self.total_requests, 4) if self.total_requests else 0.0,
+            "max_wait": round(self.max_wait, 4),
+        }
+
+
+# 全局注册表：同一 provider/model 的所有调用共享一个限流器
+_governors: Dict[str, ModelGovernor] = {}
+
+
+def get_governor(key: str, requests_per_minute: float = 20, max_concurrency: int = 4) -> ModelGovernor:
+    """获取（不存在时创建）指定 provider/model 的限流器"""
+    governor = _governors.get(key)
+    if governor is None:
+        governor = ModelGovernor(key, requests_per_minute, max_concurrency)
+        _governors[key] = governor
+    return governor
+
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    """所有限流器的统计信息"""
+    return {key: governor.stats() for key, governor in _governors.items()}
+
+
+# 输出指标时读取各限流器的排队深度与在途调用数
+metrics.LLM_QUEUE_DEPTH.set_function(
+    lambda: {(key,): sum(1 for w in governor._waiters if not w.done()) for key, governor in _governors.items()})
+metrics.LLM_IN_FLIGHT.set_function(lambda: {(key,): governor.in_flight for key, governor in _governors.items()})
@@ -0,0 +1,183 @@
+"""
+会话级选中状态与当前项目
+每个会话（客户端通过 X-Session-Id 区分，未提供时为 default）有独立的选中集合与当前项目：
+- 选中集合有上限，超出时淘汰最早选中的上下文
+- 空闲超过TTL的会话被清理（default 会话不过期）
+单进程时存放在内存中，多worker部署时存放在 shared_store 协调库中（两者接口一致）
+"""
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableSet
+from typing import Dict, Iterator, List, Optional
+
+DEFAULT_SESSION = "default"
+DEFAULT_PROJECT = "default"
+
+
+class MemorySessionBackend:
+    """进程内的会话存储（会话数超过上限时淘汰最久未访问的会话）"""
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id: str) -> Dict:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {"selected": OrderedDict(), "project_id": None, "last_seen": time.time()}
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                oldest = next(iter(self._sessions))
+                if oldest == DEFAULT_SESSION:
+                    self._sessions.move_to_end(oldest)
+                    oldest = next(iter(self._sessions))
+                del self._sessions[oldest]
+        return session
+
+    def session_touch(self, session_id: str, now: float):
+        with self._lock:
+            self._session(session_id)["last_seen"] = now
+            self._sessions.move_to_end(session_id)
+
+    def session_get_project(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session["project_id"] if session else None
+
+    def session_set_project(self, session_id: str, project_id: str):
+        with self._lock:
+            self._session(session_id)["project_id"] = project_id
+
+    def session_purge(self, before: float, keep: str) -> int:
+        with self._lock:
+            expired = [sid for sid, session in self._sessions.items()
+                       if sid != keep and session["last_seen"] < before]
+            for sid in expired:
+                del self._sessions[sid]
+            return len(expired)
+
+    def session_count(self) -> int:
+        return len(self._sessions)
+
+    def selection_contains(self, session_id: str, context_id: str) -> bool:
+        session = self._sessions.get(session_id)
+        return bool(session) and context_id in session["selected"]
+
+    def selection_list(self, session_id: str) -> List[str]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return list(session["selected"]) if session else []
+
+    def selection_add(self, session_id: str, context_id: str, limit: int):
+        with self._lock:
+            selected = self._session(session_id)["selected"]
+            selected[context_id] = True
+            while len(selected) > limit:
+                selected.popitem(last=False)
+
+    def selection_discard(self, session_id: str, context_id: str):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session:
+                session["selected"].pop(context_id, None)
+
+    def selection_clear(self, session_id: str):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session:
+                session["selected"].clear()
+
+    def selection_remove_context(self, context_id: str):
+        with self._lock:
+            for session in self._sessions.values():
+                session["selected"].pop(context_id, None)
+
+
+class SessionSelection(MutableSet):
+    """某个会话的选中集合（接口与set一致，超出上限时淘汰最早选中的上下文）"""
+
+    def __init__(self, backend, session_id: str, limit: int):
+        self.backend = backend
+        self.session_id = session_id
+        self.limit = limit
+
+    def __contains__(self, context_id) -> bool:
+        return self.backend.selection_contains(self.session_id, context_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.backend.selection_list(self.session_id))
+
+    def __len__(self) -> int:
+        return len(self.backend.selection_list(self.session_id))
+
+    def add(self, context_id: str):
+        self.backend.selection_add(self.session_id, context_id, self.limit)
+
+    def discard(self, context_id: str):
+        self.backend.selection_discard(self.session_id, context_id)
+
+    def clear(self):
+        self.backend.selection_clear(self.session_id)
+
+
+class SessionRegistry:
+    """会话注册表：按会话提供选中集合与当前项目，并定期清理过期会话"""
+
+    PURGE_INTERVAL = 60.0  # 秒
+    TOUCH_INTERVAL = 30.0  # 同一会话两次更新访问时间的最小间隔（秒）
+
+    def __init__(self, backend, max_selection: int = 50, ttl: float = 86400.0):
+        self.backend = backend
+        self.max_selection = max_selection
+        self.ttl = ttl
+        self._last_touch: Dict[str, float] = {}
+        self._last_purge = 0.0
+
+    def _touch(self, session_id: str):
+        now = time.time()
+        if now - self._last_touch.get(session_id, 0.0) >= self.TOUCH_INTERVAL:
+            self._last_touch[session_id] = now
+            self.backend.session_touch(session_id, now)
+        if now - self._last_purge >= self.PURGE_INTERVAL:
+            self._last_purge = now
+            self.purge_expired()
+
+    def selection(self, session_id: str = DEFAULT_SESSION) -> SessionSelection:
+        """获取会话的选中集合"""
+        self._touch(session_id)
+        return SessionSelection(self.backend, session_id, self.max_selection)
+
+    def get_project(self, session_id: str = DEFAULT_SESSION) -> str:
+        """获取会话的当前项目"""
+        self._touch(session_id)
+        return self.backend.session_get_project(session_id) or DEFAULT_PROJECT
+
+    def set_project(self, session_id: str, project_id: str):
+        """设置会话的当前项目"""
+        self._touch(session_id)
+        self.backend.session_set_project(session_id, project_id)
+
+    def remove_context(self, context_id: str):
+        """上下文删除后从所有会话的选中集合中移除"""
+        self.backend.selection_remove_context(context_id)
+
+    def purge_expired(self) -> int:
+        """清理空闲超过TTL的会话（default 会话保留），返回清理数量"""
+        purged = self.backend.session_purge(time.time() - self.ttl, keep=DEFAULT_SESSION)
+        if purged:
+            cutoff = time.time() - self.ttl
+            self._last_touch = {sid: ts for sid, ts in self._last_touch.items() if ts >= cutoff}
+        return purged
+
+    def info(self, session_id: str = DEFAULT_SESSION) -> Dict:
+        """会话概况"""
+        return {
+            "session_id": session_id,
+            "project_id": self.get_project(session_id),
+            "selected_count": len(self.selection(session_id)),
+            "max_selection": self.max_selection,
+            "ttl": self.ttl,
+            "active_sessions": self.backend.session_count()
+        }
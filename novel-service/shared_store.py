@@ -0,0 +1,228 @@
+"""
+多进程共享存储协调
+多个uvicorn worker共享同一个 context_data 目录，通过目录下的SQLite协调库：
+- revisions 表：每个上下文已落盘的版本号，写入前在跨进程写锁内比较，过期写入被丢弃；
+  删除后保留记录并标记 deleted（墓碑），其他worker随后提交的旧修改不会让已删除的上下文复活
+- changes 表：变更日志，各worker轮询（先用 PRAGMA data_version 快速判断）后重新加载变更的上下文；
+  同时是客户端增量同步的变更源（接口与 change_feed.MemoryChangeLog 一致）
+- sessions / selections 表：会话的当前项目与选中的上下文（不放在进程内存中，所有worker看到一致的状态）
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from change_feed import CHANGE_LOG_RETENTION, DELETED, LEGACY_OPS, UPDATED
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    context_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    worker TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    context_id TEXT NOT NULL,
+    op TEXT NOT NULL,
+    revision INTEGER,
+    worker TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    project_id TEXT,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS selections (
+    session_id TEXT NOT NULL,
+    context_id TEXT NOT NULL,
+    PRIMARY KEY (session_id, context_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """基于SQLite的跨进程写锁、变更日志与会话状态（会话接口与 session_state.MemorySessionBackend 一致）"""
+
+    def __init__(self, db_path: str, worker_id: Optional[str] = None):
+        self.db_path = db_path
+        self.worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        if "deleted" not in {row[1] for row in conn.execute("PRAGMA table_info(revisions)")}:
+            try:
+                conn.execute("ALTER TABLE revisions ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass  # 其他worker已添加
+        # 变更序号的纪元：协调库重建后序号从头计数，客户端据此判断需要重新获取完整数据
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:12],))
+        self.epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+        # 变更监听使用独立连接（data_version 只反映其他连接提交的修改）
+        self._watch_lock = threading.Lock()
+        self._watch_conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._data_version = None
+        self.last_seq = self._watch_conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接（自动提交模式，事务显式开启）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _record(self, conn: sqlite3.Connection, context_id: str, op: str, revision: Optional[int]):
+        conn.execute("INSERT INTO changes (context_id, op, revision, worker) VALUES (?, ?, ?, ?)",
+                     (context_id, op, revision, self.worker_id))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+                         (CHANGE_LOG_RETENTION,))
+
+    def commit_write(self, context_id: str, revision: int, write: Callable[[], None], op: str = UPDATED) -> bool:
+        """在跨进程写锁内比较版本并写入：已落盘版本不低于本次版本或上下文已被删除时放弃写入，返回是否写入"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT revision, deleted FROM revisions WHERE context_id = ?",
+                               (context_id,)).fetchone()
+            if row and (row[1] or row[0] >= revision):
+                conn.execute("ROLLBACK")
+                return False
+            write()
+            conn.execute("INSERT INTO revisions (context_id, revision, worker) VALUES (?, ?, ?) "
+                         "ON CONFLICT(context_id) DO UPDATE SET revision = excluded.revision, worker = excluded.worker",
+                         (context_id, revision, self.worker_id))
+            self._record(conn, context_id, op, revision)
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def commit_delete(self, context_id: str, remove: Callable[[], None]):
+        """在跨进程写锁内删除上下文文件、留下墓碑并记录变更"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            remove()
+            conn.execute("INSERT INTO revisions (context_id, revision, worker, deleted) VALUES (?, 0, ?, 1) "
+                         "ON CONFLICT(context_id) DO UPDATE SET deleted = 1, worker = excluded.worker",
+                         (context_id, self.worker_id))
+            conn.execute("DELETE FROM selections WHERE context_id = ?", (context_id,))
+            self._record(conn, context_id, DELETED, None)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def poll_changes(self) -> Tuple[List[Tuple[str, str]], bool]:
+        """
+        获取其他worker自上次轮询以来的变更
+        返回 ([(上下文ID, 操作)], 是否需要全量重新加载)；无变更时只执行一次 PRAGMA data_version
+        """
+        with self._watch_lock:
+            version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return [], False
+            self._data_version = version
+            oldest = self._watch_conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            rows = self._watch_conn.execute(
+                "SELECT seq, context_id, op, worker FROM changes WHERE seq > ? ORDER BY seq", (self.last_seq,)
+            ).fetchall()
+            full_reload = oldest is not None and oldest > self.last_seq + 1
+            if rows:
+                self.last_seq = rows[-1][0]
+            return [(context_id, op) for _, context_id, op, worker in rows if worker != self.worker_id], full_reload
+
+    def latest_change(self) -> int:
+        return self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, since: int, limit: int) -> Tuple[List[Dict], bool]:
+        """返回 (序号大于 since 的变更，最多 limit 条, 是否需要重新获取完整数据)，包括本worker的变更"""
+        conn = self._conn()
+        oldest, latest = conn.execute("SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM changes").fetchone()
+        if since > latest or (oldest is not None and oldest > since + 1):
+            return [], True
+        rows = conn.execute("SELECT seq, op, context_id, revision FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                            (since, limit)).fetchall()
+        return [{"seq": seq, "op": LEGACY_OPS.get(op, op), "context_id": context_id, "revision": revision}
+                for seq, op, context_id, revision in rows], False
+
+    # ==================== 会话状态 ====================
+
+    def session_touch(self, session_id: str, now: float):
+        self._conn().execute("INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+                             "ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen",
+                             (session_id, now))
+
+    def session_get_project(self, session_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT project_id FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def session_set_project(self, session_id: str, project_id: str):
+        self._conn().execute("INSERT INTO sessions (session_id, project_id, last_seen) VALUES (?, ?, ?) "
+                             "ON CONFLICT(session_id) DO UPDATE SET project_id = excluded.project_id",
+                             (session_id, project_id, time.time()))
+
+    def session_purge(self, before: float, keep: str) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = "SELECT session_id FROM sessions WHERE last_seen < ? AND session_id != ?"
+            conn.execute(f"DELETE FROM selections WHERE session_id IN ({expired})", (before, keep))
+            purged = conn.execute(f"DELETE FROM sessions WHERE session_id IN ({expired})", (before, keep)).rowcount
+            conn.execute("COMMIT")
+            return purged
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def session_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def selection_contains(self, session_id: str, context_id: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM selections WHERE session_id = ? AND context_id = ?",
+                                    (session_id, context_id)).fetchone() is not None
+
+    def selection_list(self, session_id: str) -> List[str]:
+        rows = self._conn().execute("SELECT context_id FROM selections WHERE session_id = ? ORDER BY rowid",
+                                    (session_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def selection_add(self, session_id: str, context_id: str, limit: int):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR IGNORE INTO selections (session_id, context_id) VALUES (?, ?)",
+                         (session_id, context_id))
+            # 超出上限时淘汰最早选中的上下文
+            conn.execute("DELETE FROM selections WHERE session_id = ? AND rowid NOT IN "
+                         "(SELECT rowid FROM selections WHERE session_id = ? ORDER BY rowid DESC LIMIT ?)",
+                         (session_id, session_id, limit))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def selection_discard(self, session_id: str, context_id: str):
+        self._conn().execute("DELETE FROM selections WHERE session_id = ? AND context_id = ?",
+                             (session_id, context_id))
+
+    def selection_clear(self, session_id: str):
+        self._conn().execute("DELETE FROM selections WHERE session_id = ?", (session_id,))
+
+    def selection_remove_context(self, context_id: str):
+        self._conn().execute("DELETE FROM selections WHERE context_id = ?", (context_id,))
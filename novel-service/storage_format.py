@@ -0,0 +1,107 @@
+"""
+上下文文件的存储格式
+- pretty：缩进的JSON（原有格式，便于直接查看与手工修改）
+- compact：去掉缩进与空白的JSON
+- gzip：compact + gzip压缩
+- zstd：compact + zstd压缩（需要 zstandard，未安装时改用gzip）
+序列化使用 json_codec（有 orjson 时使用 orjson）
+文件名保持不变（上下文文件仍是 .json、blob仍是 .txt），读取时按文件头识别格式，
+因此不同格式的文件可以混合存放：切换格式后旧文件照常读取，下次保存时改写为新格式
+"""
+import gzip
+import sys
+from typing import Any, Dict
+
+import json_codec
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    zstandard = None
+    HAS_ZSTD = False
+
+PRETTY = "pretty"
+COMPACT = "compact"
+GZIP = "gzip"
+ZSTD = "zstd"
+FORMATS = (PRETTY, COMPACT, GZIP, ZSTD)
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def resolve_format(name: str) -> str:
+    """校验格式名（zstd不可用时退回gzip）"""
+    name = (name or PRETTY).lower()
+    if name not in FORMATS:
+        raise ValueError(f"未知的存储格式: {name}（可选: {', '.join(FORMATS)}）")
+    if name == ZSTD and not HAS_ZSTD:
+        print("[⚠️] zstandard不可用，上下文文件改用gzip压缩", file=sys.stderr)
+        return GZIP
+    return name
+
+
+def detect_format(raw: bytes) -> str:
+    """按文件头识别格式"""
+    if raw.startswith(_GZIP_MAGIC):
+        return GZIP
+    if raw.startswith(_ZSTD_MAGIC):
+        return ZSTD
+    if raw.startswith(b'{"'):
+        return COMPACT
+    return PRETTY
+
+
+def compress(raw: bytes, fmt: str) -> bytes:
+    if fmt == GZIP:
+        # 固定mtime，相同内容得到相同的文件
+        return gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    if fmt == ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return raw
+
+
+def decompress(raw: bytes) -> bytes:
+    """解压（未压缩的内容原样返回），损坏的压缩数据统一抛出 ValueError"""
+    fmt = detect_format(raw)
+    if fmt in (PRETTY, COMPACT):
+        return raw
+    if fmt == ZSTD and not HAS_ZSTD:
+        raise ValueError("文件为zstd压缩格式，但zstandard不可用")
+    try:
+        if fmt == GZIP:
+            return gzip.decompress(raw)
+        return zstandard.ZstdDecompressor().decompress(raw, max_output_size=1 << 31)
+    except Exception as e:
+        raise ValueError(f"压缩数据损坏: {e}") from e
+
+
+def dumps(data: Any, fmt: str = PRETTY) -> bytes:
+    """序列化为指定格式的文件内容"""
+    if fmt == PRETTY:
+        return json_codec.dumps_bytes(data, pretty=True)
+    return compress(json_codec.dumps_bytes(data), fmt)
+
+
+def loads(raw: bytes) -> Any:
+    """解析任意格式的文件内容"""
+    return json_codec.loads(decompress(raw))
+
+
+def load_file(filepath: str) -> Dict:
+    """读取任意格式的JSON文件"""
+    with open(filepath, "rb") as f:
+        return loads(f.read())
+
+
+def encode_text(text: str, fmt: str = PRETTY) -> bytes:
+    """文本（blob）按格式压缩：pretty / compact 保持纯文本"""
+    return compress(text.encode("utf-8"), fmt)
+
+
+def decode_text(raw: bytes) -> str:
+    return decompress(raw).decode("utf-8")
@@ -0,0 +1,448 @@
+"""
+请求链路追踪
+按 OpenTelemetry 的追踪接口（Tracer.start_as_current_span / start_span、Span.set_attribute / add_event /
+record_exception / set_status、get_current_span）实现的轻量追踪器，记录一次请求经过的各阶段：
+    HTTP请求 -> 提示词组装 -> Agent编译 -> Agent流式生成 -> 模型调用 / 工具调用 -> 解析节点 -> 写入上下文
+当前span保存在 contextvars 中，随 asyncio 任务传递；提交到线程池的任务需用 wrap_context 带上当前上下文
+请求头 traceparent（W3C Trace Context）会被沿用，响应头返回 traceparent 与 X-Trace-Id
+
+导出：
+- 最近的若干条链路保存在内存中（GET /api/traces、GET /api/traces/{trace_id}）
+- TRACE_EXPORTER=console 输出到标准错误，=file 追加写入 TRACE_FILE（JSON Lines，默认 traces.jsonl），
+  由后台线程写出，不阻塞请求
+TRACING_ENABLED=0 时不记录任何span（trace_id 为空）
+"""
+import asyncio
+import atexit
+import contextvars
+import functools
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import json_codec
+
+ENABLED = os.getenv("TRACING_ENABLED", "1").lower() not in ("0", "false", "no")
+EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+RECENT_TRACES = int(os.getenv("TRACE_RECENT", "100"))
+MAX_SPANS_PER_TRACE = 2000
+# 不记录链路的路径前缀（指标抓取、链路查询与健康检查会挤掉内存中真正需要排查的链路）
+EXCLUDED_PATHS = ("/metrics", "/api/traces", "/api/health")
+SERVICE_NAME = "novel-service"
+
+# 与 opentelemetry.trace.StatusCode 同名
+UNSET = "UNSET"
+OK = "OK"
+ERROR = "ERROR"
+
+SpanContext = namedtuple("SpanContext", ["trace_id", "span_id"])  # 十六进制字符串（32位 / 16位）
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def _iso(ns: int) -> str:
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).isoformat()
+
+
+class Span:
+    """一个计时的操作；end() 后交给导出器"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "events",
+                 "status", "status_description")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.events: List[Dict[str, Any]] = []
+        self.status = UNSET
+        self.status_description: Optional[str] = None
+
+    def get_span_context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id)
+
+    def is_recording(self) -> bool:
+        return self.end_ns is None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes or {}})
+
+    def record_exception(self, exception: BaseException):
+        self.add_event("exception", {
+            "exception.type": type(exception).__name__,
+            "exception.message": str(exception),
+            "exception.stacktrace": "".join(traceback.format_exception(type(exception), exception,
+                                                                       exception.__traceback__))[-4000:],
+        })
+
+    def set_status(self, status: str, description: Optional[str] = None):
+        self.status = status
+        self.status_description = description
+
+    def update_name(self, name: str):
+        self.name = name
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        _processor.on_end(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time": _iso(self.start_ns),
+            "end_time": _iso(end_ns),
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "status_description": self.status_description,
+            "attributes": self.attributes,
+            "events": [{"name": event["name"], "time": _iso(event["time_ns"]), "attributes": event["attributes"]}
+                       for event in self.events],
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class _NonRecordingSpan:
+    """追踪关闭时使用的空span（接口与 Span 相同，不记录任何内容）"""
+
+    trace_id = None
+    span_id = None
+
+    def get_span_context(self) -> SpanContext:
+        return SpanContext(None, None)
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+    def set_status(self, status: str, description: Optional[str] = None):
+        pass
+
+    def update_name(self, name: str):
+        pass
+
+    def end(self):
+        pass
+
+
+INVALID_SPAN = _NonRecordingSpan()
+AnySpan = Union[Span, _NonRecordingSpan]
+
+
+# ==================== 导出 ====================
+
+class _RecentTraces:
+    """内存中保存最近的链路（按链路ID分组，超出数量时淘汰最早的链路）"""
+
+    def __init__(self, max_traces: int):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, span: Dict):
+        with self._lock:
+            spans = self._traces.get(span["trace_id"])
+            if spans is None:
+                spans = self._traces[span["trace_id"]] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if len(spans) < MAX_SPANS_PER_TRACE:
+                spans.append(span)
+
+    def get(self, trace_id: str) -> Optional[List[Dict]]:
+        with self._lock:
+            spans = self._traces.get(trace_id)
+            return sorted(spans, key=lambda span: span["start_time"]) if spans is not None else None
+
+    def summaries(self) -> List[Dict]:
+        """最近的链路概况（新的在前）：根span名称、耗时与span数量"""
+        with self._lock:
+            traces = [(trace_id, list(spans)) for trace_id, spans in self._traces.items()]
+        result = []
+        for trace_id, spans in reversed(traces):
+            span_ids = {span["span_id"] for span in spans}
+            roots = [span for span in spans if span["parent_span_id"] not in span_ids]
+            root = max(roots, key=lambda span: span["duration_ms"]) if roots else spans[0]
+            result.append({
+                "trace_id": trace_id,
+                "name": root["name"],
+                "start_time": root["start_time"],
+                "duration_ms": root["duration_ms"],
+                "status": root["status"],
+                "span_count": len(spans),
+            })
+        return result
+
+
+class _SpanProcessor:
+    """结束的span存入最近链路，并按配置交给后台线程写到标准错误或文件"""
+
+    def __init__(self, exporter: str, trace_file: str, recent: int):
+        self.recent = _RecentTraces(recent)
+        self.exporter = exporter if exporter in ("console", "file") else None
+        self.trace_file = trace_file
+        self._queue: "queue.SimpleQueue[Dict]" = queue.SimpleQueue()
+        self._write_lock = threading.Lock()
+        if self.exporter:
+            threading.Thread(target=self._export_loop, daemon=True, name="trace-export").start()
+            atexit.register(self.flush)
+
+    def on_end(self, span: Span):
+        data = span.to_dict()
+        self.recent.add(data)
+        if self.exporter:
+            self._queue.put(data)
+
+    def _export_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            self._write(batch)
+
+    def _write(self, batch: List[Dict]):
+        # 一次写出队列中已有的全部span
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        text = "".join(json_codec.dumps(span) + "\n" for span in batch)
+        with self._write_lock:
+            try:
+                if self.exporter == "console":
+                    sys.stderr.write(text)
+                    sys.stderr.flush()
+                else:
+                    with open(self.trace_file, "a", encoding="utf-8") as f:
+                        f.write(text)
+            except OSError as e:
+                print(f"[⚠️] 写出追踪数据失败: {e}", file=sys.stderr)
+
+    def flush(self):
+        """写出队列中尚未导出的span（进程退出时调用）"""
+        self._write([])
+
+
+_processor = _SpanProcessor(EXPORTER, TRACE_FILE, RECENT_TRACES)
+
+
+def get_trace(trace_id: str) -> Optional[List[Dict]]:
+    """内存中保存的一条链路的全部span（按开始时间排序），已淘汰或不存在时返回None"""
+    return _processor.recent.get(trace_id)
+
+
+def recent_traces() -> List[Dict]:
+    """内存中最近链路的概况"""
+    return _processor.recent.summaries()
+
+
+# ==================== 追踪接口 ====================
+
+def get_current_span() -> AnySpan:
+    """当前上下文中的span（没有时返回空span）"""
+    return _current_span.get() or INVALID_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    """当前链路ID（不在链路中或追踪关闭时为None）"""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+@contextmanager
+def use_span(span: AnySpan, end_on_exit: bool = False) -> Iterator[AnySpan]:
+    """在代码块内把 span 设为当前span（可用于异步生成器：生成器被其他上下文关闭时忽略还原失败）"""
+    token = _current_span.set(span if isinstance(span, Span) else None)
+    try:
+        yield span
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            pass
+        if end_on_exit:
+            span.end()
+
+
+class Tracer:
+    """span的创建入口（接口与 opentelemetry.trace.Tracer 一致的子集）"""
+
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                   parent: Optional[Union[Span, SpanContext]] = None) -> AnySpan:
+        """创建span（不设为当前span，需要调用 end()）；未指定 parent 时以当前span为父span，没有时开始新链路"""
+        if not ENABLED:
+            return INVALID_SPAN
+        if parent is None:
+            parent = _current_span.get()
+        if isinstance(parent, Span):
+            parent = parent.get_span_context()
+        if parent is not None and parent.trace_id:
+            return Span(name, parent.trace_id, parent.span_id, attributes)
+        return Span(name, _new_id(128), None, attributes)
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                              parent: Optional[Union[Span, SpanContext]] = None) -> Iterator[AnySpan]:
+        """创建span并在代码块内设为当前span，退出时结束（异常记录到span并标记为错误）"""
+        span = self.start_span(name, attributes, parent)
+        with use_span(span, end_on_exit=True):
+            try:
+                yield span
+            except BaseException as e:
+                if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+                    span.record_exception(e)
+                    span.set_status(ERROR, str(e)[:200])
+                raise
+
+
+tracer = Tracer()
+
+
+def get_tracer(name: Optional[str] = None) -> Tracer:
+    """与 opentelemetry.trace.get_tracer 对应（所有模块共用一个追踪器）"""
+    return tracer
+
+
+def traced(name: str, child_only: bool = True):
+    """
+    把函数（同步或异步）的执行记录为一个span
+    child_only 为真时只在已有链路中记录（如请求处理中），命令行与基准测试中的调用不产生新链路
+    """
+    def decorator(func: Callable) -> Callable:
+        if not ENABLED:
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if child_only and _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with tracer.start_as_current_span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if child_only and _current_span.get() is None:
+                return func(*args, **kwargs)
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap_context(func: Callable, *args) -> Callable[[], Any]:
+    """带上当前上下文（当前span）的可调用对象，提交到线程池后其中创建的span仍属于当前链路"""
+    return functools.partial(contextvars.copy_context().run, func, *args)
+
+
+# ==================== W3C Trace Context ====================
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """解析 traceparent 请求头（"00-<32位链路ID>-<16位span ID>-<标志>"），无效时返回None"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    trace_id, span_id = parts[1].lower(), parts[2].lower()
+    try:
+        int(trace_id, 16), int(span_id, 16)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id)
+
+
+def format_traceparent(span: AnySpan) -> Optional[str]:
+    if not isinstance(span, Span):
+        return None
+    return f"00-{span.trace_id}-{span.span_id}-01"
+
+
+class TracingMiddleware:
+    """
+    为每个HTTP请求创建根span（沿用请求头中的 traceparent），名称为 "HTTP <方法> <路由模板>"
+    流式响应的span持续到响应结束；响应头返回 traceparent 与 X-Trace-Id
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED or scope.get("path", "").startswith(EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        span = tracer.start_span(f"HTTP {scope['method']}", {
+            "http.method": scope["method"],
+            "http.target": scope.get("path", ""),
+        }, parent)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                span.set_attribute("http.status_code", status)
+                if status >= 500:
+                    span.set_status(ERROR)
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"traceparent", format_traceparent(span).encode("latin-1")),
+                    (b"x-trace-id", span.trace_id.encode("latin-1")),
+                ]
+            await send(message)
+
+        with use_span(span, end_on_exit=True):
+            try:
+                await self.app(scope, receive, send_wrapper)
+            except BaseException as e:
+                if not isinstance(e, asyncio.CancelledError):
+                    span.record_exception(e)
+                    span.set_status(ERROR, str(e)[:200])
+                raise
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.set_attribute("http.route", route)
+                    span.update_name(f"HTTP {scope['method']} {route}")
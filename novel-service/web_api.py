@@ -1,27 +1,40 @@
 """
 Web API服务器 - 连接Electron客户端和LangChain后端
 """
-import json
-from typing import Dict, List, Optional, Any
+import asyncio
+import os
+from typing import Callable, Dict, List, Literal, Optional, Any
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from starlette.middleware.base import BaseHTTPMiddleware
 from prompt import prompt as system_prompt
 from llm import llm
-from context_manager import advanced_context_manager, ContextType
+from context_manager import (AdvancedContextManager, advanced_context_manager, BatchOperationError, ContextConflictError,
+                             ContextType)
+from project_store import ProjectNotFoundError, project_registry
+from session_state import DEFAULT_PROJECT, DEFAULT_SESSION
 from agent_service import AgentService
+from rate_limiter import RateLimitedError, get_all_stats as get_rate_limit_stats
+from llm_router import LatencyTracker
+from http_compression import CompressionMiddleware, etag_matches, make_etag
 from langchain_core.messages import HumanMessage
+import json_codec
+import metrics
+import tracing
 
 # 导入fanqie_tool模块
 try:
     from fanqie_tool import novel_tool
+    from fanqie_crawler import FanqieCrawler
 except ImportError as e:
     print(f"⚠️ 导入fanqie_tool模块失败: {e}")
     novel_tool = None
+    FanqieCrawler = None
 
 # 导入配置模块
 try:
@@ -54,6 +67,42 @@ def resolve_context_type(type_str: Optional[str], default: ContextType = Context
     return default
 
 
+def _conflict(e: ContextConflictError) -> HTTPException:
+    """乐观并发冲突转换为409响应（附带当前版本号，客户端可重新获取后重试）"""
+    return HTTPException(status_code=409, detail={
+        "message": str(e),
+        "context_id": e.context_id,
+        "expected_revision": e.expected,
+        "current_revision": e.actual
+    })
+
+
+def _session_id(x_session_id: Optional[str] = Header(None), session: Optional[str] = None) -> str:
+    """从 X-Session-Id 请求头获取会话ID（EventSource 无法设置请求头，可用查询参数 session；都未提供时使用默认会话）"""
+    session_id = (x_session_id or session or "").strip()
+    if len(session_id) > 128:
+        raise HTTPException(status_code=400, detail="X-Session-Id 过长")
+    return session_id or DEFAULT_SESSION
+
+
+def _project_id(x_project_id: Optional[str] = Header(None), session_id: str = Depends(_session_id)) -> str:
+    """当前请求的项目：X-Project-Id 请求头优先，否则为会话的当前项目"""
+    return (x_project_id or "").strip() or advanced_context_manager.sessions.get_project(session_id)
+
+
+def _get_project_manager(project_id: str) -> AdvancedContextManager:
+    """获取项目分片（按需加载），项目不存在时返回404"""
+    try:
+        return project_registry.get(project_id)
+    except ProjectNotFoundError:
+        raise HTTPException(status_code=404, detail=f"项目不存在: {project_id}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _project_manager(project_id: str = Depends(_project_id)) -> AdvancedContextManager:
+    """当前请求所属项目的分片（同步依赖在线程池中执行，加载分片不阻塞事件循环）"""
+    return _get_project_manager(project_id)
 
 
 def deduplicate_context_info(context_info: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
@@ -113,11 +162,24 @@ class HealthResponse(BaseModel):
     server_time: str
     context_count: int = 0
 
+class FastJSONResponse(JSONResponse):
+    """
+    使用 json_codec 序列化的JSON响应（有 orjson 时使用 orjson）
+    返回值只含JSON基本类型的大响应（上下文列表、树）直接返回此响应，跳过FastAPI逐层的 jsonable_encoder 转换
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_codec.dumps_bytes(content)
+
+
+tracer = tracing.get_tracer(__name__)
+
 # 创建FastAPI应用
 app = FastAPI(
     title="AI小说生成器API",
     description="连接Electron客户端和LangChain后端的Web API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # 配置CORS
@@ -127,6 +189,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Change-Revision", "X-Trace-Id", "traceparent"],
 )
 
 class EncodingMiddleware(BaseHTTPMiddleware):
@@ -136,7 +199,36 @@ class EncodingMiddleware(BaseHTTPMiddleware):
             response.headers["content-type"] = "application/json; charset=utf-8"
         return response
 
+# 较大的JSON响应按 Accept-Encoding 压缩（br/gzip），流式响应不压缩
+# 需要在 EncodingMiddleware 内层：BaseHTTPMiddleware 会把响应体拆成多段转发
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("HTTP_COMPRESS_MIN_SIZE", "1024")))
 app.add_middleware(EncodingMiddleware)
+# 最外层：请求耗时与链路包含压缩与其他中间件
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+
+
+def _conditional_json(request: Request, etag: str, build: Callable[[], Any],
+                      change_revision: Optional[int] = None) -> Response:
+    """
+    带强ETag的JSON响应：If-None-Match 匹配时返回304，不构建也不传输响应体
+    Cache-Control: no-cache 让客户端（Electron的HTTP缓存）每次带上ETag重新验证
+    change_revision: 构建数据前的变更序号（X-Change-Revision），客户端从这里开始订阅增量变更
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if change_revision is not None:
+        headers["X-Change-Revision"] = str(change_revision)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(build(), headers=headers)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """运行指标（Prometheus文本格式；METRICS_ENABLED=0 时不可用）"""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="指标收集未启用")
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/api/health")
@@ -151,47 +243,97 @@ async def health_check():
 
 
 @app.get("/api/contexts")
-async def get_contexts():
-    """获取所有上下文"""
-    return advanced_context_manager.list_contexts()
+async def get_contexts(request: Request, session_id: str = Depends(_session_id),
+                       manager: AdvancedContextManager = Depends(_project_manager)):
+    """获取所有上下文（支持ETag条件请求）"""
+    change_revision = manager.change_log.latest_change()
+    etag = make_etag("contexts", manager.project_id or manager.sessions.get_project(session_id),
+                     manager.state_digest(), sorted(manager.sessions.selection(session_id)))
+    return _conditional_json(request, etag, lambda: manager.list_contexts(session_id=session_id), change_revision)
+
+# 上下文详情可选择的字段（fields 参数），未指定时返回默认字段
+CONTEXT_DETAIL_FIELDS = ("id", "name", "type", "content", "items", "item_count", "metadata", "parent_id",
+                         "children", "created_at", "updated_at", "revision", "is_selected")
+DEFAULT_DETAIL_FIELDS = ("id", "name", "type", "content", "items", "item_count", "created_at", "updated_at",
+                         "revision", "is_selected")
+# 单页最多返回的条目数
+MAX_ITEM_PAGE_SIZE = 1000
 
 @app.get("/api/context/{context_id}")
-async def get_context(context_id: str):
-    """获取特定上下文的详细信息"""
-    context = advanced_context_manager.get_context(context_id)
+async def get_context(context_id: str, request: Request, fields: Optional[str] = None, offset: int = 0,
+                      limit: Optional[int] = None, preview: Optional[int] = None,
+                      session_id: str = Depends(_session_id),
+                      manager: AdvancedContextManager = Depends(_project_manager)):
+    """
+    获取特定上下文的详细信息（支持ETag条件请求）
+    fields: 逗号分隔的字段列表（如 fields=id,name,items,item_count），content 与 items 是同一组条目，通常只需其一
+    offset/limit: 条目分页（content 与 items 都只返回这一页，item_count 为条目总数）
+    preview: 每个条目正文只返回前若干个字符（被截取的条目带 truncated 与完整长度 length）
+    """
+    context = manager.get_context(context_id)
     if not context:
         raise HTTPException(status_code=404, detail=f"上下文不存在: {context_id}")
     
-    # 获取上下文条目
-    items = advanced_context_manager.get_context_items(context_id)
+    if fields:
+        selected_fields = {"id"} | {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = selected_fields.difference(CONTEXT_DETAIL_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知的字段: {', '.join(sorted(unknown))}")
+    else:
+        selected_fields = set(DEFAULT_DETAIL_FIELDS)
+    offset = max(0, offset)
+    limit = max(1, min(limit, MAX_ITEM_PAGE_SIZE)) if limit is not None else None
+    preview = max(0, preview) if preview is not None else None
+    
+    is_selected = context_id in manager.sessions.selection(session_id)
+    etag = make_etag("context", manager.project_id, context.id, context.revision, context.updated_at, is_selected,
+                     ",".join(sorted(selected_fields)), offset, limit, preview)
     
-    return {
-        "id": context.id,
-        "name": context.name,
-        "type": context.type,
-        "content": context.content,
-        "items": items,
-        "created_at": context.created_at,
-        "updated_at": context.updated_at,
-        "is_selected": context_id in advanced_context_manager.selected_contexts
-    }
+    def build():
+        items = context.list_items()
+        page = items[offset:offset + limit] if limit is not None else items[offset:]
+        values = {
+            "id": lambda: context.id,
+            "name": lambda: context.name,
+            "type": lambda: context.type.value,
+            "content": lambda: page if preview is None else [
+                manager.preview_item(dict(item), preview) if isinstance(item, dict) else item for item in page
+            ],
+            "items": lambda: manager.get_context_items(context_id, offset, limit, preview),
+            "item_count": lambda: len(items),
+            "metadata": lambda: context.metadata,
+            "parent_id": lambda: context.parent_id,
+            "children": lambda: context.children,
+            "created_at": lambda: context.created_at,
+            "updated_at": lambda: context.updated_at,
+            "revision": lambda: context.revision,
+            "is_selected": lambda: is_selected
+        }
+        data = {field: values[field]() for field in CONTEXT_DETAIL_FIELDS if field in selected_fields}
+        if offset or limit is not None:
+            data["offset"] = offset
+            data["limit"] = limit
+        return data
+    
+    return _conditional_json(request, etag, build)
 
 @app.post("/api/context/save")
-async def save_context(request: SaveContextRequest):
+async def save_context(request: SaveContextRequest, session_id: str = Depends(_session_id),
+                       manager: AdvancedContextManager = Depends(_project_manager)):
     """保存内容到上下文"""
     try:
         context_type_enum = resolve_context_type(request.type, ContextType.NOVEL)
         
         # 查找或创建指定类型的上下文
-        contexts_of_type = advanced_context_manager.get_contexts_by_type(context_type_enum)
+        contexts_of_type = manager.get_contexts_by_type(context_type_enum)
         
         if contexts_of_type:
             context_id = contexts_of_type[0].id
-            advanced_context_manager.save_to_context(context_id, request.content, append=True)
+            await manager.asave_to_context(context_id, request.content, append=True)
             context_name = contexts_of_type[0].name
         else:
-            context_id = advanced_context_manager.create_context(
-                name=request.title, context_type=context_type_enum, content=request.content
+            context_id = await manager.acreate_context(
+                name=request.title, context_type=context_type_enum, content=request.content, session_id=session_id
             )
             context_name = request.title
         
@@ -206,30 +348,33 @@ async def save_context(request: SaveContextRequest):
 
 
 @app.post("/api/context/{context_id}/select")
-async def select_context(context_id: str, select: bool = True):
-    """选择或取消选择上下文"""
-    context = advanced_context_manager.get_context(context_id)
+async def select_context(context_id: str, select: bool = True, session_id: str = Depends(_session_id),
+                         manager: AdvancedContextManager = Depends(_project_manager)):
+    """在当前会话中选择或取消选择上下文（超出上限时淘汰最早选中的上下文）"""
+    context = manager.get_context(context_id)
     if not context:
         raise HTTPException(status_code=404, detail=f"上下文不存在: {context_id}")
     
+    selection = manager.sessions.selection(session_id)
     if select:
-        advanced_context_manager.selected_contexts.add(context_id)
-    elif context_id in advanced_context_manager.selected_contexts:
-        advanced_context_manager.selected_contexts.remove(context_id)
+        selection.add(context_id)
+    else:
+        selection.discard(context_id)
     
     return {
         "success": True,
         "context_id": context_id,
         "selected": select,
-        "selected_count": len(advanced_context_manager.selected_contexts)
+        "selected_count": len(selection)
     }
 
 @app.get("/api/selected-contexts")
-async def get_selected_contexts():
-    """获取当前选中的上下文"""
+async def get_selected_contexts(session_id: str = Depends(_session_id),
+                                manager: AdvancedContextManager = Depends(_project_manager)):
+    """获取当前会话选中的上下文"""
     selected = []
-    for context_id in advanced_context_manager.selected_contexts:
-        context = advanced_context_manager.get_context(context_id)
+    for context_id in manager.sessions.selection(session_id):
+        context = manager.get_context(context_id)
         if context:
             selected.append({
                 "id": context.id,
@@ -243,24 +388,143 @@ async def get_selected_contexts():
     }
 
 
+# ==================== 会话API端点 ====================
+
+class SessionSelectionRequest(BaseModel):
+    context_ids: List[str]
+
+class SessionProjectRequest(BaseModel):
+    project_id: str
+
+@app.get("/api/session")
+async def get_session(session_id: str = Depends(_session_id)):
+    """获取当前会话的概况（当前项目、选中数量与上限）"""
+    return advanced_context_manager.sessions.info(session_id)
+
+@app.put("/api/session/selection")
+async def replace_session_selection(request: SessionSelectionRequest, session_id: str = Depends(_session_id),
+                                    manager: AdvancedContextManager = Depends(_project_manager)):
+    """替换当前会话的选中上下文"""
+    manager.select_contexts(request.context_ids, session_id)
+    selected = list(manager.sessions.selection(session_id))
+    return {"success": True, "selected_contexts": selected, "count": len(selected)}
+
+@app.delete("/api/session/selection")
+async def clear_session_selection(session_id: str = Depends(_session_id)):
+    """清空当前会话的选中上下文"""
+    advanced_context_manager.clear_selection(session_id)
+    return {"success": True, "count": 0}
+
+@app.put("/api/session/project")
+async def set_session_project(request: SessionProjectRequest, session_id: str = Depends(_session_id)):
+    """设置当前会话的当前项目（之后的请求默认使用该项目的分片）"""
+    if not project_registry.exists(request.project_id):
+        raise HTTPException(status_code=404, detail=f"项目不存在: {request.project_id}")
+    advanced_context_manager.sessions.set_project(session_id, request.project_id)
+    return {"success": True, "project_id": request.project_id}
+
+
+# ==================== 项目API端点 ====================
+
+class CreateProjectRequest(BaseModel):
+    id: str
+    name: Optional[str] = None
+
+@app.get("/api/projects")
+async def list_projects():
+    """列出所有项目（包括未加载的分片）"""
+    projects = project_registry.list_projects()
+    return {"projects": projects, "count": len(projects)}
+
+@app.post("/api/projects")
+def create_project(request: CreateProjectRequest, session_id: str = Depends(_session_id)):
+    """创建项目并设为当前会话的当前项目（同步端点在线程池中执行）"""
+    try:
+        project = project_registry.create_project(request.id, request.name or request.id, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "project": project}
+
+
 @app.get("/api/contexts/tree")
-async def get_context_tree(root_id: Optional[str] = None):
-    """获取上下文树状结构"""
+async def get_context_tree(request: Request, root_id: Optional[str] = None, session_id: str = Depends(_session_id),
+                           manager: AdvancedContextManager = Depends(_project_manager)):
+    """获取上下文树状结构（支持ETag条件请求，树未变化时返回304）"""
     try:
-        tree = advanced_context_manager.get_context_tree(root_id)
-        return {
-            "success": True,
-            "tree": tree,
-            "count": len(tree)
-        }
+        change_revision = manager.change_log.latest_change()
+        etag = make_etag("tree", manager.project_id, root_id, manager.state_digest(),
+                         sorted(manager.sessions.selection(session_id)))
+        
+        def build():
+            tree = manager.get_context_tree(root_id, session_id)
+            return {
+                "success": True,
+                "tree": tree,
+                "count": len(tree)
+            }
+        
+        return _conditional_json(request, etag, build, change_revision)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取上下文树失败: {str(e)}")
 
+@app.get("/api/changes")
+def get_changes(since: Optional[int] = None, epoch: Optional[str] = None, limit: int = 500,
+                session_id: str = Depends(_session_id),
+                manager: AdvancedContextManager = Depends(_project_manager)):
+    """
+    增量变更（同步端点在线程池中执行）：返回序号大于 since 的变更，
+    reset 为真时客户端重新获取完整的树，之后从返回的 revision 继续
+    """
+    return manager.get_changes(since, epoch, max(1, min(limit, 5000)), session_id)
+
+@app.get("/api/changes/stream")
+async def stream_changes(request: Request, since: Optional[int] = None, epoch: Optional[str] = None,
+                         last_event_id: Optional[str] = Header(None),
+                         session_id: str = Depends(_session_id), project_id: str = Depends(_project_id),
+                         manager: AdvancedContextManager = Depends(_project_manager)):
+    """
+    变更订阅（SSE）：有新变更时推送 changes 事件（数据与 GET /api/changes 相同），空闲时定期发送心跳
+    事件ID为 "<epoch>:<revision>"，断线重连时浏览器带上 Last-Event-ID 从断点继续
+    每次轮询重新获取项目分片：订阅期间分片保持加载；分片曾被卸载并重新加载时变更日志的纪元不同，推送 reset
+    """
+    if since is None and last_event_id and ":" in last_event_id:
+        epoch, _, revision = last_event_id.rpartition(":")
+        since = int(revision) if revision.isdigit() else None
+    interval = float(os.getenv("CHANGE_STREAM_INTERVAL", "0.5"))
+    heartbeat = 15.0
+
+    async def event_generator():
+        cursor, cursor_epoch = since, epoch
+        idle = 0.0
+        yield f"retry: {int(interval * 6000)}\n\n"  # 断线后的重连间隔（毫秒）
+        while not await request.is_disconnected():
+            try:
+                shard = await run_in_threadpool(project_registry.get, project_id)
+            except ProjectNotFoundError:
+                break
+            if cursor is not None and cursor_epoch == shard.change_log.epoch \
+                    and shard.change_log.latest_change() == cursor and idle < heartbeat:
+                await asyncio.sleep(interval)
+                idle += interval
+                continue
+            feed = await run_in_threadpool(shard.get_changes, cursor, cursor_epoch, 500, session_id)
+            if cursor is None or feed["reset"] or feed["changes"]:
+                event_type = "hello" if cursor is None else "changes"
+                yield (f"event: {event_type}\nid: {feed['epoch']}:{feed['revision']}\n"
+                       f"data: {json_codec.dumps(feed)}\n\n")
+            elif idle >= heartbeat:
+                yield ": ping\n\n"
+            cursor, cursor_epoch, idle = feed["revision"], feed["epoch"], 0.0
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
 @app.get("/api/contexts/root")
-async def get_root_contexts():
+async def get_root_contexts(session_id: str = Depends(_session_id),
+                            manager: AdvancedContextManager = Depends(_project_manager)):
     """获取根节点上下文（没有父节点的上下文）"""
     try:
-        root_contexts = advanced_context_manager.list_contexts(parent_id="")
+        root_contexts = manager.list_contexts(parent_id="", session_id=session_id)
         return {
             "success": True,
             "contexts": root_contexts,
@@ -270,10 +534,11 @@ async def get_root_contexts():
         raise HTTPException(status_code=500, detail=f"获取根节点上下文失败: {str(e)}")
 
 @app.get("/api/context/{context_id}/children")
-async def get_context_children(context_id: str):
+async def get_context_children(context_id: str, session_id: str = Depends(_session_id),
+                               manager: AdvancedContextManager = Depends(_project_manager)):
     """获取指定上下文的子节点"""
     try:
-        children = advanced_context_manager.list_contexts(parent_id=context_id)
+        children = manager.list_contexts(parent_id=context_id, session_id=session_id)
         return {
             "success": True,
             "children": children,
@@ -282,11 +547,30 @@ async def get_context_children(context_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取子节点失败: {str(e)}")
 
+@app.get("/api/context/{context_id}/context-info")
+def get_context_info(context_id: str, manager: AdvancedContextManager = Depends(_project_manager)):
+    """获取节点生成时引用的上下文全文（节点文件只保存引用，同步端点在线程池中读取blob）"""
+    try:
+        context_info = manager.resolve_context_info(context_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"context_id": context_id, "context_info": context_info, "count": len(context_info)}
+
+# blob清理的最短宽限期（秒）：其他worker写入的blob与引用它的上下文文件之间可能有短暂间隔
+MIN_GC_GRACE_SECONDS = 60
+
+@app.post("/api/maintenance/gc")
+def collect_blob_garbage(grace_seconds: float = 3600.0, manager: AdvancedContextManager = Depends(_project_manager)):
+    """清理当前项目中不再被引用的正文与引用内容（同步端点在线程池中扫描文件）"""
+    if grace_seconds < MIN_GC_GRACE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"grace_seconds 不能小于 {MIN_GC_GRACE_SECONDS}")
+    return {"success": True, **manager.collect_garbage(grace_seconds)}
+
 @app.get("/api/context/{context_id}/path")
-async def get_context_path(context_id: str):
+async def get_context_path(context_id: str, manager: AdvancedContextManager = Depends(_project_manager)):
     """获取上下文路径（从根节点到当前节点）"""
     try:
-        path = advanced_context_manager.get_context_path(context_id)
+        path = manager.get_context_path(context_id)
         return {
             "success": True,
             "path": path,
@@ -315,8 +599,8 @@ def _parse_ai_json_nodes(ai_content: str, parent_id: Optional[str]) -> List[Dict
         content = "\n".join(lines).strip()
     
     try:
-        parsed = json.loads(content)
-    except json.JSONDecodeError:
+        parsed = json_codec.loads(content)
+    except json_codec.JSONDecodeError:
         return None  # 返回None表示解析失败，需要走原逻辑
     
     if not isinstance(parsed, list):
@@ -340,179 +624,451 @@ def _parse_ai_json_nodes(ai_content: str, parent_id: Optional[str]) -> List[Dict
     return nodes
 
 
-@app.post("/api/context/create")
-async def create_context(request: CreateContextRequest):
-    """创建新上下文（支持树状结构）并调用大模型生成初始内容，AI自动判断生成一个或多个节点"""
-    try:
-        context_type = resolve_context_type(request.type)
-        context_info = request.context_info or request.contextInfo
-        
-        # 去重处理
-        deduplicated_info = deduplicate_context_info(context_info) if context_info else context_info
-        
-        # 格式化上下文信息
-        context_info_str = "无"
-        if deduplicated_info:
-            items = []
-            for ctx in deduplicated_info:
-                ctx_content = ctx.get('content', '')
-                preview = ctx_content[:100] + "..." if len(ctx_content) > 100 else ctx_content
-                items.append(f"ID: {ctx.get('id', '未知ID')}, 类型: {ctx.get('type', '未知类型')}, 内容预览: {preview}")
-            context_info_str = "\n".join(items)
-        
-        user_message = f"""
-            名称：{request.name}
+def _format_context_info(context_info: Optional[List[Dict[str, Any]]]) -> str:
+    """去重并格式化请求中的上下文信息（批量生成时对所有兄弟节点只做一次）"""
+    deduplicated_info = deduplicate_context_info(context_info) if context_info else context_info
+    if not deduplicated_info:
+        return "无"
+    items = []
+    for ctx in deduplicated_info:
+        ctx_content = ctx.get('content', '')
+        preview = ctx_content[:100] + "..." if len(ctx_content) > 100 else ctx_content
+        items.append(f"ID: {ctx.get('id', '未知ID')}, 类型: {ctx.get('type', '未知类型')}, 内容预览: {preview}")
+    return "\n".join(items)
+
+
+def _build_user_message(name: Optional[str], context_type: ContextType, parent_id: Optional[str],
+                        context_info_str: str, content: Any) -> str:
+    """构建节点生成的用户消息"""
+    return f"""
+            名称：{name}
             类型：{context_type}
-            父节点ID：{request.parent_id if request.parent_id is not None else ''}
+            父节点ID：{parent_id if parent_id is not None else ''}
             上下文信息：{context_info_str}
-            内容: {request.content if request.content else '（无初始内容）'}
+            内容: {content if content else '（无初始内容）'}
         """
-        
-        # 存储请求中的parent_id，供后续创建节点使用
+
+
+def _build_agent_service(user_message: str) -> AgentService:
+    """按需加载工具：只有用户输入包含番茄链接时才带novel_tool"""
+    if novel_tool and 'fanqienovel.com/page/' in user_message:
+        from prompt import get_system_prompt_with_tool
+        return AgentService(llm, get_system_prompt_with_tool(), tools=[novel_tool])
+    return AgentService(llm, system_prompt, tools=[])
+
+
+async def _create_nodes_from_ai_content(ai_content: str, name: Optional[str], context_type: ContextType,
+                                        parent_id: Optional[str], session_id: str = DEFAULT_SESSION,
+                                        project_id: str = DEFAULT_PROJECT) -> List[Dict]:
+    """解析AI返回内容并创建节点，解析失败时按原逻辑创建单个节点"""
+    # 流式生成可能持续较久，创建节点时再获取项目分片（期间分片可能已被卸载）
+    manager = await run_in_threadpool(project_registry.get, project_id)
+    with tracer.start_as_current_span("nodes.parse", {"content.length": len(ai_content)}) as span:
+        nodes = _parse_ai_json_nodes(ai_content, parent_id)
+        span.set_attribute("nodes.count", len(nodes or []))
+    with tracer.start_as_current_span("nodes.create", {"nodes.count": len(nodes or []) or 1}):
+        if nodes:
+            # 成功解析为节点列表，批量创建
+            created_ids = []
+            for node in nodes:
+                node_type = resolve_context_type(node["type"])
+                node_id = await manager.acreate_context(
+                    name=node["name"],
+                    context_type=node_type,
+                    content=node["content"],
+                    parent_id=node["parent_id"],
+                    session_id=session_id
+                )
+                created_ids.append({"id": node_id, "name": node["name"], "type": node["type"]})
+            return created_ids
+
+        node_id = await manager.acreate_context(
+            name=name or "新节点",
+            context_type=context_type,
+            content=ai_content,
+            parent_id=parent_id,
+            session_id=session_id
+        )
+        return [{"id": node_id, "name": name or "新节点", "type": context_type.value}]
+
+
+@app.post("/api/context/create")
+async def create_context(request: CreateContextRequest, session_id: str = Depends(_session_id),
+                         manager: AdvancedContextManager = Depends(_project_manager)):
+    """创建新上下文（支持树状结构）并调用大模型生成初始内容，AI自动判断生成一个或多个节点"""
+    try:
+        with tracer.start_as_current_span("prompt.format") as span:
+            context_type = resolve_context_type(request.type)
+            context_info_str = _format_context_info(request.context_info or request.contextInfo)
+            user_message = _build_user_message(
+                request.name, context_type, request.parent_id, context_info_str, request.content
+            )
+            span.set_attribute("prompt.length", len(user_message))
+
+        # 存储请求中的parent_id与项目，供后续创建节点使用
         request_parent_id = request.parent_id
-        
+        project_id = manager.project_id or DEFAULT_PROJECT
+
         async def event_generator():
-            # 按需加载工具：只有用户输入包含番茄链接时才带novel_tool
-            needs_tool = novel_tool and 'fanqienovel.com/page/' in user_message
-            if needs_tool:
-                from prompt import get_system_prompt_with_tool
-                agent_service = AgentService(llm, get_system_prompt_with_tool(), tools=[novel_tool])
-            else:
-                agent_service = AgentService(llm, system_prompt, tools=[])
+            with tracer.start_as_current_span("agent.compile"):
+                agent_service = _build_agent_service(user_message)
             accumulated_ai_content = ""
-            nodes_created = False
-            
+
             async for event_str in agent_service.stream(user_message):
                 yield event_str + "\n"
-                
-                # 累积AI消息内容
+
+                # 累积AI消息内容（只解析AI消息事件）
+                if '"ai_message"' not in event_str:
+                    continue
                 try:
-                    event_data = json.loads(event_str)
+                    event_data = json_codec.loads(event_str)
                     if event_data.get("type") == "ai_message":
                         accumulated_ai_content += event_data.get("content", "")
-                except (json.JSONDecodeError, TypeError):
+                except (json_codec.JSONDecodeError, TypeError):
                     pass
-            
+
             # 流式结束后，尝试解析AI返回的JSON并创建节点
             if accumulated_ai_content.strip():
-                nodes = _parse_ai_json_nodes(accumulated_ai_content, request_parent_id)
-                
-                if nodes is not None and len(nodes) > 0:
-                    # 成功解析为节点列表，批量创建
-                    created_ids = []
-                    for node in nodes:
-                        node_type = resolve_context_type(node["type"])
-                        node_id = advanced_context_manager.create_context(
-                            name=node["name"],
-                            context_type=node_type,
-                            content=node["content"],
-                            parent_id=node["parent_id"]
-                        )
-                        created_ids.append({"id": node_id, "name": node["name"], "type": node["type"]})
-                    
-                    # 发送节点创建结果事件
-                    result_event = json.dumps({
-                        "type": "nodes_created",
-                        "nodes": created_ids,
-                        "count": len(created_ids)
-                    }, ensure_ascii=False)
-                    yield result_event + "\n"
-                    nodes_created = True
-                
-                if not nodes_created:
-                    # 解析失败，按原逻辑创建单个节点
-                    node_id = advanced_context_manager.create_context(
-                        name=request.name or "新节点",
-                        context_type=context_type,
-                        content=accumulated_ai_content,
-                        parent_id=request_parent_id
-                    )
-                    result_event = json.dumps({
-                        "type": "nodes_created",
-                        "nodes": [{"id": node_id, "name": request.name or "新节点", "type": context_type.value}],
-                        "count": 1
-                    }, ensure_ascii=False)
-                    yield result_event + "\n"
-        
+                created_ids = await _create_nodes_from_ai_content(
+                    accumulated_ai_content, request.name, context_type, request_parent_id, session_id, project_id
+                )
+                # 发送节点创建结果事件
+                result_event = json_codec.dumps({
+                    "type": "nodes_created",
+                    "nodes": created_ids,
+                    "count": len(created_ids),
+                    "trace_id": tracing.current_trace_id()
+                })
+                yield result_event + "\n"
+
         return StreamingResponse(event_generator(), media_type="text/event-stream")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建上下文失败: {str(e)}")
 
+
+# ==================== 批量生成API端点 ====================
+
+class BatchChildSpec(BaseModel):
+    """批量生成中的单个子节点规格"""
+    name: Optional[str] = None
+    type: Optional[str] = None
+    content: Optional[Any] = None
+    parent_id: Optional[str] = None  # 为空时使用请求中的parent_id
+
+class BatchCreateRequest(BaseModel):
+    """批量生成请求：children与expand_leaves至少提供一个"""
+    parent_id: Optional[str] = None
+    type: Optional[str] = None
+    children: Optional[List[BatchChildSpec]] = None
+    expand_leaves: bool = False  # 为parent_id子树下的每个叶子节点生成子节点
+    context_info: Optional[List[Dict[str, Any]]] = None
+    concurrency: Optional[int] = None
+    rate_limit: Optional[float] = None  # 每秒最多发起的模型调用数
+
+
+def _collect_leaf_specs(manager: AdvancedContextManager, root_id: str,
+                        type_str: Optional[str]) -> List[BatchChildSpec]:
+    """收集子树下所有叶子节点，每个叶子生成一个以其为父节点的子节点规格"""
+    specs = []
+    stack = [root_id]
+    while stack:
+        node = manager.get_context(stack.pop())
+        if not node:
+            continue
+        if node.children:
+            stack.extend(reversed(node.children))
+            continue
+        specs.append(BatchChildSpec(
+            name=node.name,
+            type=type_str or node.type.value,
+            content=node.get_all_content(),
+            parent_id=node.id
+        ))
+    return specs
+
+
+class _StartRateLimiter:
+    """限制调用发起速率（相邻两次调用之间保持最小间隔）"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@app.post("/api/context/batch-create")
+async def batch_create_contexts(request: BatchCreateRequest, session_id: str = Depends(_session_id),
+                                manager: AdvancedContextManager = Depends(_project_manager)):
+    """批量生成兄弟节点：并发调用大模型，按子节点流式返回进度"""
+    specs = list(request.children or [])
+    if request.expand_leaves:
+        if not request.parent_id or not manager.get_context(request.parent_id):
+            raise HTTPException(status_code=404, detail=f"上下文不存在: {request.parent_id}")
+        specs.extend(_collect_leaf_specs(manager, request.parent_id, request.type))
+    if not specs:
+        raise HTTPException(status_code=400, detail="未提供需要生成的子节点")
+
+    generation_config = getattr(config, "novel_generation", None)
+    concurrency = request.concurrency or getattr(generation_config, "batch_concurrency", 4)
+    rate_limit = request.rate_limit if request.rate_limit is not None else getattr(generation_config, "batch_rate_limit", 0)
+
+    # 共享上下文只组装一次，Agent按是否需要工具各编译一次
+    context_info_str = _format_context_info(request.context_info)
+    agent_services: Dict[bool, AgentService] = {}
+
+    def get_agent_service(user_message: str) -> AgentService:
+        needs_tool = bool(novel_tool) and 'fanqienovel.com/page/' in user_message
+        if needs_tool not in agent_services:
+            agent_services[needs_tool] = _build_agent_service(user_message)
+        return agent_services[needs_tool]
+
+    project_id = manager.project_id or DEFAULT_PROJECT
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    limiter = _StartRateLimiter(rate_limit)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_child(index: int, spec: BatchChildSpec):
+        parent_id = spec.parent_id or request.parent_id
+        context_type = resolve_context_type(spec.type or request.type)
+        user_message = _build_user_message(spec.name, context_type, parent_id, context_info_str, spec.content)
+        with tracer.start_as_current_span("batch.child", {"batch.index": index}) as span:
+            try:
+                async with semaphore:
+                    await limiter.wait()
+                    await queue.put({"type": "child_start", "index": index, "name": spec.name, "parent_id": parent_id})
+                    accumulated_ai_content = ""
+                    async for event_str in get_agent_service(user_message).stream(user_message):
+                        try:
+                            event_data = json_codec.loads(event_str)
+                        except (json_codec.JSONDecodeError, TypeError):
+                            continue
+                        if event_data.get("type") == "ai_message":
+                            accumulated_ai_content += event_data.get("content", "")
+                        await queue.put({"type": "child_event", "index": index, "event": event_data})
+
+                if not accumulated_ai_content.strip():
+                    await queue.put({"type": "child_error", "index": index, "error": "模型未返回内容"})
+                    return
+                created_ids = await _create_nodes_from_ai_content(accumulated_ai_content, spec.name, context_type,
+                                                                  parent_id, session_id, project_id)
+                await queue.put({"type": "child_done", "index": index, "nodes": created_ids, "count": len(created_ids)})
+            except Exception as e:
+                span.record_exception(e)
+                span.set_status(tracing.ERROR, str(e)[:200])
+                await queue.put({"type": "child_error", "index": index, "error": str(e)})
+
+    async def event_generator():
+        start = asyncio.get_running_loop().time()
+        yield json_codec.dumps({"type": "batch_start", "total": len(specs), "concurrency": concurrency}) + "\n"
+        tasks = [asyncio.create_task(run_child(i, spec)) for i, spec in enumerate(specs)]
+        finished = failed = 0
+        try:
+            while finished < len(tasks):
+                event = await queue.get()
+                if event["type"] in ("child_done", "child_error"):
+                    finished += 1
+                    failed += event["type"] == "child_error"
+                yield json_codec.dumps(event) + "\n"
+        finally:
+            # 客户端断开时取消尚未完成的调用
+            for task in tasks:
+                task.cancel()
+        yield json_codec.dumps({
+            "type": "batch_complete",
+            "total": len(specs),
+            "succeeded": finished - failed,
+            "failed": failed,
+            "elapsed": round(asyncio.get_running_loop().time() - start, 3),
+            "trace_id": tracing.current_trace_id()
+        }) + "\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 class UpdateContextRequest(BaseModel):
     name: Optional[str] = None
     type: Optional[str] = None
     content: Optional[Any] = None
     metadata: Optional[Dict] = None
+    revision: Optional[int] = None  # 客户端读取时的版本号，提供时做乐观并发检查
 
 @app.put("/api/context/{context_id}")
-async def update_context(context_id: str, request: UpdateContextRequest):
-    """更新上下文"""
+async def update_context(context_id: str, request: UpdateContextRequest,
+                         manager: AdvancedContextManager = Depends(_project_manager)):
+    """更新上下文（提供revision且上下文已被其他请求修改时返回409）"""
     try:
-        context = advanced_context_manager.get_context(context_id)
-        if not context:
+        if not manager.get_context(context_id):
             raise HTTPException(status_code=404, detail=f"上下文不存在: {context_id}")
         
-        # 更新名称
-        if request.name is not None:
-            context.name = request.name
-        
-        # 更新类型
-        if request.type is not None:
-            context_type_enum = resolve_context_type(request.type)
-            if context_type_enum:
-                context.type = context_type_enum
-        
-        # 更新内容
-        if request.content is not None:
-            context.update(request.content, request.metadata)
-        elif request.metadata is not None:
-            # 只更新元数据
-            context.metadata.update(request.metadata)
-            context.updated_at = datetime.now().isoformat()
-        
-        # 保存更新
-        advanced_context_manager._save_context(context)
+        context = await manager.apatch_context(
+            context_id,
+            name=request.name,
+            context_type=resolve_context_type(request.type) if request.type is not None else None,
+            content=request.content,
+            metadata=request.metadata,
+            expected_revision=request.revision
+        )
         
         return {
             "success": True,
             "context_id": context_id,
+            "revision": context.revision,
             "message": f"上下文 '{context.name}' 更新成功"
         }
+    except HTTPException:
+        raise
+    except ContextConflictError as e:
+        raise _conflict(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新上下文失败: {str(e)}")
 
 @app.delete("/api/context/{context_id}")
-async def delete_context(context_id: str):
-    """删除上下文"""
+async def delete_context(context_id: str, revision: Optional[int] = None,
+                         manager: AdvancedContextManager = Depends(_project_manager)):
+    """删除上下文（提供revision且上下文已被修改时返回409）"""
     try:
-        if not advanced_context_manager.delete_context(context_id):
+        if not await manager.adelete_context(context_id, expected_revision=revision):
             raise HTTPException(status_code=404, detail=f"上下文不存在: {context_id}")
         return {"success": True, "message": "上下文删除成功"}
     except HTTPException:
         raise
+    except ContextConflictError as e:
+        raise _conflict(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除上下文失败: {str(e)}")
 
 class MoveContextRequest(BaseModel):
     new_parent_id: Optional[str] = None
+    revision: Optional[int] = None  # 被移动上下文的版本号
 
 @app.post("/api/context/{context_id}/move")
-async def move_context(context_id: str, request: MoveContextRequest):
-    """移动上下文到新的父节点"""
+async def move_context(context_id: str, request: MoveContextRequest,
+                       manager: AdvancedContextManager = Depends(_project_manager)):
+    """移动上下文到新的父节点（提供revision且上下文已被修改时返回409）"""
     try:
-        success = advanced_context_manager.move_context(context_id, request.new_parent_id)
+        success = await manager.amove_context(
+            context_id, request.new_parent_id, expected_revision=request.revision
+        )
         if success:
+            moved = manager.get_context(context_id)
+            if moved is None:
+                # 等待落盘期间被并发删除
+                raise HTTPException(status_code=404, detail=f"上下文不存在: {context_id}")
             return {
                 "success": True,
+                "revision": moved.revision,
                 "message": f"上下文移动成功"
             }
         else:
             raise HTTPException(status_code=400, detail="移动失败：可能形成循环引用或上下文不存在")
+    except HTTPException:
+        raise
+    except ContextConflictError as e:
+        raise _conflict(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"移动上下文失败: {str(e)}")
 
+# 单次批量请求最多包含的操作数
+MAX_BATCH_OPERATIONS = 1000
+
+class BatchOperation(BaseModel):
+    """批量请求中的单个操作（各操作使用的字段见 AdvancedContextManager.apply_batch）"""
+    op: Literal["create", "update", "move", "delete", "select"]
+    ref: Optional[str] = None  # create：之后的操作可用 "$ref" 引用新上下文的ID
+    context_id: Optional[str] = None
+    name: Optional[str] = None
+    type: Optional[str] = None
+    content: Optional[Any] = None
+    metadata: Optional[Dict[str, Any]] = None
+    parent_id: Optional[str] = None
+    revision: Optional[int] = None
+    recursive: bool = False  # delete：同时删除子孙节点
+    selected: bool = True  # select：选中或取消选中
+    select: bool = False  # create：在会话中选中新上下文
+
+class ContextBatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+@app.post("/api/contexts/batch")
+async def apply_context_batch(request: ContextBatchRequest, session_id: str = Depends(_session_id),
+                              manager: AdvancedContextManager = Depends(_project_manager)):
+    """
+    原子地执行一组上下文操作（创建/更新/移动/删除/选中），全部完成后统一落盘一次
+    任一操作无效时整批回滚并返回400（detail.index 为失败操作的序号），版本冲突返回409
+    """
+    if not request.operations:
+        raise HTTPException(status_code=400, detail="未提供操作")
+    if len(request.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {MAX_BATCH_OPERATIONS} 个操作")
+    operations = [{
+        "op": operation.op,
+        "ref": operation.ref,
+        "context_id": operation.context_id,
+        "name": operation.name,
+        "type": resolve_context_type(operation.type) if operation.type is not None else None,
+        "content": operation.content,
+        "metadata": operation.metadata,
+        "parent_id": operation.parent_id,
+        "revision": operation.revision,
+        "recursive": operation.recursive,
+        "selected": operation.selected,
+        "select": operation.select
+    } for operation in request.operations]
+    try:
+        results = await manager.aapply_batch(operations, session_id)
+        return {
+            "success": True,
+            "results": results,
+            "count": len(results),
+            "change_revision": manager.change_log.latest_change()
+        }
+    except BatchOperationError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "index": e.index})
+    except ContextConflictError as e:
+        raise _conflict(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量操作失败: {str(e)}")
+
+# ==================== 小说抓取API端点 ====================
+
+class CrawlNovelRequest(BaseModel):
+    """整本抓取请求"""
+    url: str
+    max_chapters: Optional[int] = None
+    concurrency: int = 4
+    include_locked: bool = False
+
+@app.post("/api/novel/crawl")
+async def crawl_novel(request: CrawlNovelRequest):
+    """抓取整本小说的免费章节到小说上下文（流式返回进度，可断点续抓）"""
+    if FanqieCrawler is None:
+        raise HTTPException(status_code=503, detail="小说抓取模块不可用")
+    if "fanqienovel.com/page/" not in request.url:
+        raise HTTPException(status_code=400, detail="无效链接，请提供番茄小说详情页URL")
+
+    crawler = FanqieCrawler(concurrency=request.concurrency)
+
+    async def event_generator():
+        try:
+            async for event in crawler.crawl(request.url, request.max_chapters, request.include_locked):
+                yield json_codec.dumps(event) + "\n"
+        except Exception as e:
+            yield json_codec.dumps({"type": "crawl_error", "error": str(e)}) + "\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 # ==================== AI生成API端点 ====================
 
 class AiGenerateRequest(BaseModel):
@@ -520,6 +1076,8 @@ class AiGenerateRequest(BaseModel):
     prompt: str
     selected_contexts: Optional[List[str]] = None
     parameters: Optional[Dict[str, Any]] = None
+    timeout: Optional[float] = None  # 截止时间（秒），为空时使用AIConfig.timeout
+    hedge: bool = False  # 超过p95延迟仍未返回时发起一次对冲请求
 
 class AiGenerateResponse(BaseModel):
     """AI生成响应"""
@@ -527,16 +1085,66 @@ class AiGenerateResponse(BaseModel):
     content: str
     context_used: Optional[List[str]] = None
     error: Optional[str] = None
+    retry_after: Optional[float] = None
+
+class ClientDisconnected(Exception):
+    """客户端在生成完成前断开连接"""
+
+
+# /api/ai/generate 的延迟统计，用于计算对冲延迟
+_generate_latency = LatencyTracker(window=100)
+_DISCONNECT_POLL_INTERVAL = 1.0
+
+
+async def _invoke_with_deadline(messages, deadline: float, hedge: bool, http_request: Request):
+    """在截止时间内调用LLM：超时或客户端断开时取消上游请求，可选在p95延迟后发起对冲请求"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = [asyncio.create_task(llm.ainvoke(messages))]
+    hedge_at = None
+    if hedge:
+        p95 = _generate_latency.percentile(0.95)
+        hedge_at = start + (p95 if p95 is not None and len(_generate_latency.latencies) >= 5 else deadline / 2)
+    try:
+        while True:
+            now = loop.time()
+            remaining = start + deadline - now
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            wake = min(remaining, _DISCONNECT_POLL_INTERVAL)
+            if hedge_at:
+                wake = min(wake, max(0.0, hedge_at - now))
+            done, _ = await asyncio.wait(tasks, timeout=wake, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    _generate_latency.record_success(loop.time() - start)
+                    return task.result()
+                if not tasks and not hedge_at:
+                    raise task.exception()
+            if await http_request.is_disconnected():
+                raise ClientDisconnected()
+            # 到达对冲时间或首个请求已失败时，发起（唯一一次）对冲请求
+            if hedge_at and (not tasks or loop.time() >= hedge_at):
+                hedge_at = None
+                tasks.append(asyncio.create_task(llm.ainvoke(messages)))
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
 @app.post("/api/ai/generate", response_model=AiGenerateResponse)
-async def generate_ai_content(request: AiGenerateRequest):
+async def generate_ai_content(request: AiGenerateRequest, http_request: Request,
+                              manager: AdvancedContextManager = Depends(_project_manager)):
     """生成AI内容"""
+    ai_config = getattr(config, "ai", None)
+    deadline = request.timeout or getattr(ai_config, "timeout", 30)
     try:
         # 构建上下文内容
         context_content = ""
         if request.selected_contexts:
             for context_id in request.selected_contexts:
-                context = advanced_context_manager.get_context(context_id)
+                context = manager.get_context(context_id)
                 if context:
                     context_content += f"\n\n【上下文ID: {context.id}, 名称: {context.name}, 类型: {context.type}】\n"
                     if isinstance(context.content, list):
@@ -553,7 +1161,7 @@ async def generate_ai_content(request: AiGenerateRequest):
         
         # 调用LLM
         messages = [system_prompt, HumanMessage(content=user_message)] if system_prompt else [HumanMessage(content=user_message)]
-        response = await llm.ainvoke(messages)
+        response = await _invoke_with_deadline(messages, deadline, request.hedge, http_request)
         generated_content = str(getattr(response, 'content', response))
         
         # 清理内容
@@ -561,10 +1169,42 @@ async def generate_ai_content(request: AiGenerateRequest):
             generated_content = generated_content.replace(old, new)
         
         return AiGenerateResponse(success=True, content=generated_content, context_used=request.selected_contexts)
+    except RateLimitedError as e:
+        return AiGenerateResponse(success=False, content="", error=f"AI生成失败: {str(e)}", retry_after=e.retry_after)
+    except asyncio.TimeoutError:
+        return AiGenerateResponse(success=False, content="", error=f"AI生成超时: 超过 {deadline} 秒未返回")
+    except ClientDisconnected:
+        return AiGenerateResponse(success=False, content="", error="AI生成已取消: 客户端断开连接")
     except Exception as e:
         return AiGenerateResponse(success=False, content="", error=f"AI生成失败: {str(e)}")
 
 
+@app.get("/api/llm/limits")
+async def get_llm_limits():
+    """获取模型调用限流器状态（排队深度、并发、等待时间）"""
+    return {"success": True, "governors": get_rate_limit_stats()}
+
+
+@app.get("/api/traces")
+async def get_recent_traces():
+    """内存中最近链路的概况（新的在前）"""
+    return {"success": True, "traces": tracing.recent_traces()}
+
+@app.get("/api/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """一条链路的全部span（按开始时间排序），用于定位生成慢在哪个阶段"""
+    spans = tracing.get_trace(trace_id)
+    if spans is None:
+        raise HTTPException(status_code=404, detail=f"链路不存在或已被淘汰: {trace_id}")
+    return {"success": True, "trace_id": trace_id, "spans": spans, "count": len(spans)}
+
+@app.get("/api/llm/backends")
+async def get_llm_backends():
+    """获取各模型后端的延迟与错误率统计"""
+    backends = llm.stats() if hasattr(llm, "stats") else []
+    return {"success": True, "routed": bool(backends), "backends": backends}
+
+
 def run_server():
     """运行Web服务器"""
     print(f"🚀 启动AI小说生成器API服务器...")
@@ -572,7 +1212,18 @@ def run_server():
     print(f"🔧 调试模式: {config.server.debug}")
     print(f"📚 已加载上下文: {len(advanced_context_manager.contexts)} 个")
     
-    if config.server.debug:
+    workers = getattr(config.server, "workers", 1)
+    if workers > 1 and not config.server.debug:
+        # 多worker：各进程通过协调库共享上下文存储与选中状态（直接用uvicorn --workers启动时需自行设置该变量）
+        os.environ["CONTEXT_SHARED_STORE"] = "1"
+        print(f"👥 worker进程数: {workers}（共享上下文存储）")
+        uvicorn.run(
+            "web_api:app",
+            host=config.server.host,
+            port=config.server.port,
+            workers=workers
+        )
+    elif config.server.debug:
         # 在调试模式下，使用导入字符串
         uvicorn.run(
             "web_api:app",